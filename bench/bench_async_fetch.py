@@ -0,0 +1,43 @@
+# coding=utf-8
+
+"""
+async_fetch.fetch_manyのスループットが同時接続数に応じて伸びることを確認するベンチマーク
+
+    python -m crawler.bench.bench_async_fetch
+"""
+
+import logging
+from time import perf_counter
+
+from crawler.bench.server import LocalServer
+from crawler.lib.async_fetch import fetch_many
+
+N_URLS = 200
+LATENCY = 0.05
+CONCURRENCIES = (1, 4, 16, 64)
+
+
+def main():
+
+    logger = logging.getLogger("bench")
+    with LocalServer(latency=LATENCY) as base_url:
+        urls = ["{}/article/{}".format(base_url, i) for i in range(N_URLS)]
+        print("concurrency\telapsed[s]\turls/sec")
+        for concurrency in CONCURRENCIES:
+            start = perf_counter()
+            results = fetch_many(
+                    urls,
+                    logger,
+                    1,
+                    max_concurrency=concurrency,
+                    max_per_host=concurrency
+            )
+            elapsed = perf_counter() - start
+            errors = [r for r in results if isinstance(r, Exception)]
+            assert not errors, errors[:3]
+            assert all(status == 200 for _, status in results)
+            print("{}\t{:.2f}\t{:.1f}".format(concurrency, elapsed, N_URLS / elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# coding=utf-8
+
+"""
+charset.detectとレスポンス全体に対するcchardetの速度と正確さを比較するベンチマーク
+
+Shift_JIS / EUC-JP / UTF-8の記事について、Content-Typeヘッダにcharsetがある場合、
+metaタグのみにある場合、どちらにも無い場合のそれぞれで計測する
+
+    python -m crawler.bench.bench_charset
+"""
+
+import random
+import re
+from time import perf_counter
+
+import cchardet
+
+from crawler.bench.corpus import news_page
+from crawler.lib.charset import CharsetDetector
+
+N_PAGES = 300
+CHARSETS = ("shift_jis", "euc-jp", "utf-8")
+META_PAT = re.compile(r"<meta charset=\"[^\"]*\">\n?")
+
+
+def make_cases(hint, seed=0):
+    """ (本文のbytes, Content-Type, url, 元のhtml)のリストを作る
+    """
+
+    rnd = random.Random(seed)
+    cases = []
+    for i in range(N_PAGES):
+        charset = CHARSETS[i % len(CHARSETS)]
+        html = news_page(rnd, site="{}.example.jp".format(charset), paragraphs=rnd.randint(3, 30), charset=charset)
+        content_type = "text/html"
+        if hint == "header":
+            content_type = "text/html; charset={}".format(charset)
+        elif hint == "none":
+            html = META_PAT.sub("", html)
+        cases.append((html.encode(charset), content_type, "https://{}/articles/{}".format(charset, i), html))
+    return cases
+
+
+def legacy(content, content_type, url):
+
+    encoding = cchardet.detect(content)["encoding"]
+    return encoding.lower() if encoding else None
+
+
+def run(detect, cases):
+
+    start = perf_counter()
+    encodings = [detect(content, content_type, url) for content, content_type, url, _ in cases]
+    elapsed = perf_counter() - start
+    correct = 0
+    for encoding, (content, _, _, html) in zip(encodings, cases):
+        try:
+            correct += content.decode(encoding) == html
+        except (UnicodeDecodeError, LookupError, TypeError):
+            pass
+    return elapsed, correct
+
+
+def main():
+
+    print("hint\tmethod\telapsed[ms]\tpages/sec\tcorrect")
+    for hint in ("header", "meta", "none"):
+        cases = make_cases(hint)
+        for name, detect in (("cchardet", legacy), ("charset.detect", CharsetDetector().detect)):
+            elapsed, correct = run(detect, cases)
+            print("{}\t{}\t{:.1f}\t{:.0f}\t{}/{}".format(
+                hint, name, elapsed * 1000, len(cases) / elapsed, correct, len(cases)))
+    detector = CharsetDetector()
+    run(detector.detect, make_cases("none"))
+    print("methods (hint=none):", dict(detector.stats))
+
+
+if __name__ == "__main__":
+    main()
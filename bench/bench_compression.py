@@ -0,0 +1,54 @@
+# coding=utf-8
+
+"""
+Source.htmlの圧縮形式ごとの圧縮率と圧縮・展開のスループットを比較するベンチマーク
+
+    python -m crawler.bench.bench_compression
+"""
+
+from time import perf_counter
+
+from crawler.bench.corpus import make_corpus
+from crawler.lib import compression
+
+
+def codecs(train):
+    """ 比較するコーデックの一覧を返す
+    """
+
+    result = [compression.HtmlCodec(compression.ZLIB)]
+    zdict = compression.train_dictionary(train, compression.ZLIB)
+    result.append(compression.HtmlCodec(compression.ZLIB, dictionary=zdict, dict_name="news"))
+    if compression.zstandard != None:
+        result.append(compression.HtmlCodec(compression.ZSTD))
+        zdict = compression.train_dictionary(train, compression.ZSTD)
+        result.append(compression.HtmlCodec(compression.ZSTD, dictionary=zdict, dict_name="news"))
+    return result
+
+
+def main(n_train=200, n_test=300):
+
+    train = make_corpus(n_train, seed=1)
+    test = make_corpus(n_test, seed=2)
+    raw_bytes = sum(len(html.encode("utf-8")) for html in test)
+
+    print("codec\tratio\tencode[MB/s]\tdecode[MB/s]")
+    for codec in codecs(train):
+        start = perf_counter()
+        blobs = [codec.compress(html) for html in test]
+        encode = perf_counter() - start
+        start = perf_counter()
+        decoded = [codec.decompress(blob) for blob in blobs]
+        decode = perf_counter() - start
+        assert decoded == test
+        compressed_bytes = sum(len(blob) for blob in blobs)
+        print("{}\t{:.2f}\t{:.1f}\t{:.1f}".format(
+            codec.name,
+            float(raw_bytes) / compressed_bytes,
+            raw_bytes / encode / 1e6,
+            raw_bytes / decode / 1e6
+        ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+# coding=utf-8
+
+"""
+WebDriverをページごとに起動する場合とDriverPoolで使い回す場合のコストを比較するベンチマーク
+(phantomjsがPATH上にある必要がある)
+
+    python -m crawler.bench.bench_driver_pool
+"""
+
+from time import perf_counter
+
+from crawler.bench.server import LocalServer
+from crawler.lib.driver_pool import DriverPool, create_phantomjs
+
+N_PAGES = 30
+
+
+def per_call(urls):
+
+    for url in urls:
+        driver = create_phantomjs()
+        driver.get(url)
+        driver.page_source
+        driver.quit()
+
+
+def pooled(urls):
+
+    pool = DriverPool(size=1)
+    for url in urls:
+        with pool.driver() as driver:
+            driver.get(url)
+            driver.page_source
+    pool.shutdown()
+    return pool.stats
+
+
+def main():
+
+    with LocalServer() as base_url:
+        urls = ["{}/article/{}".format(base_url, i) for i in range(N_PAGES)]
+
+        start = perf_counter()
+        per_call(urls)
+        per_call_elapsed = perf_counter() - start
+
+        start = perf_counter()
+        stats = pooled(urls)
+        pooled_elapsed = perf_counter() - start
+
+    print("mode\telapsed[s]\tms/page")
+    print("per-call\t{:.2f}\t{:.1f}".format(per_call_elapsed, per_call_elapsed / N_PAGES * 1000))
+    print("pooled\t{:.2f}\t{:.1f}".format(pooled_elapsed, pooled_elapsed / N_PAGES * 1000))
+    print("pool stats: {}".format(stats))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# coding=utf-8
+
+"""
+utils.Queueの以前の実装(listの先頭をdelで取り出す)とdequeによる実装、Frontierの追加・取り出しの実行時間を比較するベンチマーク
+
+    python -m crawler.bench.bench_frontier
+"""
+
+import os
+import random
+import tempfile
+from time import perf_counter
+
+from crawler.lib.frontier import Frontier
+from crawler.lib.utils import Queue
+
+SIZES = (1000, 10000, 100000)
+HOSTS = 100
+
+
+class LegacyQueue(Queue):
+    """ 以前のutils.Queue(listで保持する)
+    """
+
+    def __init__(self, queue=None, max_size=5):
+
+        self.queue = queue if queue != None else []
+        self.max_size = max_size
+
+    def dequeue(self):
+
+        elem = self.queue[0]
+        del self.queue[0]
+        return elem
+
+
+def targets(n):
+
+    rnd = random.Random(n)
+    return [("http://host{}.example.jp/articles/{}".format(rnd.randrange(HOSTS), i), "title",
+             "2019-{:02d}-{:02d} 00:00:00".format(rnd.randint(1, 12), rnd.randint(1, 28))) for i in range(n)]
+
+
+def run_queue(factory, items):
+
+    queue = factory()
+    for item in items:
+        queue.enqueue(item)
+    for _ in items:
+        queue.dequeue()
+
+
+def run_frontier(path, items):
+
+    frontier = Frontier(path, resume=False)
+    frontier.put_many(items)
+    frontier.put_many(items)  # すべて重複として追加されない
+    entry = frontier.get(block=False)
+    while entry != None:
+        frontier.done(entry.url)
+        entry = frontier.get(block=False)
+    frontier.close()
+
+
+def main():
+
+    print("n\timpl\tsec\tops/sec")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in SIZES:
+            items = targets(n)
+            runs = (
+                ("list Queue", lambda: run_queue(LegacyQueue, items)),
+                ("deque Queue", lambda: run_queue(Queue, items)),
+                ("Frontier(memory)", lambda: run_frontier(":memory:", items)),
+                ("Frontier(file)", lambda: run_frontier(os.path.join(tmp, "frontier.sqlite3"), items))
+            )
+            for name, run in runs:
+                start = perf_counter()
+                run()
+                elapsed = perf_counter() - start
+                print("{}\t{}\t{:.3f}\t{:.0f}".format(n, name, elapsed, n / elapsed))
+
+
+if __name__ == "__main__":
+    main()
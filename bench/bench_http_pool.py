@@ -0,0 +1,56 @@
+# coding=utf-8
+
+"""
+requests.getとSessionPoolのスループットを比較し、keep-aliveによる接続の再利用の効果を確認するベンチマーク
+
+    python -m crawler.bench.bench_http_pool
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+import requests
+
+import crawler.lib.const as GC
+from crawler.bench.server import LocalServer
+from crawler.lib.http_pool import SessionPool
+
+N_URLS = 1000
+THREADS = (1, 8)
+
+
+def run(fetch, urls, threads):
+
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        statuses = list(executor.map(fetch, urls))
+    assert all(status == 200 for status in statuses)
+    return perf_counter() - start
+
+
+def main():
+
+    with LocalServer() as base_url:
+        urls = ["{}/article/{}".format(base_url, i) for i in range(N_URLS)]
+        print("threads\tmethod\telapsed[s]\turls/sec\tconnections")
+        for threads in THREADS:
+            elapsed = run(
+                    lambda url: requests.get(url, headers=GC.HEADERS, timeout=GC.TIMEOUT).status_code,
+                    urls,
+                    threads
+            )
+            print("{}\trequests.get\t{:.2f}\t{:.1f}\t{}".format(threads, elapsed, N_URLS / elapsed, N_URLS))
+
+            pool = SessionPool(pool_maxsize=threads)
+            elapsed = run(
+                    lambda url: pool.get(url, timeout=GC.TIMEOUT).status_code,
+                    urls,
+                    threads
+            )
+            connections = sum(s["connections"] for s in pool.stats().values())
+            pool.close()
+            print("{}\tSessionPool\t{:.2f}\t{:.1f}\t{}".format(threads, elapsed, N_URLS / elapsed, connections))
+
+
+if __name__ == "__main__":
+    main()
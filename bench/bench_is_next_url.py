@@ -0,0 +1,101 @@
+# coding=utf-8
+
+"""
+is_next_urlと、difflib.SequenceMatcherを用いた以前の実装の実行時間を比較するベンチマーク
+
+    python -m crawler.bench.bench_is_next_url
+"""
+
+import random
+from difflib import SequenceMatcher
+from timeit import timeit
+
+import crawler.lib.const as GC
+import crawler.lib.page_navigator as navi
+
+
+def legacy_is_next_url(next_url, item_link):
+    """ 以前のis_next_url(RECALL_THRの参照のみ修正したもの)
+    """
+
+    TAG = 0
+    SEQ1_START = 1
+    SEQ1_END = 2
+
+    def is_anchor(m):
+        opcodes = m.get_opcodes()
+        if opcodes[-1][TAG] == "delete":
+            start = opcodes[-1][SEQ1_START]
+            end = opcodes[-1][SEQ1_END]
+            if opcodes[-1][start:end][:1] == "#":
+                return True
+        return False
+
+    def is_param(m, cand):
+        if cand[:1] == "?":
+            return True
+        opcodes = m.get_opcodes()
+        if opcodes[-1][TAG] == "delete":
+            start = opcodes[-1][SEQ1_START]
+            end = opcodes[-1][SEQ1_END]
+            if opcodes[-1][start:end][:1] == "?":
+                return True
+        return False
+
+    def calc_recall(m, whole_len):
+        matched_len = sum([opcode[SEQ1_END] - opcode[SEQ1_START]
+                for opcode in m.get_opcodes() if opcode[TAG] == "equal"])
+        return float(matched_len) / whole_len
+
+    if next_url == None:
+        return False
+    matcher = SequenceMatcher()
+    matcher.set_seq1(next_url)
+    matcher.set_seq2(item_link)
+    if is_anchor(matcher):
+        return False
+    if is_param(matcher, next_url):
+        return True
+    if calc_recall(matcher, len(next_url)) >= GC.RECALL_THR:
+        return True
+    return False
+
+
+def make_pairs(n, seed=0):
+
+    rnd = random.Random(seed)
+    pairs = []
+    for i in range(n):
+        item = "https://web.archive.org/web/2017120{}000000/http://news{}.example.jp/articles/2017/12/{:06d}.html".format(
+                rnd.randint(1, 9), rnd.randint(1, 20), i)
+        base = item.rsplit(".", 1)[0]
+        pairs.append((rnd.choice([
+                base + "_2.html",
+                "?page=2",
+                "/web/20180101000000/http://news1.example.jp/ranking/",
+                "http://twitter.com/share?url=" + item,
+                "#comments",
+        ]), item))
+    return pairs
+
+
+def main(n=2000, repeat=5):
+
+    pairs = make_pairs(n)
+
+    def run(func):
+        for next_url, item_link in pairs:
+            func(next_url, item_link)
+
+    legacy = timeit(lambda: run(legacy_is_next_url), number=repeat)
+    cold = timeit(lambda: (navi.is_next_url.cache_clear(), run(navi.is_next_url)), number=repeat)
+    warm = timeit(lambda: run(navi.is_next_url), number=repeat)
+    calls = n * repeat
+    print("implementation\tus/call")
+    print("legacy\t{:.2f}".format(legacy / calls * 1e6))
+    print("structural\t{:.2f}".format(cold / calls * 1e6))
+    print("structural(cached)\t{:.2f}".format(warm / calls * 1e6))
+
+
+if __name__ == "__main__":
+    main()
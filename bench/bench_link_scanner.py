@@ -0,0 +1,64 @@
+# coding=utf-8
+
+"""
+scan_linksがsearch_dispurl/search_nexturlと同じ結果を返すことを確認し、実行時間を比較するベンチマーク
+
+    python -m crawler.bench.bench_link_scanner
+"""
+
+import random
+from time import perf_counter
+
+import crawler.lib.page_navigator as navi
+
+ANCHOR_TEXTS = [
+        "次へ", "次のページ", "次ページ", "続きを読む", "全文を表示", "記事全文を表示する",
+        "1", "2", "3", "4", "前へ", "トップ", "関連記事", "#"
+]
+BRACKETS = [("", ""), ("[", "]"), ("【", "】"), ("&lt;", "&gt;"), ("«", "»")]
+HREFS = ["/article/123?page={}", "http://hogehoge.com/a/{}.html", "//hogehoge.com/b_{}", "#top{}", "?p={}"]
+
+
+def make_page(rnd, n_links=200, filler=200):
+    """ ランダムなリンクを含むhtmlを生成する
+    """
+
+    parts = ["<html><body>"]
+    for _ in range(n_links):
+        open_b, close_b = rnd.choice(BRACKETS)
+        href = rnd.choice(HREFS).format(rnd.randint(1, 9))
+        text = rnd.choice(ANCHOR_TEXTS)
+        if rnd.random() < 0.2:
+            text = "<span class=\"x\">{}</span>".format(text)
+        parts.append("<p>{}</p><a class=\"l\" href=\"{}\">{}{}{}</a>".format(
+            "本文" * rnd.randint(0, filler), href, open_b, text, close_b))
+    parts.append("</body></html>")
+    return "".join(parts)
+
+
+def legacy(html, page_cnt):
+
+    return navi.search_dispurl(html), navi.search_nexturl(html, page_cnt)
+
+
+def main(n_docs=300, seed=0):
+
+    rnd = random.Random(seed)
+    corpus = [(make_page(rnd, n_links=rnd.randint(0, 60)), rnd.randint(1, 9)) for _ in range(n_docs)]
+
+    for html, page_cnt in corpus:
+        expected = legacy(html, page_cnt)
+        actual = tuple(navi.scan_links(html, page_cnt))
+        assert expected == actual, (expected, actual)
+    print("{} documents: scan_links matches search_dispurl/search_nexturl".format(n_docs))
+
+    for name, func in (("legacy", legacy), ("scan_links", navi.scan_links)):
+        start = perf_counter()
+        for html, page_cnt in corpus:
+            func(html, page_cnt)
+        elapsed = perf_counter() - start
+        print("{}\t{:.3f}s\t{:.1f} docs/sec".format(name, elapsed, n_docs / elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# coding=utf-8
+
+"""
+MAX_PAGESページの大きな記事を取得する際のメモリ使用量のピークをtracemallocで比較するベンチマーク
+
+    legacy: 以前のnamedtuple(htmlをstrで保持)のリストに全ページを溜めてから保存する
+    compact: ScrapedArticleData(htmlをbytesで保持)のリストに全ページを溜めてから保存する
+    stream: 1ページ取得するごとにWarcArticleSink.add_pageで保存して破棄する
+
+本文の多い(日本語の割合が高い)ページと、scriptやタグの多いページのそれぞれで計測する
+
+    python -m crawler.bench.bench_memory
+"""
+
+import random
+import tempfile
+import tracemalloc
+from collections import namedtuple
+
+from crawler.bench.corpus import news_page
+from crawler.lib.container import ScrapedArticleData
+from crawler.lib.warc import WarcArticleSink, article_records
+import crawler.lib.const as GC
+
+
+class LegacyScrapedArticleData(namedtuple(
+        'LegacyScrapedArticleData',
+        ('origin_url', 'page_url', 'title', 'html', 'page', 'published_at', 'status_code'))):
+    """ 以前のScrapedArticleData(htmlをstrで保持するnamedtuple)
+    """
+
+    def encoded(self, encoding="utf-8"):
+
+        return (self.html or "").encode(encoding)
+
+
+URL = "https://news.example.jp/articles/100000"
+PARAGRAPHS = 100
+SCRIPT_BYTES = 300000  # scriptやタグの多いページに埋め込むインラインscriptの大きさ
+
+
+def fetch(page, markup):
+    """ 記事のpage番目のページを取得する代わりに、htmlを生成してutils.getと同様にstrで返す
+    """
+
+    html = news_page(random.Random(page), site="news.example.jp", paragraphs=PARAGRAPHS, page=page)
+    if markup:
+        script = "<script>var ads = [{}];</script>\n".format(",".join(["{\"slot\": 1}"] * (SCRIPT_BYTES // 12)))
+        html = html.replace("</head>", script + "</head>", 1)
+    return html.encode("utf-8").decode("utf-8")
+
+
+def pages(factory, markup):
+
+    for page in range(1, GC.MAX_PAGES + 1):
+        yield factory(URL, URL + "?page={}".format(page), "title", fetch(page, markup), page, "2019-01-01 00:00:00", 200)
+
+
+def run_legacy(sink, markup):
+
+    atcl_list = list(pages(LegacyScrapedArticleData, markup))
+    # 以前のWarcArticleSink.addと同様に、全ページのレコードを作ってから書き込む
+    sink.writer.write([r for atcl in atcl_list for r in article_records(URL, atcl)])
+
+
+def run_compact(sink, markup):
+
+    sink.add(URL, list(pages(ScrapedArticleData, markup)))
+
+
+def run_stream(sink, markup):
+
+    for atcl in pages(ScrapedArticleData, markup):
+        sink.add_page(URL, atcl)
+    sink.end_target(URL)
+
+
+def measure(run, markup):
+    """ runのメモリ使用量のピーク(bytes)を返す
+    """
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sink = WarcArticleSink(tmp)
+        fetch(1, markup)  # 計測に含めないよう、生成に使うものを先に読み込んでおく
+        tracemalloc.start()
+        run(sink, markup)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        sink.close()
+    return peak
+
+
+def main():
+
+    print("page\tpage size[KB]\tmode\tpeak[MB]\tvs legacy")
+    for markup in (False, True):
+        kind = "markup" if markup else "text"
+        size = len(fetch(1, markup).encode("utf-8")) / 1024.0
+        base = None
+        for name, run in (("legacy", run_legacy), ("compact", run_compact), ("stream", run_stream)):
+            peak = measure(run, markup)
+            base = base or peak
+            print("{}\t{:.0f}\t{}\t{:.2f}\t{:.2f}".format(kind, size, name, peak / float(1 << 20), peak / float(base)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+# coding=utf-8
+
+"""
+ParallelCrawlerのワーカー数に対するスループットの伸びを確認するベンチマーク
+
+1記事ごとに、ネットワークの待ち時間の代わりにsleepし、生成した記事のhtmlに対して
+文字コードの判定とリンクの探索(CPUを使う処理)を行う
+保存はDBの代わりに何もしないsinkで行う(djangoの設定が無い場合はメモリ上のSQLiteで設定する)
+
+    python -m crawler.bench.bench_parallel
+"""
+
+import logging
+import os
+import random
+import tempfile
+from functools import partial
+from time import perf_counter, sleep
+
+import django
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure(
+            INSTALLED_APPS=["internet_archives"],
+            DATABASES={"default": {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"}}
+    )
+    django.setup()
+
+from crawler.bench.corpus import news_page
+from crawler.lib.circuit_breaker import CircuitBreaker
+from crawler.lib.container import ScrapedArticleData
+import crawler.lib.charset as charset
+import crawler.lib.page_navigator as navi
+from internet_archives.lib.parallel import ParallelCrawler
+
+N_TARGETS = 400
+N_HOSTS = 50
+LATENCY = 0.02
+PAGES = 3
+WORKERS = (1, 2, 4, 8)
+
+
+class BenchCrawler:
+    """ scrapeでsleepとCPUを使う処理を行う、InternetArchivesCrawlerの代わり
+    """
+
+    def __init__(self, latency):
+
+        self.latency = latency
+        self.breaker = CircuitBreaker(name="bench")
+        self.rnd = random.Random(os.getpid())
+
+    def scrape(self, url, title, published_at, logger):
+
+        atcl_list = []
+        for page in range(1, PAGES + 1):
+            sleep(self.latency)
+            html = news_page(self.rnd, paragraphs=30, page=page, pagination="counter")
+            content = html.encode("utf-8")
+            text = content.decode(charset.detect(content, url=url))
+            navi.scan_links(text, page + 1)
+            atcl_list.append(ScrapedArticleData(url, url, title, text, page, published_at, 200))
+        return atcl_list
+
+
+class NullSink:
+    """ 何も保存しないsink
+    """
+
+    def __init__(self):
+
+        self.pages = 0
+        self.__callbacks = []
+
+    def add_flush_callback(self, callback):
+
+        self.__callbacks.append(callback)
+
+    def add(self, url, atcl_list):
+
+        self.pages += len(atcl_list)
+
+    def flush(self):
+
+        for callback in self.__callbacks:
+            callback()
+
+    def crawled_urls(self):
+
+        return []
+
+    def report(self, logger):
+        pass
+
+
+def main():
+
+    logger = logging.getLogger("bench")
+    with tempfile.TemporaryDirectory() as tmp:
+        target_file = os.path.join(tmp, "crawling_target")
+        with open(target_file, "w") as f:
+            for i in range(N_TARGETS):
+                f.write("http://host{}.example.jp/articles/{}|||title{}|||2019-01-01 00:00:00\n".format(
+                    i % N_HOSTS, i, i))
+
+        print("workers\telapsed[s]\ttargets/sec\tspeedup")
+        base = None
+        for n_workers in WORKERS:
+            sink = NullSink()
+            crawler = ParallelCrawler(
+                    n_workers=n_workers,
+                    factory=partial(BenchCrawler, LATENCY),
+                    target_file=target_file,
+                    resume=False,
+                    sink=sink
+            )
+            start = perf_counter()
+            crawler.parse(logger)
+            elapsed = perf_counter() - start
+            assert sink.pages == N_TARGETS * PAGES, sink.pages
+            base = base or elapsed
+            print("{}\t{:.2f}\t{:.1f}\t{:.2f}".format(n_workers, elapsed, N_TARGETS / elapsed, base / elapsed))
+
+
+if __name__ == "__main__":
+    main()
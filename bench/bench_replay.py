@@ -0,0 +1,193 @@
+# coding=utf-8
+
+"""
+ia_serverのローカルサーバに対してInternetArchivesCrawler.parseを最後まで実行し、スループットを計測するベンチマーク
+
+Internet Archiveやニュースサイトに接続せずに、キャッシュの確認(seleniumの代わりにstatic-firstモード、またはCDX API)、
+複数ページの記事の取得、保存までを通して計測し、pages/sec、rows/sec、記事・リクエストごとの所要時間の分布を表示する
+保存先はDB(djangoの設定が無い場合はメモリ上のSQLiteにテーブルを作る)、WARC、何もしないsinkから選べる
+
+    python -m crawler.bench.bench_replay --articles 200 --latency 0.01
+    python -m crawler.bench.bench_replay --resolver --sink warc --error-rate 0.02 --timeout-rate 0.01
+"""
+
+import argparse
+import atexit
+import logging
+import os
+import shutil
+import tempfile
+from time import perf_counter
+
+import django
+from django.conf import settings
+
+IN_MEMORY_DB = not settings.configured
+if IN_MEMORY_DB:
+    settings.configure(
+            INSTALLED_APPS=["internet_archives"],
+            DATABASES={"default": {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"}},
+            USE_TZ=False
+    )
+    django.setup()
+
+from django.apps import apps
+from django.db import connection
+
+from crawler.bench.bench_parallel import NullSink
+from crawler.bench.ia_server import Faults, ReplayServer, ReplaySite
+from crawler.bench.suite import percentile
+from crawler.lib.metrics import METRICS
+from crawler.lib.warc import WarcArticleSink
+from internet_archives.lib.cdx import CdxResolver
+from internet_archives.lib.crawler import InternetArchivesCrawler
+
+RECORDS_PER_PAGE = 3  # WARCに書き込む1ページあたりのレコード数(response、request、metadata)
+REPORTED_HISTOGRAMS = ("ia_resolve_seconds", "http_fetch_seconds", "save_seconds", "writer_flush_seconds")
+
+
+class TimedCrawler(InternetArchivesCrawler):
+    """ 記事ごとの所要時間(ページを保存する時間を含む)と取得したページ数を記録するInternetArchivesCrawler
+    """
+
+    def __init__(self, *args, **kwargs):
+
+        super().__init__(*args, **kwargs)
+        self.latencies = []
+        self.pages = 0
+
+    def iter_scrape(self, url, title, published_at, logger):
+
+        start = perf_counter()
+        try:
+            for atcl in super().iter_scrape(url, title, published_at, logger):
+                self.pages += 1
+                yield atcl
+        finally:
+            self.latencies.append(perf_counter() - start)
+
+
+def create_tables():
+    """ メモリ上のSQLiteにinternet_archivesのテーブルを作る
+    """
+
+    with connection.schema_editor() as editor:
+        for model in apps.get_app_config("internet_archives").get_models():
+            editor.create_model(model)
+
+
+def distribution(name, values):
+
+    values = sorted(values)
+    if not values:
+        return "{}\t0".format(name)
+    return "{}\t{}\t{:.1f}\t{:.1f}\t{:.1f}\t{:.1f}\t{:.1f}".format(
+            name, len(values), sum(values) / len(values) * 1e3, percentile(values, 50) * 1e3,
+            percentile(values, 90) * 1e3, percentile(values, 99) * 1e3, values[-1] * 1e3)
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--articles", type=int, default=200, help="crawling_targetの記事数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--missing-rate", type=float, default=0.1, help="キャッシュが無い記事の割合")
+    parser.add_argument("--max-pages", type=int, default=4, help="複数ページの記事の最大ページ数")
+    parser.add_argument("--latency", type=float, default=0.01, help="応答までの遅延(秒)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="遅延に加える指数分布の平均(秒)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="503を返す確率")
+    parser.add_argument("--timeout-rate", type=float, default=0.0, help="応答せずに切断する確率")
+    parser.add_argument("--hang", type=float, default=2.0, help="切断するまでに待つ秒数")
+    parser.add_argument("--resolver", action="store_true", help="CdxResolverでスナップショットを求める")
+    parser.add_argument("--sink", choices=("db", "warc", "null"), default="db", help="保存先")
+    parser.add_argument("--batch-size", type=int, default=100, help="DBにまとめて保存するurlの数")
+    parser.add_argument("--prefetch", action="store_true", help="記事の後続ページを先読みする")
+    parser.add_argument("--verbose", action="store_true", help="クローラのログを表示する")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL)
+    logger = logging.getLogger("bench")
+    if IN_MEMORY_DB and args.sink == "db":
+        create_tables()
+
+    site = ReplaySite(args.articles, args.seed, args.missing_rate, args.max_pages)
+    faults = Faults(args.latency, args.jitter, args.error_rate, args.timeout_rate, args.hang, args.seed)
+    server = ReplayServer(site, faults)
+    # writer等もatexitでcrawling_targetの読み込み位置を保存するため、それらより後に消す
+    tmp = tempfile.mkdtemp()
+    atexit.register(shutil.rmtree, tmp, True)
+    with server as base_url:
+        target_file = os.path.join(tmp, "crawling_target")
+        site.write_targets(target_file)
+        sink = None
+        if args.sink == "warc":
+            sink = WarcArticleSink(os.path.join(tmp, "warc"))
+        elif args.sink == "null":
+            sink = NullSink()
+        resolver = None
+        if args.resolver:
+            resolver = CdxResolver(
+                    endpoint=base_url + "/cdx/search/cdx",
+                    snapshot_prefix=base_url + "/web/",
+                    cache_path=os.path.join(tmp, "cdx.sqlite3")
+            )
+        # seleniumを使わずに済むよう、static-firstモードで取得する(sleep_time=1ではsleepしない)
+        crawler = TimedCrawler(
+                sleep_time=1,
+                static_first=True,
+                batch_size=args.batch_size,
+                target_file=target_file,
+                resume=False,
+                sink=sink,
+                resolver=resolver,
+                ia_prefix=base_url + "/web/*/",
+                prefetch=args.prefetch
+        )
+
+        METRICS.reset()
+        METRICS.enable()
+        start = perf_counter()
+        crawler.parse(logger)
+        elapsed = perf_counter() - start
+        METRICS.disable()
+
+        if args.sink == "db":
+            rows = crawler.writer.stats["rows"]
+        elif args.sink == "warc":
+            rows = sink.stats["pages"] * RECORDS_PER_PAGE
+            sink.close()
+        else:
+            rows = 0
+        if resolver != None:
+            resolver.close()
+
+    print("articles\tpages\texpected\trows\telapsed[s]\tpages/sec\trows/sec")
+    print("{}\t{}\t{}\t{}\t{:.2f}\t{:.1f}\t{:.1f}".format(
+        len(crawler.latencies), crawler.pages, site.expected_pages(), rows, elapsed,
+        crawler.pages / elapsed, rows / elapsed))
+
+    print("\nlatency\tcount\tmean[ms]\tp50[ms]\tp90[ms]\tp99[ms]\tmax[ms]")
+    print(distribution("scrape", crawler.latencies))
+    for kind, values in sorted(server.latencies.items()):
+        print(distribution("server:" + kind, values))
+    histograms = METRICS.snapshot()["histograms"]
+    for name in REPORTED_HISTOGRAMS:
+        hists = [h for h in histograms if h["name"] == name]
+        count = sum(h["count"] for h in hists)
+        if count:
+            print("{}\t{}\t{:.1f}".format(name, count, sum(h["sum"] for h in hists) / count * 1e3))
+
+    if crawler.prefetcher != None:
+        stats = crawler.prefetcher.stats
+        print("\nprefetch\tsubmitted\thits\tmismatched\tunused\twasted\thit rate")
+        print("\t{}\t{}\t{}\t{}\t{}\t{:.1%}".format(
+            stats["submitted"], stats["hits"], stats["mismatched"], stats["unused"], stats["wasted"],
+            crawler.prefetcher.hit_rate()))
+
+    print("\nrequest\tstatus\tcount")
+    for (kind, status), count in sorted(server.counts.items(), key=lambda item: str(item[0])):
+        print("{}\t{}\t{}".format(kind, status, count))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# coding=utf-8
+
+"""
+ベンチマーク用の日本語ニュースサイト風htmlを生成するモジュール
+"""
+
+import random
+
+SITES = ["news.example.jp", "shimbun.example.co.jp", "keizai.example.com", "sports.example.jp"]
+WORDS = [
+        "政府", "経済", "東京", "発表", "記者会見", "首相", "市場", "株価", "円安", "企業",
+        "調査", "結果", "影響", "関係者", "によると", "について", "明らかにした", "見通し",
+        "地震", "台風", "選挙", "野球", "サッカー", "大会", "優勝", "日本代表", "技術", "開発",
+]
+
+HEADER = """<!DOCTYPE html>
+<html lang="ja">
+<head>
+<meta charset="{charset}">
+<title>{title} - {site}</title>
+<link rel="stylesheet" href="https://{site}/static/css/common.css">
+<script src="https://{site}/static/js/analytics.js"></script>
+</head>
+<body>
+<header class="site-header"><a href="https://{site}/">{site}</a>
+<nav><ul>
+<li><a href="https://{site}/politics/">政治</a></li>
+<li><a href="https://{site}/economy/">経済</a></li>
+<li><a href="https://{site}/international/">国際</a></li>
+<li><a href="https://{site}/sports/">スポーツ</a></li>
+<li><a href="https://{site}/ranking/">ランキング</a></li>
+</ul></nav></header>
+<main><article>
+<h1>{title}</h1>
+<time datetime="2017-12-01T09:00:00+09:00">2017年12月1日 9時00分</time>
+"""
+
+FOOTER = """</article>
+<aside class="related"><h2>関連記事</h2><ul>{related}</ul></aside>
+</main>
+<footer><p>Copyright (C) {site} All rights reserved.</p>
+<a href="https://{site}/privacy/">プライバシーポリシー</a></footer>
+</body>
+</html>
+"""
+
+
+def sentence(rnd):
+
+    return "".join(rnd.choice(WORDS) for _ in range(rnd.randint(8, 20))) + "。"
+
+
+def news_page(rnd, site=None, paragraphs=10, charset="utf-8", article_id=None, page=1, pagination=None):
+    """ ニュース記事のhtmlを生成する
+
+    Args:
+        rnd (random.Random): 乱数生成器
+        site (str): サイトのホスト名、Noneの場合はランダム
+        paragraphs (int): 段落の数
+        charset (str): metaタグに記載する文字コード
+        article_id (int): 記事のid、Noneの場合はランダム
+        page (int): ページ番号
+        pagination (str): "next"(次へリンク)、"counter"(ページ番号リンク)、"disp"(続きを読むリンク)、None
+
+    Returns:
+        str: htmlの生テキスト
+    """
+
+    site = site or rnd.choice(SITES)
+    article_id = article_id or rnd.randint(100000, 999999)
+    title = sentence(rnd)[:30]
+    parts = [HEADER.format(charset=charset, site=site, title=title)]
+    for _ in range(paragraphs):
+        parts.append("<p>{}</p>\n".format("".join(sentence(rnd) for _ in range(rnd.randint(2, 5)))))
+    base = "https://{}/articles/{}".format(site, article_id)
+    if pagination == "next":
+        parts.append("<div class=\"pager\"><a href=\"{}?page={}\">次へ</a></div>\n".format(base, page + 1))
+    elif pagination == "counter":
+        links = "".join("<a href=\"{}?page={}\">{}</a> ".format(base, i, i) for i in range(1, page + 3))
+        parts.append("<div class=\"pager\">{}</div>\n".format(links))
+    elif pagination == "disp":
+        parts.append("<p class=\"more\"><a href=\"{}/full\">続きを読む</a></p>\n".format(base))
+    related = "".join(
+            "<li><a href=\"https://{}/articles/{}\">{}</a></li>".format(site, rnd.randint(100000, 999999), sentence(rnd)[:20])
+            for _ in range(5)
+    )
+    parts.append(FOOTER.format(site=site, related=related))
+    return "".join(parts)
+
+
+def make_corpus(n, seed=0, **kwargs):
+    """ news_pageをn件生成する
+    """
+
+    rnd = random.Random(seed)
+    return [news_page(rnd, paragraphs=rnd.randint(3, 30), **kwargs) for _ in range(n)]
@@ -0,0 +1,279 @@
+# coding=utf-8
+
+"""
+Internet Archiveと複数ページのニュース記事を模したローカルHTTPサーバを提供するモジュール
+
+InternetArchivesCrawlerをネットワークに接続せずに最後まで動作させるためのもので、以下のpathに応答する
+    /web/*/<元のurl>            キャッシュがあればdiv#wb-metaにスナップショットへのリンクを、無ければエラーを表示する
+    /web/<timestamp>/<元のurl>  スナップショット(記事のページ)、記事内のリンクは/web/<timestamp>/に書き換える
+    /cdx/search/cdx?url=<元のurl>  CDX APIと同じ形式のJSON
+記事の内容(キャッシュの有無、ページ数、ページ送りの種類)はseedと記事のidから決まるため、何度実行しても同じになる
+遅延、エラー(503)、タイムアウト(応答せずに切断)をリクエストごとに一定の確率で起こせる
+"""
+
+import json
+import random
+import threading
+from collections import Counter, defaultdict
+from http.server import BaseHTTPRequestHandler
+from time import perf_counter, sleep
+from urllib.parse import parse_qs, urlsplit
+
+from crawler.bench.corpus import SITES, news_page
+from crawler.bench.server import LocalServer
+
+STYLES = {"single": 0.25, "next": 0.3, "counter": 0.25, "disp": 0.2}  # ページ送りの種類 -> 割合
+
+LOOKUP_TEMPLATE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Wayback Machine</title></head>
+<body>
+<div id="wm-ipp-base"><a href="/">Wayback Machine</a></div>
+{body}
+</body></html>"""
+WB_META = """<div id="wb-meta"><p class="wbThis"><a href="/web/{timestamp}/{url}">{url}</a> has been crawled
+{captures} times going all the way back to {date}.</p></div>"""
+WB_ERROR = """<div class="error error-border"><h2>Hrm.</h2>
+<p>The Wayback Machine has not archived that URL.</p></div>"""
+TOOLBAR = """<!-- BEGIN WAYBACK TOOLBAR INSERT -->
+<div id="wm-ipp"><a href="/web/{timestamp}/{url}">{timestamp}</a></div>
+<!-- END WAYBACK TOOLBAR INSERT -->
+"""
+
+
+class Article:
+    """ 記事1つ分の設定
+
+    Attributes:
+        url (str): 記事の元のurl
+        archived (bool): Internet Archiveにキャッシュがあるか否か
+        timestamp (str): スナップショットのタイムスタンプ
+        style (str): ページ送りの種類、STYLESのいずれか
+        n_pages (int): ページ数("disp"の場合は全文表示のページを含まない)
+    """
+
+    def __init__(self, seed, article_id, missing_rate, max_pages):
+
+        rnd = random.Random("{}:{}".format(seed, article_id))
+        self.id = article_id
+        self.site = rnd.choice(SITES)
+        self.url = "https://{}/articles/{}".format(self.site, article_id)
+        self.title = "記事{}".format(article_id)
+        self.published_at = "2019-{:02d}-{:02d} {:02d}:00:00".format(
+                rnd.randint(1, 12), rnd.randint(1, 28), rnd.randint(0, 23))
+        self.timestamp = "2019{:02d}{:02d}{:06d}".format(rnd.randint(1, 12), rnd.randint(1, 28), rnd.randint(0, 235959))
+        self.archived = rnd.random() >= missing_rate
+        self.style = rnd.choices(list(STYLES), weights=list(STYLES.values()))[0]
+        self.n_pages = 1 if self.style in ("single", "disp") else rnd.randint(2, max_pages)
+        self.seed = seed
+
+    def expected_pages(self):
+        """ クローラが保存するページ数(キャッシュが無い場合は404の1件)
+        """
+
+        return self.n_pages if self.archived else 1
+
+    def page(self, page, full=False):
+        """ 記事のpage番目のページのhtmlを返す(リンクは元のurlのまま)
+
+        Args:
+            page (int): ページ番号
+            full (bool): 全文表示のページか否か
+        """
+
+        rnd = random.Random("{}:{}:{}:{}".format(self.seed, self.id, page, full))
+        if full:
+            return news_page(rnd, site=self.site, paragraphs=30, article_id=self.id)
+        if self.style == "disp":
+            pagination = "disp"
+        elif self.style in ("next", "counter") and page < self.n_pages:
+            pagination = self.style
+        else:
+            pagination = None
+        return news_page(rnd, site=self.site, paragraphs=10, article_id=self.id, page=page, pagination=pagination)
+
+
+class ReplaySite:
+    """ crawling_targetと、それに対応するInternet Archiveのページ・スナップショットを生成するクラス
+
+    Attributes:
+        articles (dict): 元のurl -> Article
+    """
+
+    def __init__(self, n_articles=200, seed=0, missing_rate=0.1, max_pages=4):
+
+        self.articles = {}
+        for article_id in range(100000, 100000 + n_articles):
+            article = Article(seed, article_id, missing_rate, max_pages)
+            self.articles[article.url] = article
+
+    def write_targets(self, path):
+        """ crawling_targetをpathに書き出す
+        """
+
+        with open(path, "w") as f:
+            for article in self.articles.values():
+                f.write("{}|||{}|||{}\n".format(article.url, article.title, article.published_at))
+
+    def expected_pages(self):
+        """ 全ての記事を取得し終えた際にクローラが保存するページ数
+        """
+
+        return sum(a.expected_pages() for a in self.articles.values())
+
+    def lookup(self, url):
+        """ /web/*/<url>のhtmlを返す
+        """
+
+        article = self.articles.get(url)
+        if article == None or not article.archived:
+            return LOOKUP_TEMPLATE.format(body=WB_ERROR)
+        return LOOKUP_TEMPLATE.format(body=WB_META.format(
+            timestamp=article.timestamp, url=url, captures=3, date=article.published_at[:10]))
+
+    def snapshot(self, timestamp, url):
+        """ /web/<timestamp>/<url>のhtmlを返す
+
+        Internet Archiveと同様に、記事内の絶対urlのリンクを/web/<timestamp>/<url>に書き換える
+
+        Returns:
+            str: htmlの生テキスト、スナップショットが無い場合はNone
+        """
+
+        parts = urlsplit(url)
+        base = "{}://{}{}".format(parts.scheme, parts.netloc, parts.path)
+        full = base.endswith("/full")
+        article = self.articles.get(base[:-len("/full")] if full else base)
+        if article == None or not article.archived:
+            return None
+        page = int(parse_qs(parts.query).get("page", ["1"])[0])
+        if page < 1 or page > article.n_pages or (full and article.style != "disp"):
+            return None
+        html = article.page(page, full).replace('="https://', '="/web/{}/https://'.format(timestamp))
+        return html.replace("<body>", "<body>\n" + TOOLBAR.format(timestamp=timestamp, url=url), 1)
+
+    def cdx(self, url):
+        """ CDX APIの結果(1行目は列名)を返す、キャッシュが無い場合は空のリスト
+        """
+
+        article = self.articles.get(url)
+        if article == None or not article.archived:
+            return []
+        return [["timestamp", "original"], [article.timestamp, url]]
+
+
+class Faults:
+    """ リクエストごとの遅延と障害の起こし方
+
+    Attributes:
+        latency (float): 応答までの遅延(秒)
+        jitter (float): 遅延に加える指数分布の平均(秒)
+        error_rate (float): 503を返す確率
+        timeout_rate (float): hang秒待ってから応答せずに切断する確率
+        hang (float): タイムアウトさせる場合に待つ秒数
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, timeout_rate=0.0, hang=2.0, seed=0):
+
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.hang = hang
+        self.__rnd = random.Random(seed)
+        self.__lock = threading.Lock()
+
+    def draw(self):
+        """ 1つのリクエストの遅延と障害を決める
+
+        Returns:
+            tuple: (遅延の秒数, "error"、"timeout"またはNone)
+        """
+
+        with self.__lock:
+            delay = self.latency + (self.__rnd.expovariate(1.0 / self.jitter) if self.jitter > 0 else 0.0)
+            r = self.__rnd.random()
+        if r < self.timeout_rate:
+            return delay, "timeout"
+        if r < self.timeout_rate + self.error_rate:
+            return delay, "error"
+        return delay, None
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    """ ReplaySiteのページを返すハンドラ
+    """
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+
+        start = perf_counter()
+        server = self.server
+        kind, status, body = self.__route()
+        delay, fault = server.faults.draw()
+        sleep(delay)
+        if fault == "timeout":
+            sleep(server.faults.hang)
+            self.close_connection = True
+            server.record(kind, "timeout", perf_counter() - start)
+            return
+        if fault == "error":
+            status, body = 503, "<html><body>Service Unavailable</body></html>"
+        content = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json" if kind == "cdx" else "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+        server.record(kind, status, perf_counter() - start)
+
+    def __route(self):
+        """ pathに対応する(種類, ステータスコード, 本文)を返す
+        """
+
+        site = self.server.site
+        if self.path.startswith("/cdx/search/cdx"):
+            url = parse_qs(urlsplit(self.path).query).get("url", [""])[0]
+            rows = site.cdx(url)
+            return "cdx", 200, json.dumps(rows) if rows else ""
+        if self.path.startswith("/web/*/"):
+            return "lookup", 200, site.lookup(self.path[len("/web/*/"):])
+        if self.path.startswith("/web/"):
+            timestamp, _, url = self.path[len("/web/"):].partition("/")
+            html = site.snapshot(timestamp, url)
+            if html == None:
+                return "snapshot", 404, "<html><body>Not Found</body></html>"
+            return "snapshot", 200, html
+        return "other", 404, "<html><body>Not Found</body></html>"
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ReplayServer(LocalServer):
+    """ ReplaySiteを配信するローカルHTTPサーバ
+
+    with ReplayServer(ReplaySite(), Faults(latency=0.01)) as base_url:
+        ...
+
+    Attributes:
+        latencies (dict): 種類("lookup"、"snapshot"、"cdx") -> サーバ側の応答時間(秒)のリスト
+        counts (Counter): (種類, ステータスコードまたは"timeout") -> リクエスト数
+    """
+
+    def __init__(self, site, faults=None, host="127.0.0.1", port=0):
+
+        super().__init__(handler=ReplayHandler, host=host, port=port)
+        self.httpd.site = site
+        self.httpd.faults = faults or Faults()
+        self.httpd.record = self.__record
+        self.latencies = defaultdict(list)
+        self.counts = Counter()
+        self.__lock = threading.Lock()
+
+    def __record(self, kind, status, elapsed):
+
+        with self.__lock:
+            self.latencies[kind].append(elapsed)
+            self.counts[(kind, status)] += 1
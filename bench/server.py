@@ -0,0 +1,121 @@
+# coding=utf-8
+
+"""
+ベンチマーク用のローカルHTTPサーバを提供するモジュール
+"""
+
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep
+
+PAGE_TEMPLATE = """<html><head><meta charset="utf-8"><title>{title}</title></head>
+<body><h1>{title}</h1><p>{body}</p></body></html>"""
+
+
+class BenchHandler(BaseHTTPRequestHandler):
+    """ pathに関わらず、一定の遅延の後にhtmlを返すハンドラ
+
+    処理中のリクエスト数の最大値を、全体とHostヘッダごとにサーバに記録する
+    """
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # keep-aliveの接続でヘッダと本文を分けて送っても遅延しないように
+
+    def do_GET(self):
+
+        with self.server.track(self.headers.get("Host")):
+            self.respond()
+
+    def respond(self):
+
+        sleep(self.server.latency)
+        body = PAGE_TEMPLATE.format(title=self.path, body="本文" * 100).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TrackingServer(ThreadingHTTPServer):
+    """ 処理中のリクエスト数と、その最大値を記録するThreadingHTTPServer
+
+    Attributes:
+        peak (int): 全体で同時に処理したリクエスト数の最大値
+        host_peaks (Counter): Hostヘッダ -> 同時に処理したリクエスト数の最大値
+        requests (int): 受け付けたリクエストの数
+        connections (int): 受け付けた接続の数
+    """
+
+    daemon_threads = True
+    request_queue_size = 256  # 同時に多数の接続を受けてもlistenのキューがあふれないように
+
+    def __init__(self, *args, **kwargs):
+
+        super().__init__(*args, **kwargs)
+        self.latency = 0.0
+        self.peak = 0
+        self.host_peaks = Counter()
+        self.requests = 0
+        self.connections = 0
+        self.__active = Counter()
+        self.__lock = threading.Lock()
+
+    def process_request(self, request, client_address):
+
+        with self.__lock:
+            self.connections += 1
+        super().process_request(request, client_address)
+
+    @contextmanager
+    def track(self, host):
+        """ with文の中をhostへのリクエストの処理中として数える
+        """
+
+        with self.__lock:
+            self.requests += 1
+            self.__active[None] += 1
+            self.__active[host] += 1
+            self.peak = max(self.peak, self.__active[None])
+            self.host_peaks[host] = max(self.host_peaks[host], self.__active[host])
+        try:
+            yield
+        finally:
+            with self.__lock:
+                self.__active[None] -= 1
+                self.__active[host] -= 1
+
+
+class LocalServer:
+    """ 別スレッドで動作するローカルHTTPサーバ
+
+    with LocalServer(latency=0.1) as base_url:
+        ...
+    """
+
+    def __init__(self, latency=0.0, handler=BenchHandler, host="127.0.0.1", port=0):
+
+        self.httpd = TrackingServer((host, port), handler)
+        self.httpd.latency = latency
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+
+        host, port = self.httpd.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    def __enter__(self):
+
+        self.thread.start()
+        return self.base_url
+
+    def __exit__(self, *exc):
+
+        self.httpd.shutdown()
+        self.httpd.server_close()
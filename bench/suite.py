@@ -0,0 +1,294 @@
+# coding=utf-8
+
+"""
+ページごとに実行される関数(page_navigator、utils、文字コードの判定)のベンチマークスイート
+
+生成した記事(大きさ、文字コード、ページ送りの種類を変えたもの)、bench/recordedに保存したhtml、
+LINK_PATのバックトラックが多くなる入力に対して、ops/secと1回あたりの所要時間のパーセンタイルを計測する
+結果はbench/baselines/<name>.jsonに保存でき、保存したものとの比較を表示する
+
+    python -m crawler.bench.suite                      # 計測してbaselines/default.jsonと比較する
+    python -m crawler.bench.suite --save default       # 計測結果をbaselines/default.jsonに保存する
+    python -m crawler.bench.suite --filter search_     # 名前にsearch_を含むものだけ計測する
+    python -m crawler.bench.suite --record urls.txt    # urls.txtのurlのhtmlをbench/recordedに保存する
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+from glob import glob
+from time import perf_counter
+
+from crawler.bench.bench_is_next_url import make_pairs
+from crawler.bench.corpus import news_page
+import crawler.lib.charset as charset
+import crawler.lib.page_navigator as navi
+import crawler.lib.utils as utils
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_DIR = os.path.join(BENCH_DIR, "baselines")
+RECORDED_DIR = os.path.join(BENCH_DIR, "recorded")
+SEED = 0
+SIZES = {"small": 3, "medium": 30, "large": 300}  # 段落の数
+PAGINATIONS = (None, "next", "counter", "disp")
+ENCODINGS = ("utf-8", "shift_jis", "euc-jp")
+SAMPLE_SECONDS = 0.0005  # 1サンプルの最小の計測時間(これに達するまで同じ処理を繰り返す)
+CASE_SECONDS = 0.5  # 1ケースの計測時間
+MAX_SAMPLES = 2000
+REGRESSION_RATIO = 1.25  # baselineよりこの倍率以上遅い場合に警告する
+
+
+def synthetic_pages(seed=SEED):
+    """ 大きさとページ送りの種類ごとに生成したhtmlを返す
+
+    Returns:
+        dict: "<size>/<pagination>" -> html
+    """
+
+    rnd = random.Random(seed)
+    pages = {}
+    for size, paragraphs in SIZES.items():
+        for pagination in PAGINATIONS:
+            pages["{}/{}".format(size, pagination or "none")] = news_page(
+                    rnd, site="news.example.jp", paragraphs=paragraphs, page=1, pagination=pagination
+            )
+    return pages
+
+
+def pathological_pages(n=2000):
+    """ LINK_PATのバックトラックが多くなるhtmlを返す
+
+    Returns:
+        dict: 名前 -> html
+    """
+
+    return {
+            # 閉じる引用符の無いhref: URL_PATの繰り返しを全ての位置からやり直す
+            "unclosed_href": "".join('<a href="/{} \n'.format("a" * 200) for _ in range(n // 10)),
+            # 1つのタグに大量のhref=: [^>]*?が各href=で照合を試みる
+            "many_hrefs": "<a " + " ".join('href="/p{}"'.format(i) for i in range(n)) + "><p>本文</p>",
+            # アンカテキストが長くマッチしない
+            "long_atext": "".join('<a href="/p{}">{}</a>\n'.format(i, "次" * 100 + "記事") for i in range(n // 10)),
+            # クエリの長いurlで閉じる引用符が無い
+            "long_query": '<a href="/p?' + "&a=1" * n + '>次へ</a>',
+            # マッチしないリンクが大量にある
+            "many_links": "".join('<a href="/articles/{}">関連記事{}</a>\n'.format(i, i) for i in range(n)),
+            # 括弧だけが続くアンカテキスト
+            "brackets": "".join('<a href="/p{}">{}</a>'.format(i, "【「《" * 30) for i in range(n // 10)),
+    }
+
+
+def recorded_pages(directory=RECORDED_DIR):
+    """ directoryに保存したhtmlを読み込む(無い場合は空)
+
+    Returns:
+        dict: "recorded/<ファイル名>" -> html
+    """
+
+    pages = {}
+    for path in sorted(glob(os.path.join(directory, "*.html"))):
+        with open(path, "rb") as f:
+            content = f.read()
+        pages["recorded/" + os.path.basename(path)] = content.decode(charset.detect(content), "replace")
+    return pages
+
+
+def record(url_file, directory=RECORDED_DIR):
+    """ url_fileに1行ずつ書かれたurlのhtmlを取得し、directoryに保存する
+
+    本文は文字コードを変換せずに保存する
+    """
+
+    from crawler.lib.http_pool import get_session_pool
+    import crawler.lib.const as GC
+
+    os.makedirs(directory, exist_ok=True)
+    with open(url_file) as f:
+        urls = [line.strip() for line in f if line.strip()]
+    for url in urls:
+        res = get_session_pool().get(url, headers=GC.HEADERS, timeout=GC.TIMEOUT)
+        path = os.path.join(directory, "{:016x}.html".format(utils.fingerprint(url)))
+        with open(path, "wb") as f:
+            f.write(res.content)
+        print("{}\t{}\t{}".format(res.status_code, len(res.content), path))
+
+
+def encoded_pages(seed=SEED):
+    """ 文字コードとmetaタグの有無ごとにエンコードしたhtmlを返す
+
+    Returns:
+        dict: "<encoding>/<meta or nometa>" -> bytes
+    """
+
+    rnd = random.Random(seed)
+    pages = {}
+    for encoding in ENCODINGS:
+        html = news_page(rnd, paragraphs=SIZES["medium"], charset=encoding)
+        pages["{}/meta".format(encoding)] = html.encode(encoding)
+        nometa = html.replace('<meta charset="{}">'.format(encoding), "")
+        pages["{}/nometa".format(encoding)] = nometa.encode(encoding)
+    return pages
+
+
+def make_cases():
+    """ 計測するケースを返す
+
+    Returns:
+        list: (名前, 引数なしで呼び出す関数)のリスト
+    """
+
+    cases = []
+    disp_pat, next_pat = navi.get_disppat(), navi.get_nextpat()
+    pages = synthetic_pages()
+    pages.update(recorded_pages())
+    pages.update({"pathological/" + k: v for k, v in pathological_pages().items()})
+    for name, html in pages.items():
+        cases += [
+                ("search_url[disp]/" + name, lambda html=html: navi.search_url(disp_pat, html)),
+                ("search_dispurl/" + name, lambda html=html: navi.search_dispurl(html)),
+                ("search_nexturl/" + name, lambda html=html: navi.search_nexturl(html, 1)),
+                ("scan_links/" + name, lambda html=html: navi.scan_links(html, 1)),
+        ]
+    # next_patはsearch_nexturlの中で使われるため、生成した記事でのみ単独で計測する
+    cases.append(("search_url[next]/medium/next",
+                  lambda html=pages["medium/next"]: navi.search_url(next_pat, html)))
+
+    pairs = make_pairs(200, SEED)
+    raw_is_next_url = navi.is_next_url.__wrapped__.__wrapped__  # 計測とlru_cacheを外したもの
+    cases += [
+            ("is_next_url/cached", lambda: [navi.is_next_url(*p) for p in pairs]),
+            ("is_next_url/uncached", lambda: [raw_is_next_url(*p) for p in pairs]),
+    ]
+
+    source = "https://news.example.jp/articles/2017/12/000001.html"
+    for url in ("//news.example.jp/a/2", "/articles/2017/12/000001_2.html", "?page=2", "https://other.example.jp/"):
+        cases.append(("normalize_url/" + url, lambda url=url: utils.normalize_url(url, source)))
+    for code in (100, 200, 301, 404, 503):
+        cases.append(("status_code2str/{}".format(code), lambda code=code: utils.status_code2str(code)))
+
+    for name, content in encoded_pages().items():
+        url = "https://{}.example.jp/articles/1".format(name.split("/")[0])
+        cases += [
+                ("charset.detect/" + name,
+                 lambda content=content: charset.CharsetDetector().detect(content, "text/html")),
+                ("charset.detect[domain]/" + name,
+                 lambda content=content, url=url, d=charset.CharsetDetector(): d.detect(content, "text/html", url)),
+        ]
+    return cases
+
+
+def percentile(sorted_values, q):
+
+    if not sorted_values:
+        return 0.0
+    i = min(len(sorted_values) - 1, int(round(q / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[i]
+
+
+def measure(func, case_seconds=CASE_SECONDS):
+    """ funcの1回あたりの所要時間を計測する
+
+    SAMPLE_SECONDSに達するまで繰り返した時間を1サンプルとし、CASE_SECONDSまたはMAX_SAMPLESに達するまで計測する
+
+    Returns:
+        dict: ops_per_sec、p50_us、p90_us、p99_us、samples
+    """
+
+    func()  # 正規表現のコンパイル等を計測に含めない
+    start = perf_counter()
+    func()
+    once = perf_counter() - start
+    inner = max(1, int(SAMPLE_SECONDS / max(once, 1e-9)))
+
+    samples, total, calls = [], 0.0, 0
+    while total < case_seconds and len(samples) < MAX_SAMPLES:
+        start = perf_counter()
+        for _ in range(inner):
+            func()
+        elapsed = perf_counter() - start
+        samples.append(elapsed / inner)
+        total += elapsed
+        calls += inner
+    samples.sort()
+    return {
+            "ops_per_sec": calls / total,
+            "p50_us": percentile(samples, 50) * 1e6,
+            "p90_us": percentile(samples, 90) * 1e6,
+            "p99_us": percentile(samples, 99) * 1e6,
+            "samples": len(samples)
+    }
+
+
+def baseline_path(name):
+
+    return os.path.join(BASELINE_DIR, "{}.json".format(name))
+
+
+def load_baseline(name):
+
+    try:
+        with open(baseline_path(name)) as f:
+            return json.load(f)
+    except OSError:
+        return {}
+
+
+def save_baseline(name, results):
+    """ 計測結果を保存する、ops_per_secとp50_usのみを残し、差分が見やすいようキーの順に並べる
+    """
+
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    rounded = {
+            case: {"ops_per_sec": round(r["ops_per_sec"], 1), "p50_us": round(r["p50_us"], 2)}
+            for case, r in results.items()
+    }
+    with open(baseline_path(name), "w") as f:
+        json.dump(rounded, f, indent=2, sort_keys=True, ensure_ascii=False)
+        f.write("\n")
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--filter", default="", help="名前にこの文字列を含むケースのみ計測する")
+    parser.add_argument("--baseline", default="default", help="比較するbaselineの名前")
+    parser.add_argument("--save", default=None, help="計測結果をこの名前のbaselineとして保存する")
+    parser.add_argument("--seconds", type=float, default=CASE_SECONDS, help="1ケースの計測時間")
+    parser.add_argument("--record", default=None, help="このファイルに書かれたurlのhtmlを保存して終了する")
+    args = parser.parse_args(argv)
+
+    if args.record != None:
+        record(args.record)
+        return 0
+
+    baseline = load_baseline(args.baseline)
+    results, regressions = {}, []
+    print("case\tops/sec\tp50[us]\tp90[us]\tp99[us]\tvs baseline")
+    for name, func in make_cases():
+        if args.filter not in name:
+            continue
+        r = results[name] = measure(func, args.seconds)
+        diff = ""
+        if name in baseline:
+            ratio = baseline[name]["ops_per_sec"] / r["ops_per_sec"]
+            diff = "{:+.1f}%".format((1 / ratio - 1) * 100)
+            if ratio >= REGRESSION_RATIO:
+                diff += " REGRESSION"
+                regressions.append(name)
+        print("{}\t{:.1f}\t{:.2f}\t{:.2f}\t{:.2f}\t{}".format(
+            name, r["ops_per_sec"], r["p50_us"], r["p90_us"], r["p99_us"], diff), flush=True)
+
+    if args.save != None:
+        save_baseline(args.save, results)
+        print("saved to {}".format(baseline_path(args.save)))
+    if regressions:
+        print("{} cases are slower than baseline '{}' by {:.0%} or more".format(
+            len(regressions), args.baseline, REGRESSION_RATIO - 1))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
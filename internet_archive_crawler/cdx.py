@@ -0,0 +1,249 @@
+# coding=utf-8
+
+"""
+CDX APIを用いて、Internet Archive上のキャッシュ(スナップショット)のurlを取得する機能を提供するモジュール
+
+web.archive.org/web/*/<url>をseleniumで描画してwb-metaのリンクを読む代わりに、
+CDX APIにHTTPで問い合わせ、published_atに最も近いスナップショットを選ぶ
+結果はSQLiteに保存し、再実行時には問い合わせない
+"""
+
+import json
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from time import time
+
+import crawler.lib.const as GC
+from crawler.lib.http_pool import get_session_pool
+from crawler.lib.timeout import remaining
+import internet_archives.lib.const as C
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    url TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    snapshot_url TEXT,
+    resolved_at REAL NOT NULL,
+    PRIMARY KEY (url, timestamp)
+)
+"""
+
+
+def to_timestamp(published_at):
+    """ published_atをCDX APIのタイムスタンプ(YYYYMMDDhhmmss)にする
+
+    Args:
+        published_at (str or datetime): GC.DATETIME_FORMAT形式の文字列、またはdatetime
+
+    Returns:
+        str: タイムスタンプ、変換できない場合は空文字列
+    """
+
+    if isinstance(published_at, datetime):
+        return published_at.strftime("%Y%m%d%H%M%S")
+    try:
+        return datetime.strptime(str(published_at).strip(), GC.DATETIME_FORMAT).strftime("%Y%m%d%H%M%S")
+    except ValueError:
+        return ""
+
+
+def nearest(rows, timestamp):
+    """ CDX APIの結果から、timestampに最も近いスナップショットを選ぶ
+
+    Args:
+        rows (list): (timestamp, original)のリスト
+        timestamp (str): 基準とするタイムスタンプ、空文字列の場合は最新のもの
+
+    Returns:
+        tuple: (timestamp, original)、rowsが空の場合はNone
+    """
+
+    if not rows:
+        return None
+    # 14桁に満たないタイムスタンプは比較できるよう0で埋める
+    if not timestamp:
+        return max(rows, key=lambda row: row[0].ljust(14, "0"))
+    target = int(timestamp.ljust(14, "0"))
+    return min(rows, key=lambda row: (abs(int(row[0].ljust(14, "0")) - target), row[0]))
+
+
+class CdxResolver:
+    """ 記事のurlとpublished_atから、Internet Archive上のスナップショットのurlを求めるクラス
+
+    スレッド間で共有できる
+
+    Attributes:
+        endpoint (str): CDX APIのurl
+        snapshot_prefix (str): スナップショットのurlの接頭辞(この後にタイムスタンプと元のurlが続く)
+        max_workers (int): resolve_manyで同時に問い合わせる数
+        scheduler (HostScheduler): 指定した場合、問い合わせの前にホストごとの間隔を待つ
+        stats (dict): hits(キャッシュを使った数)、found、not_found、errors
+    """
+
+    def __init__(
+            self,
+            endpoint=C.CDX_ENDPOINT,
+            snapshot_prefix=C.IA_SNAPSHOT_PREFIX,
+            cache_path=C.CDX_CACHE_PATH,
+            max_workers=C.CDX_MAX_WORKERS,
+            scheduler=None
+    ):
+
+        self.endpoint = endpoint
+        self.snapshot_prefix = snapshot_prefix
+        self.max_workers = max_workers
+        self.scheduler = scheduler
+        self.stats = {"hits": 0, "found": 0, "not_found": 0, "errors": 0}
+        self.__lock = threading.Lock()
+        self.__conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self.__conn.execute(SCHEMA)
+        self.__conn.commit()
+
+    def __cached(self, url, timestamp):
+        """ キャッシュを返す
+
+        Returns:
+            tuple: (True, スナップショットのurl or None)、キャッシュが無いか期限切れの場合は(False, None)
+        """
+
+        with self.__lock:
+            row = self.__conn.execute(
+                    "SELECT snapshot_url, resolved_at FROM snapshots WHERE url = ? AND timestamp = ?",
+                    (url, timestamp)
+            ).fetchone()
+        if row == None:
+            return False, None
+        snapshot_url, resolved_at = row
+        # スナップショットが無かった結果は、後から保存される可能性があるため一定時間で問い合わせ直す
+        if snapshot_url == None and time() - resolved_at >= C.CDX_NEGATIVE_TTL:
+            return False, None
+        return True, snapshot_url
+
+    def __store(self, url, timestamp, snapshot_url):
+
+        with self.__lock:
+            self.__conn.execute(
+                    "INSERT OR REPLACE INTO snapshots (url, timestamp, snapshot_url, resolved_at) VALUES (?, ?, ?, ?)",
+                    (url, timestamp, snapshot_url, time())
+            )
+            self.__conn.commit()
+
+    def query(self, url, timestamp):
+        """ CDX APIに問い合わせ、スナップショットの(timestamp, original)のリストを返す
+
+        Args:
+            url (str): 記事のurl
+            timestamp (str): 基準とするタイムスタンプ
+
+        Returns:
+            list: (timestamp, original)のリスト
+        """
+
+        params = {
+                "url": url,
+                "output": "json",
+                "fl": "timestamp,original",
+                "filter": C.CDX_STATUS_FILTER,
+                "limit": C.CDX_LIMIT
+        }
+        if timestamp:
+            params.update({"closest": timestamp, "sort": "closest"})
+        if self.scheduler != None:
+            self.scheduler.acquire(self.endpoint)
+        res = get_session_pool().get(
+                self.endpoint,
+                params=params,
+                headers=GC.HEADERS,
+                timeout=remaining(GC.TIMEOUT)
+        )
+        if res.status_code != 200:
+            raise Exception("CDX API returned status_code {} for {}".format(res.status_code, url))
+        if not res.text.strip():
+            return []
+        rows = json.loads(res.text)
+        # 1行目は列名
+        return [(row[0], row[1]) for row in rows[1:]]
+
+    def resolve(self, url, published_at):
+        """ published_atに最も近いスナップショットのurlを返す
+
+        Args:
+            url (str): 記事のurl
+            published_at (str): 記事がceronに登録された日付
+
+        Returns:
+            str: スナップショットのurl、スナップショットが無い場合はNone
+        """
+
+        url = url.strip()
+        timestamp = to_timestamp(published_at)
+        hit, snapshot_url = self.__cached(url, timestamp)
+        if hit:
+            with self.__lock:
+                self.stats["hits"] += 1
+            return snapshot_url
+
+        try:
+            row = nearest(self.query(url, timestamp), timestamp)
+        except Exception:
+            with self.__lock:
+                self.stats["errors"] += 1
+            raise
+        snapshot_url = None if row == None else "{}{}/{}".format(self.snapshot_prefix, row[0], row[1])
+        self.__store(url, timestamp, snapshot_url)
+        with self.__lock:
+            self.stats["found" if snapshot_url != None else "not_found"] += 1
+        return snapshot_url
+
+    def resolve_many(self, targets):
+        """ 複数の記事のスナップショットを並行に求める
+
+        CDX APIは異なるurlをまとめて問い合わせられないため、キャッシュに無いものだけを1件ずつ並行に問い合わせる
+        キャッシュにあるものはスレッドに渡さずに返し、同じ(url, タイムスタンプ)は1回だけ問い合わせる
+
+        Args:
+            targets (list): (url, published_at)のリスト
+
+        Returns:
+            list: スナップショットのurl(無い場合はNone)、または送出された例外のリスト
+        """
+
+        def resolve(target):
+            try:
+                return self.resolve(*target)
+            except Exception as e:
+                return e
+
+        results, pending = {}, {}  # (url, タイムスタンプ) -> 結果、問い合わせる(url, published_at)
+        keys = [(url.strip(), to_timestamp(published_at)) for url, published_at in targets]
+        for key, target in zip(keys, targets):
+            if key in results or key in pending:
+                continue
+            hit, snapshot_url = self.__cached(*key)
+            if hit:
+                with self.__lock:
+                    self.stats["hits"] += 1
+                results[key] = snapshot_url
+            else:
+                pending[key] = target
+
+        if pending:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                results.update(zip(pending, executor.map(resolve, pending.values())))
+        return [results[key] for key in keys]
+
+    def report(self, logger):
+        """ 問い合わせの統計をloggerに出力する
+        """
+
+        logger.info(
+                "cdx: {} cache hits, {} found, {} not found, {} errors".format(
+                    self.stats["hits"], self.stats["found"], self.stats["not_found"], self.stats["errors"])
+        )
+
+    def close(self):
+
+        with self.__lock:
+            self.__conn.close()
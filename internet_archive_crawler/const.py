@@ -3,14 +3,56 @@
 import os
 
 IA_DELAY = 60
+
+# Internet Archiveへのアクセスに失敗した際の設定
+IA_BREAKER_FAILURE_THRESHOLD = 3  # サーキットブレーカがopenになるまでの連続失敗回数
+IA_BREAKER_BASE_DELAY = 10  # 最初にopenになった際にアクセスを止める秒数
+IA_BREAKER_MAX_DELAY = IA_DELAY * 10  # アクセスを止める最大秒数
+MAX_RETRIES_PER_TARGET = 5  # 1つの記事で失敗した際にやり直す回数の上限
+MAX_DEFERRED_TARGETS = 10000  # 後回しにできる記事の数の上限
+
+# 記事をまとめて保存する際の設定
+WRITER_BATCH_SIZE = 100  # 1回で保存するurlの数
+WRITER_FLUSH_INTERVAL = 30  # 保存する間隔の最大秒数
+
+# 複数のプロセスでクローリングする際の設定
+PARALLEL_WORKERS = 4  # ワーカープロセスの数
+PARALLEL_QUEUE_SIZE = 4  # 1つのワーカーに同時に渡しておく記事の数
+PARALLEL_READ_AHEAD = 4  # ワーカーに渡す前の記事をPARALLEL_WORKERS * PARALLEL_QUEUE_SIZEの何倍まで読み込んでおくか
+PARALLEL_START_METHOD = "fork"  # ワーカープロセスの起動方法
+PARALLEL_POLL_INTERVAL = 1.0  # ワーカーの結果を待つ間に異常終了を確認する間隔(秒)
+PARALLEL_SHUTDOWN_TIMEOUT = 30  # 終了を伝えてから強制終了するまでの秒数
+
+# スクレイピング済みのurlを読み込む際の設定
+CRAWLED_INDEX_CHUNK_SIZE = 10000  # 1回で読み込む行数
+CRAWLED_BLOOM_ERROR_RATE = 0.001  # Bloom filterの偽陽性率
+CRAWLED_BLOOM_HEADROOM = 1.5  # 追加されるurlのために確保するBloom filterの余裕
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 CRAWLING_TARGET_FILE = os.path.join(BASE_DIR, "lib", "crawling_target")
+CHECKPOINT_SUFFIX = ".checkpoint"  # 読み込んだ位置を保存するファイルの接尾辞
+COUNT_CHUNK_SIZE = 1 << 20  # 行数を数える際に1回で読み込むバイト数
 IA_PREFIX = "https://web.archive.org/web/*/"
 
+# CDX APIでスナップショットを求める際の設定
+CDX_ENDPOINT = "https://web.archive.org/cdx/search/cdx"
+IA_SNAPSHOT_PREFIX = "https://web.archive.org/web/"  # この後に"<timestamp>/<元のurl>"が続く
+CDX_CACHE_PATH = os.path.join(BASE_DIR, "lib", "cdx_cache.sqlite3")  # 問い合わせた結果を保存するファイル
+CDX_STATUS_FILTER = "statuscode:200"  # リダイレクトのスナップショットはたいていトップページへ飛ばされるだけ
+CDX_LIMIT = 10  # 1回の問い合わせで受け取るスナップショットの数
+CDX_MAX_WORKERS = 4  # まとめて問い合わせる際の同時接続数
+CDX_BATCH_SIZE = 50  # crawling_targetを先読みしてまとめて問い合わせる記事の数
+CDX_NEGATIVE_TTL = 60 * 60 * 24  # スナップショットが無かった結果を再利用する秒数
+
 TARGET_ERROR_CSS_SELECTOR = "div.error.error-border"
 TARGET_LINK_CSS_SELECTOR = "div#wb-meta"
 TARGET_LINK_ID = "wb-meta"
 
+# htmlの圧縮用の辞書を格納するディレクトリ
+HTML_DICT_DIR = os.path.join(BASE_DIR, "dict")
+
+BLOB_CACHE_SIZE = 100000  # 重複排除の際にメモリ上に保持するハッシュ値の数
+MIGRATION_BATCH_SIZE = 1000  # 既存のSourceの保存形式を変換する際に1回で変換する件数
+
 # logを格納するディレクトリ
 LOG_DIR = os.path.join(BASE_DIR, "log")
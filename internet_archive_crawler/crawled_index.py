@@ -0,0 +1,138 @@
+# coding=utf-8
+
+"""
+スクレイピング済みのurlをメモリ上で判定する機能を提供するモジュール
+"""
+
+import math
+from array import array
+from bisect import bisect_left, bisect_right
+from hashlib import blake2b
+
+from internet_archives.models import Url
+import internet_archives.lib.const as C
+from crawler.lib.utils import fingerprint
+
+
+class BloomFilter:
+    """ urlの集合を表すBloom filter
+
+    偽陽性はあるが偽陰性はない
+
+    Attributes:
+        n_bits (int): ビット配列の長さ
+        n_hashes (int): 1要素あたりに使うハッシュ関数の数
+    """
+
+    def __init__(self, capacity, error_rate=C.CRAWLED_BLOOM_ERROR_RATE):
+
+        capacity = max(capacity, 1)
+        self.n_bits = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.n_hashes = max(1, int(round(self.n_bits / capacity * math.log(2))))
+        self.bits = bytearray((self.n_bits + 7) // 8)
+
+    def __positions(self, url):
+
+        digest = blake2b(url.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:], "big") | 1
+        return [(h1 + i * h2) % self.n_bits for i in range(self.n_hashes)]
+
+    def add(self, url):
+
+        for pos in self.__positions(url):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, url):
+
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self.__positions(url))
+
+
+class CrawledIndex:
+    """ スクレイピング済みのurlの集合
+
+    起動時にUrlテーブルを1回のクエリで読み込み、以降の判定はなるべくDBに問い合わせずに行う
+    通常はurlの64bitのハッシュ値をソートしたarrayとして保持し、二分探索で判定する
+    ハッシュ値が一致した場合は、一緒に保持したUrlの主キーで問い合わせ、衝突した別のurlでないことを確かめる
+    (url_stringには索引が無いため、主キーで問い合わせる)
+    use_bloom=Trueの場合はBloom filterとして保持し、陽性と判定された場合のみDBに問い合わせる
+    loadにurlsを渡した場合は主キーが無いため、ハッシュ値の一致のみで判定する
+    load後に追加されたurlは、url文字列のまま保持する
+
+    Attributes:
+        use_bloom (bool): Bloom filterを使うか否か
+        error_rate (float): Bloom filterの偽陽性率
+    """
+
+    def __init__(self, use_bloom=False, error_rate=C.CRAWLED_BLOOM_ERROR_RATE):
+
+        self.use_bloom = use_bloom
+        self.error_rate = error_rate
+        self.__fingerprints = array("Q")  # loadしたurlのハッシュ値(昇順)
+        self.__pks = None  # __fingerprintsと同じ順序のUrlの主キー、urlsを渡してloadした場合はNone
+        self.__added = set()  # load後に追加されたurl
+        self.__bloom = None
+        self.__n_bloom = 0  # Bloom filterに登録したurlの数
+
+    def __len__(self):
+
+        return len(self.__fingerprints) + len(self.__added) + self.__n_bloom
+
+    def load(self, urls=None):
+        """ スクレイピング済みのurlを読み込む
+
+        Args:
+            urls (iterable): スクレイピング済みのurl、Noneの場合はUrlテーブルからストリーミングで読み込む
+        """
+
+        if urls == None:
+            if self.use_bloom:
+                self.__bloom = BloomFilter(
+                        int(Url.objects.count() * C.CRAWLED_BLOOM_HEADROOM),
+                        self.error_rate
+                )
+            rows = Url.objects.values_list("pk", "url_string").iterator(
+                    chunk_size=C.CRAWLED_INDEX_CHUNK_SIZE
+            )
+        else:
+            if self.use_bloom:
+                urls = list(urls)
+                self.__bloom = BloomFilter(int(len(urls) * C.CRAWLED_BLOOM_HEADROOM), self.error_rate)
+            rows = ((None, url) for url in urls)
+
+        if self.use_bloom:
+            for _, url in rows:
+                self.__bloom.add(url)
+                self.__n_bloom += 1
+            return
+
+        # ハッシュ値と主キーを1つの整数にまとめてソートし、2つのarrayに分ける
+        keys = sorted((fingerprint(url) << 64) | (pk or 0) for pk, url in rows)
+        mask = (1 << 64) - 1
+        self.__fingerprints = array("Q", (key >> 64 for key in keys))
+        self.__pks = array("Q", (key & mask for key in keys)) if urls == None else None
+
+    def add(self, url):
+        """ スクレイピング済みのurlを追加する
+        """
+
+        self.__added.add(url)
+
+    def __contains__(self, url):
+
+        if url in self.__added:
+            return True
+        if self.__fingerprints:
+            fp = fingerprint(url)
+            lo = bisect_left(self.__fingerprints, fp)
+            if lo < len(self.__fingerprints) and self.__fingerprints[lo] == fp:
+                if self.__pks == None:
+                    return True
+                hi = bisect_right(self.__fingerprints, fp, lo)
+                # ハッシュ値が衝突した別のurlでないことを確かめる
+                return Url.objects.filter(pk__in=list(self.__pks[lo:hi]), url_string=url).exists()
+            return False
+        if self.__bloom == None or url not in self.__bloom:
+            return False
+        # Bloom filterの偽陽性を除くためDBに問い合わせる
+        return Url.objects.filter(url_string=url).exists()
@@ -3,66 +3,149 @@
 from bs4 import BeautifulSoup
 from tqdm import tqdm
 from time import sleep
+from collections import deque
+from itertools import islice
 
-from internet_archives.models import Url, PageUrl, Source
-from django.db import transaction
+from internet_archives.lib.crawled_index import CrawledIndex
+from internet_archives.lib.writer import BufferedArticleWriter
+from internet_archives.lib.target_reader import TargetReader
 
 import crawler.lib.utils as global_utils
 from crawler.lib.container import ScrapedArticleData
 import crawler.lib.const as GC
 import crawler.lib.page_navigator as navi
+import crawler.lib.static_first as static_first_mode
+from crawler.lib.timeout import deadline
+from crawler.lib.circuit_breaker import CircuitBreaker, CircuitOpenError
+from crawler.lib.http_pool import get_session_pool
+from crawler.lib.metrics import METRICS
+from crawler.lib.prefetch import Prefetcher
 import internet_archives.lib.const as C
 
 class InternetArchivesCrawler():
 
-    def __init__(self, sleep_time=1):
+    def __init__(
+            self,
+            sleep_time=1,
+            static_first=False,
+            sufficient=static_first_mode.is_sufficient,
+            batch_size=C.WRITER_BATCH_SIZE,
+            flush_interval=C.WRITER_FLUSH_INTERVAL,
+            use_bloom=False,
+            target_file=C.CRAWLING_TARGET_FILE,
+            resume=True,
+            dedup=False,
+            scheduler=None,
+            compression=None,
+            dedup_html=False,
+            cache=None,
+            sink=None,
+            resolver=None,
+            ia_prefix=C.IA_PREFIX,
+            metrics_path=None,
+            prefetch=False
+    ):
 
-        self.TARGET_INFO = [l.strip().split("|||")[:3]
-                for l in open(C.CRAWLING_TARGET_FILE).read().strip().split("\n")]
+        self.targets = TargetReader(target_file, dedup=dedup)
+        if not resume:
+            self.targets.reset()
+        self.__checkpoint = None  # 保存が完了した行の終了位置
         self.SLEEP_TIME = sleep_time
+        self.STATIC_FIRST = static_first  # requestsで十分なページはseleniumで描画しない
+        self.sufficient = sufficient  # static-firstモードで、requestsで取得したhtmlが十分か否か判定する関数
+        self.scheduler = scheduler  # HostSchedulerを指定した場合はrandom_sleepの代わりにホストごとの間隔を待つ
+        self.cache = cache  # ResponseCacheを指定した場合は取得・描画したものを保存し、再実行時に再利用する
+        self.resolver = resolver  # CdxResolverを指定した場合はseleniumで描画せずにCDX APIでスナップショットを求める
+        self.ia_prefix = ia_prefix
+        self.metrics_path = metrics_path  # 指定した場合は計測を有効にし、一定間隔でJSONに書き出す
+        # Trueの場合は学習したページ送りのパターンから記事の後続ページを予測し、並行に先読みする
+        self.prefetcher = Prefetcher(self.__prefetch) if prefetch else None
+        if sink == None:
+            self.writer = BufferedArticleWriter(
+                    batch_size=batch_size,
+                    flush_interval=flush_interval,
+                    compression=compression,  # 指定したコーデックでSource.htmlを圧縮して保存する
+                    dedup=dedup_html  # 同一のhtmlはHtmlBlobに1つだけ保存する
+            )
+        else:
+            # WarcArticleSink等、DBの代わりに記事を保存するもの(スクレイピング済みのurlはcrawled_urlsから読み込む)
+            self.writer = sink
+        self.sink = sink
+        # writerがadd_pageを持つ場合は、ページを取得した順に渡し、記事の全ページをまとめて保持しない
+        self.streaming = hasattr(self.writer, "add_page")
+        # Bloom filterの偽陽性はDBで確認するため、DBに保存する場合のみ使う
+        self.crawled = CrawledIndex(use_bloom=use_bloom and sink == None)  # スクレイピング済みのurl
+        self.writer.add_flush_callback(self.__commit)
+        self.breaker = CircuitBreaker(
+                name="internet_archive",
+                failure_threshold=C.IA_BREAKER_FAILURE_THRESHOLD,
+                base_delay=C.IA_BREAKER_BASE_DELAY,
+                max_delay=C.IA_BREAKER_MAX_DELAY
+        )
+        self.breaker.add_listener(self.__log_transition)
 
-    def __scrape_archives(self, url, logger):
+    def __scrape_archives(self, url, published_at, logger):
         """ InternetArchive上のページから、htmlが格納されているリンクを取得する
         
         Args:
             url (str): Internet Archives上のキャッシュにアクセスしたいurl
+            published_at (str): 記事がceronに登録された日付、resolverを使う場合はこれに最も近いキャッシュを選ぶ
             logger (logger): loggerインスタンス
         Returns:
             str: Internet Archives上のキャッシュにアクセスできるURL
         """
 
         # 既にスクレイピングしたか否か確認
-        try:
-            Url.objects.get(url_string=url)
+        if url in self.crawled:
             return None
-        except:
-            pass  # スクレイピングされていなければスクレイピング処理
 
-        ia_url = "{}{}".format(C.IA_PREFIX.strip(), url.strip())
+        # サーキットブレーカにはInternet Archiveへの問い合わせの成否のみを記録する
+        if self.resolver != None:
+            try:
+                atcl_url = self.breaker.call(self.resolver.resolve, url, published_at)
+            except CircuitOpenError:
+                raise
+            except Exception as e:
+                logger.error("CDX API {} on {}".format(e, url))
+                raise Exception("Internet Archive Server is down.")
+            if atcl_url == None:
+                logger.info("There is no cache of {} on internet archive. [Skip]".format(url))
+            else:
+                logger.info("Internet Archive has cashe for {} at {}".format(url, atcl_url))
+            return atcl_url
+
+        ia_url = "{}{}".format(self.ia_prefix.strip(), url.strip())
         try:
-            html, status_code = global_utils.get(
+            html, status_code = self.breaker.call(
+                    global_utils.get,
                     ia_url,
                     logger,
                     self.SLEEP_TIME,
                     use_selenium=True,
-                    is_ia=True
+                    is_ia=True,
+                    static_first=self.STATIC_FIRST,
+                    sufficient=self.sufficient,
+                    scheduler=self.scheduler,
+                    cache=self.cache
             )
+        except TimeoutError:
+            logger.error("Internet Archive Server is down.") 
+            raise Exception("Internet Archive Server is down.")
+        try:
             soup = BeautifulSoup(html, "html.parser")
             atcl_url = soup.find("div", id=C.TARGET_LINK_ID).a.get("href")
             atcl_url = global_utils.normalize_url(atcl_url, ia_url)
             logger.info("Internet Archive has cashe for {} at {}".format(url, atcl_url))
             return atcl_url
-        except TimeoutError:
-            logger.error("Internet Archive Server is down.") 
-            raise Exception("Internet Archive Server is down.")
         except AttributeError:
             logger.info("There is no cache of {} on internet archive. [Skip]".format(url))
             return None
         
-    def __scrape_atcl(self, url, title, published_at, logger):
-        """ 記事のhtmlを取得する
+    def __iter_atcl(self, url, title, published_at, logger):
+        """ 記事のhtmlを1ページずつ取得するジェネレータ
 
         次ページへのリンクがあった場合は、それらも取得
+        取得したページは次のページを取得する前に返すため、呼び出し側で保存して破棄できる
 
         Args:
             url (str): 収集する記事のurl
@@ -70,173 +153,349 @@ class InternetArchivesCrawler():
             published_at (str): 収集する記事がceronに登録された日付
             logger (logger): loggerインスタンス
 
+        Yields:
+            ScrapedArticleData: 記事の1ページ、クライアント・サーバエラーやタイムアウトの場合はそのページで終わる
+        """
+
+        page_ctr, origin_url = 1, url
+        try:
+            while True:
+                # 取得、描画、リンクの探索でurlごとの期限を共有する(期限は返したページの保存には含めない)
+                with deadline(GC.URL_DEADLINE):
+                    atcl, next_url = self.__fetch_page(url, origin_url, title, published_at, page_ctr, logger)
+                yield atcl
+                if next_url == None:
+                    return
+                page_ctr += 1
+                if page_ctr > GC.MAX_PAGES:
+                    logger.warning("{} has too many pages. {} pages".format(url, page_ctr))
+                    return
+                url = global_utils.normalize_url(next_url, origin_url)
+                if self.prefetcher != None:
+                    self.prefetcher.advance(origin_url, url, page_ctr)
+        finally:
+            if self.prefetcher != None:
+                self.prefetcher.finish(origin_url)
+
+    def __fetch(self, url, logger, page_ctr):
+        """ 記事のpage_ctrページ目を取得する
+
         Returns:
-            list: ScrapedArticleDataのリスト、クライアント・サーバエラーやリダイレクトされた場合はNoneを返す
+            tuple: (html, status_code) utils.getと同じ形式
         """
 
-        page_ctr, origin_url, atcl_list = 1, url, []
-        while True:
-            try:
-                html, status_code = global_utils.get(
-                        url,
-                        logger,
-                        self.SLEEP_TIME,
-                        use_selenium=True
-                )
-            except TimeoutError:
-                atcl_list.append(
-                        ScrapedArticleData(
-                            origin_url,
-                            url,
-                            title,
-                            '',
-                            page_ctr,
-                            published_at,
-                            GC.TIMEOUT
-                        )
-                )
-                return atcl_list 
-            # レスポンスでエラーや404だった場合はhtmlは格納しない
-            if global_utils.status_code2str(
-                    status_code) in [GC.SERVER_ERROR, GC.CLIENT_ERROR]:
-                atcl_list.append(
-                        ScrapedArticleData(
-                            origin_url,
-                            url,
-                            title,
-                            '',
-                            page_ctr,
-                            published_at,
-                            status_code
-                        )
-                )
-                return atcl_list
+        return global_utils.get(
+                url,
+                logger,
+                self.SLEEP_TIME,
+                use_selenium=True,
+                static_first=self.STATIC_FIRST,
+                sufficient=self.sufficient,
+                scheduler=self.scheduler,
+                cache=self.cache,
+                page_cnt=page_ctr
+        )
 
-            # 全文表示へのリンクがあるか否か
-            try:
-                disp_url = navi.search_dispurl(html)
-            except TimeoutError:
-                logger.warning(
-                        "TimeoutError at search_dispurl on {}. [SKIP]".format(url)
-                )
-                return atcl_list.append(
-                        ScrapedArticleData(
-                            origin_url,
-                            url,
-                            title,
-                            html,
-                            page_ctr,
-                            published_at,
-                            GC.TIMEOUT_SEARCH_DISPURL
-                        )
-                )
-            if disp_url:
-                logger.info("disp_url exists at {}: {}".format(url, disp_url))
-                url = global_utils.normalize_url(disp_url, url)
-                html, status_code = global_utils.get(url, logger, self.SLEEP_TIME, use_selenium=True)
-                if global_utils.status_code2str(
-                    status_code) in [GC.SERVER_ERROR, GC.CLIENT_ERROR]:
-                    atcl_list.append(
-                        ScrapedArticleData( 
-                            origin_url,
-                            url,
-                            title,
-                            '',
-                            page_ctr,
-                            published_at,
-                            status_code
-                        )
-                    )
-                    return atcl_list 
-
-            atcl_list.append(
-                    ScrapedArticleData(
+    def __prefetch(self, url, page_ctr):
+        """ Prefetcherが別スレッドで呼び出す取得処理
+        """
+
+        return self.__fetch(url, self.logger, page_ctr)
+
+    def __fetch_page(self, url, origin_url, title, published_at, page_ctr, logger):
+        """ 記事の1ページを取得し、次ページへのリンクを探す
+
+        Returns:
+            tuple: (ScrapedArticleData, 次ページのurl)、次ページが無い場合やエラーの場合はurlがNone
+        """
+
+        try:
+            prefetched = None
+            if self.prefetcher != None:
+                prefetched = self.prefetcher.take(origin_url, url, page_ctr)
+            if prefetched != None:
+                html, status_code = prefetched
+            else:
+                html, status_code = self.__fetch(url, logger, page_ctr)
+        except TimeoutError:
+            return ScrapedArticleData(
+                    origin_url,
+                    url,
+                    title,
+                    '',
+                    page_ctr,
+                    published_at,
+                    GC.TIMEOUT
+            ), None
+        # レスポンスでエラーや404だった場合はhtmlは格納しない
+        if global_utils.status_code2str(
+                status_code) in [GC.SERVER_ERROR, GC.CLIENT_ERROR]:
+            return ScrapedArticleData(
+                    origin_url,
+                    url,
+                    title,
+                    '',
+                    page_ctr,
+                    published_at,
+                    status_code
+            ), None
+
+        # 全文表示へのリンク、次ページへのリンクがあるか否か
+        try:
+            links = navi.scan_links(html, page_ctr)
+        except TimeoutError:
+            logger.warning(
+                    "TimeoutError at search_dispurl on {}. [SKIP]".format(url)
+            )
+            return ScrapedArticleData(
+                    origin_url,
+                    url,
+                    title,
+                    html,
+                    page_ctr,
+                    published_at,
+                    GC.TIMEOUT_SEARCH_DISPURL
+            ), None
+        if links.disp_url:
+            logger.info("disp_url exists at {}: {}".format(url, links.disp_url))
+            url = global_utils.normalize_url(links.disp_url, url)
+            html, status_code = self.__fetch(url, logger, page_ctr)
+            if global_utils.status_code2str(
+                status_code) in [GC.SERVER_ERROR, GC.CLIENT_ERROR]:
+                return ScrapedArticleData(
                         origin_url,
                         url,
                         title,
-                        html,
+                        '',
                         page_ctr,
                         published_at,
                         status_code
-                    )
+                ), None
+
+        try:
+            # 全文表示のページは改めて次ページへのリンクを探す
+            next_url = navi.search_nexturl(html, page_ctr) if links.disp_url else links.next_url
+        except TimeoutError:
+            logger.warning(
+                    "TimeoutError at search_nexturl on {}. [SKIP]".format(url)
             )
-            try:
-                next_url = navi.search_nexturl(html, page_ctr)
-            except TimeoutError:
-                logger.warning(
-                        "TimeoutError at search_nexturl on {}. [SKIP]".format(url)
-                )
-                atcl_list[-1] = ScrapedArticleData(
-                        origin_url,
-                        url,
-                        title,
-                        html,
-                        page_ctr,
-                        published_at,
-                        GC.TIMEOUT_SEARCH_NEXTURL
-                )
-                return atcl_list  
-            if navi.is_next_url(next_url, origin_url): 
-                page_ctr += 1
-                if page_ctr > GC.MAX_PAGES:
-                   logger.warning("{} has too many pages. {} pages".format(url, page_ctr))
-                   break
-                url = global_utils.normalize_url(next_url, origin_url)
-            else:
-                break
+            return ScrapedArticleData(
+                    origin_url,
+                    url,
+                    title,
+                    html,
+                    page_ctr,
+                    published_at,
+                    GC.TIMEOUT_SEARCH_NEXTURL
+            ), None
+        atcl = ScrapedArticleData(
+                origin_url,
+                url,
+                title,
+                html,
+                page_ctr,
+                published_at,
+                status_code
+        )
+        if navi.is_next_url(next_url, origin_url):
+            return atcl, next_url
+        return atcl, None
 
-        return atcl_list 
+    def __stream(self, url, title, published_at, logger):
+        """ 記事のページを取得した順にwriter.add_pageに渡す
 
-    @transaction.atomic
-    def __save(self, url, atcl_list):
-        
-        url, created = Url.objects.get_or_create(
-                url_string=url,
-        ) 
-        if created:
-            for atcl in atcl_list:
-                purl, _ = PageUrl.objects.get_or_create(
-                        url=url,
-                        pageurl_string=atcl.page_url,
-                        page=atcl.page,
-                        status_code=atcl.status_code
-                )
-                Source.objects.get_or_create(
-                        purl=purl,
-                        title=atcl.title,
-                        html=atcl.html,
-                        published_at=atcl.published_at
+        ページをまとめて保持せずに済むよう、writerがadd_pageを持つ場合にscrapeの代わりに用いる
+        途中で失敗した場合は、渡したページを破棄してから例外を送出する
+
+        Returns:
+            int: 渡したページ数
+        """
+
+        n_pages = 0
+        try:
+            for atcl in self.iter_scrape(url, title, published_at, logger):
+                self.writer.add_page(url, atcl)
+                n_pages += 1
+        except BaseException:
+            self.writer.discard(url)
+            raise
+        return n_pages
+
+    @METRICS.timed("save_seconds")
+    def __save(self, url, scraped):
+        """ 記事を保存用のバッファに追加する、DBへの保存はwriterがまとめて行う
+
+        Args:
+            url (str): 記事のurl
+            scraped (list or int): scrapeが返したScrapedArticleDataのリスト、__streamの場合はページ数
+        """
+
+        if self.streaming:
+            self.writer.end_target(url)
+        else:
+            self.writer.add(url, scraped)
+        self.crawled.add(url)
+
+    def __commit(self):
+        """ 保存が完了した位置までcrawling_targetの読み込み位置を進める
+        """
+
+        if self.__checkpoint != None:
+            self.targets.commit(self.__checkpoint)
+
+    def iter_scrape(self, url, title, published_at, logger):
+        """ 1つの記事をInternet Archive上のキャッシュから1ページずつ取得するジェネレータ
+
+        Args:
+            url (str): 収集する記事のurl
+            title (str): 収集する記事のタイトル
+            published_at (str): 収集する記事がceronに登録された日付
+            logger (logger): loggerインスタンス
+
+        Yields:
+            ScrapedArticleData: 記事の1ページ、キャッシュが存在しない場合はstatus_codeが404のもの
+        """
+
+        with METRICS.timer("ia_resolve_seconds", method="selenium" if self.resolver == None else "cdx"):
+            atcl_url = self.__scrape_archives(url, published_at, logger)
+        METRICS.inc("ia_resolve_total", result="missing" if atcl_url == None else "found")
+        if atcl_url == None:
+            yield ScrapedArticleData(
+                    url,
+                    url,
+                    title,
+                    '',
+                    1,
+                    published_at,
+                    404
+            )
+            return
+        n_pages = 0
+        for atcl in self.__iter_atcl(atcl_url, title, published_at, logger):
+            n_pages += 1
+            yield atcl
+        logger.info("{} has {} pages (Internet Archives at {}).".format(url, n_pages, atcl_url))
+
+    def scrape(self, url, title, published_at, logger):
+        """ 1つの記事をInternet Archive上のキャッシュから取得する
+
+        Args:
+            url (str): 収集する記事のurl
+            title (str): 収集する記事のタイトル
+            published_at (str): 収集する記事がceronに登録された日付
+            logger (logger): loggerインスタンス
+
+        Returns:
+            list: ScrapedArticleDataのリスト、キャッシュが存在しない場合はstatus_codeが404のもの
+        """
+
+        return list(self.iter_scrape(url, title, published_at, logger))
+
+    def __resolve_ahead(self, targets):
+        """ resolverを使う場合、crawling_targetをCDX_BATCH_SIZE行ずつ先読みし、まとめてスナップショットを求めておく
+
+        ここで失敗したものは、scrapeの際に改めて問い合わせる
+
+        Args:
+            targets (iterator): TargetLineのイテレータ
+
+        Yields:
+            TargetLine: targetsと同じもの
+        """
+
+        if self.resolver == None:
+            yield from targets
+            return
+        while True:
+            chunk = list(islice(targets, C.CDX_BATCH_SIZE))
+            if not chunk:
+                return
+            if self.breaker.ready():
+                self.resolver.resolve_many(
+                        [(t.url, t.published_at) for t in chunk if t.url not in self.crawled]
                 )
+            yield from chunk
+
+    def __log_transition(self, name, old, new):
+
+        self.logger.warning("circuit {}: {} -> {}".format(name, old, new))
 
     def parse(self, logger):
 
-        idx = 0
-        pbar = tqdm(total=len(self.TARGET_INFO))
-        while idx < len(self.TARGET_INFO):
-            (url, title, published_at) = self.TARGET_INFO[idx]
-            try:
-            	atcl_url = self.__scrape_archives(url, logger)
-            	if atcl_url == None:
-            	    atcl_list = [
-            	            ScrapedArticleData(
-            	                url,
-            	                url,
-            	                title,
-            	                '',
-            	                1,
-            	                published_at,
-            	                404
-            	            )
-            	    ]
-            	else:
-            	    atcl_list = self.__scrape_atcl(atcl_url, title, published_at, logger)
-            	    logger.info("{} has {} pages (Internet Archives at {}).".format(url, len(atcl_list), atcl_url))
-            except Exception as e: 
-                logger.info("Reconnect to internet archives after {}s by Exception: {}".format(C.IA_DELAY, e))
-                sleep(C.IA_DELAY)
+        self.logger = logger
+        if self.metrics_path != None:
+            METRICS.enable()
+            METRICS.start_snapshots(self.metrics_path)
+        self.crawled.load(None if self.sink == None else self.sink.crawled_urls())
+        logger.info("{} urls have already been crawled.".format(len(self.crawled)))
+        total, done = self.targets.count()
+        pbar = tqdm(total=total, initial=done)
+        deferred = deque()  # Internet Archiveにアクセスできず後回しにした(TargetLine, 失敗回数)
+        targets = self.__resolve_ahead(iter(self.targets))
+        read_end, exhausted = self.targets.offset(), False
+        while True:
+            # アクセスを再開できれば後回しにした記事から処理する
+            if deferred and (exhausted or len(deferred) >= C.MAX_DEFERRED_TARGETS or self.breaker.ready()):
+                if not self.breaker.ready():
+                    wait = max(self.breaker.retry_after(), 1)
+                    logger.info("Reconnect to internet archives after {:.1f}s ({} targets deferred).".format(
+                        wait, len(deferred)))
+                    sleep(wait)
+                    continue
+                target, failures = deferred.popleft()
+            elif not exhausted:
+                target = next(targets, None)
+                if target == None:
+                    exhausted = True
+                    continue
+                failures, read_end = 0, target.end
+            else:
+                break
+
+            if target.url in self.crawled:
+                scraped = None  # Internet Archiveにアクセスせずに済むものはブレーカが開いていても処理する
+            elif not self.breaker.ready():
+                deferred.append((target, failures))
                 continue
-            self.__save(url, atcl_list)
+            else:
+                try:
+                    # Internet Archiveへの問い合わせはscrapeの中でサーキットブレーカを通す
+                    scrape = self.__stream if self.streaming else self.scrape
+                    scraped = scrape(target.url, target.title, target.published_at, logger)
+                except CircuitOpenError:
+                    deferred.append((target, failures))
+                    continue
+                except Exception as e: 
+                    failures += 1
+                    if failures >= C.MAX_RETRIES_PER_TARGET:
+                        logger.error("Give up {} after {} failures: {}".format(target.url, failures, e))
+                        pbar.update(1)
+                    else:
+                        logger.info("Retry {} later by Exception: {}".format(target.url, e))
+                        deferred.append((target, failures))
+                    continue
 
-            idx += 1
+            # 保存が完了した時点で、後回しにした記事より前の行までを読み込み済みとする
+            self.__checkpoint = min([t.start for t, _ in deferred], default=read_end)
+            if scraped != None:
+                self.__save(target.url, scraped)
             pbar.update(1)
         pbar.close()
+        self.writer.flush()
+        self.writer.report(logger)
+        if self.STATIC_FIRST:
+            static_first_mode.RENDER_STATS.report(logger)
+        logger.info("circuit {}: {}".format(self.breaker.name, self.breaker.metrics()))
+        get_session_pool().report(logger)
+        if self.cache != None:
+            self.cache.report(logger)
+        if self.resolver != None:
+            self.resolver.report(logger)
+        if self.prefetcher != None:
+            self.prefetcher.report(logger)
+        if self.metrics_path != None:
+            METRICS.stop_snapshots()
+            logger.info("metrics: written to {}".format(self.metrics_path))
+        if self.scheduler != None:
+            for host, stats in sorted(self.scheduler.stats().items()):
+                logger.info("scheduler {}: {}".format(host, stats))
@@ -1,5 +1,8 @@
 from django.db import models
 
+from crawler.lib.compression import get_codec
+import internet_archives.lib.const as C
+
 # Create your models here.
 
 class Url(models.Model):
@@ -30,6 +33,35 @@ class PageUrl(models.Model):
         return self.pageurl_string
 
 
+class HtmlBlob(models.Model):
+    """ 内容のハッシュ値をキーとして、同一のhtmlを1つだけ保存するテーブル
+    """
+
+    digest = models.CharField(
+            max_length=64,
+            unique=True
+    )
+    size = models.PositiveIntegerField()  # 元のhtmlのバイト数
+    data = models.BinaryField()
+    codec = models.CharField(
+            max_length=32,
+            blank=True,
+            default=""
+    )  # 空の場合はdataはutf-8でエンコードしたhtml
+    created_at = models.DateTimeField(
+            auto_now_add=True
+    )
+
+    def __str__(self):
+        return self.digest
+
+    def get_html(self):
+
+        if self.codec:
+            return get_codec(self.codec, C.HTML_DICT_DIR).decompress(bytes(self.data))
+        return bytes(self.data).decode("utf-8")
+
+
 class Source(models.Model):
 
     purl = models.ForeignKey(
@@ -39,8 +71,63 @@ class Source(models.Model):
     title = models.CharField(
             max_length=255
     )
-    html = models.TextField()
+    html = models.TextField(
+            blank=True
+    )
+    # 圧縮して保存する場合はhtmlを空にし、圧縮したデータとコーデック名を格納する
+    html_blob = models.BinaryField(
+            null=True,
+            blank=True
+    )
+    html_codec = models.CharField(
+            max_length=32,
+            blank=True,
+            default=""
+    )
+    # 重複を除いて保存する場合はhtmlを空にし、HtmlBlobを参照する
+    blob = models.ForeignKey(
+            HtmlBlob,
+            null=True,
+            blank=True,
+            on_delete=models.PROTECT
+    )
     published_at = models.DateTimeField()
 
     def __str__(self):
-        return self.title 
+        return self.title
+
+    def set_html(self, html, codec=None):
+        """ htmlを格納する、codecを指定した場合は圧縮して格納する
+
+        Args:
+            html (str): htmlの生テキスト
+            codec (str): コーデック名("zlib"、"zstd"、"zlib:<辞書名>"など)
+        """
+
+        if codec:
+            self.html = ""
+            self.html_blob = get_codec(codec, C.HTML_DICT_DIR).compress(html)
+            self.html_codec = codec
+        else:
+            self.html = html
+            self.html_blob = None
+            self.html_codec = ""
+        self._html_cache = html
+
+    def get_html(self):
+        """ htmlを返す、圧縮されている場合は初回の呼び出し時に展開する
+
+        Returns:
+            str: htmlの生テキスト
+        """
+
+        if getattr(self, "_html_cache", None) == None:
+            if self.blob_id != None:
+                self._html_cache = self.blob.get_html()
+            elif self.html_codec:
+                self._html_cache = get_codec(self.html_codec, C.HTML_DICT_DIR).decompress(
+                        bytes(self.html_blob)
+                )
+            else:
+                self._html_cache = self.html
+        return self._html_cache 
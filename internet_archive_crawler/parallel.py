@@ -0,0 +1,360 @@
+# coding=utf-8
+
+"""
+crawling_targetを複数のプロセスで並行にクローリングする機能を提供するモジュール
+
+記事のurlのホスト名のハッシュ値でワーカープロセスに振り分けるため、同じドメインの記事は1つのプロセスにまとまり、
+文字コードやページ送りのパターン等のドメインごとの学習結果をプロセス内で使い回せる
+実際のアクセス先は全てInternet Archiveであるため、Internet Archiveへの間隔は全ワーカーで共有する
+SharedTokenBucketで守り、ワーカー数を増やしてもInternet Archiveへのリクエスト数はHOST_RATEを超えない
+ワーカーはスクレイピングのみを行い、保存と読み込み位置の管理は親プロセスがまとめて行う
+"""
+
+import logging
+import multiprocessing
+import queue
+import signal
+from collections import deque
+from functools import partial
+from time import monotonic, sleep
+from urllib.parse import urlparse
+
+from django.db import connections
+from tqdm import tqdm
+
+from internet_archives.lib.cdx import CdxResolver
+from internet_archives.lib.crawled_index import CrawledIndex
+from internet_archives.lib.crawler import InternetArchivesCrawler
+from internet_archives.lib.target_reader import TargetReader
+from internet_archives.lib.writer import BufferedArticleWriter
+import crawler.lib.charset as charset
+from crawler.lib.circuit_breaker import CircuitOpenError
+from crawler.lib.driver_pool import reset_driver_pool
+from crawler.lib.http_cache import ResponseCache
+from crawler.lib.http_pool import reset_session_pool
+from crawler.lib.metrics import METRICS
+from crawler.lib.politeness import HostScheduler, SharedTokenBucket
+import crawler.lib.static_first as static_first_mode
+from crawler.lib.utils import fingerprint
+import crawler.lib.const as GC
+import internet_archives.lib.const as C
+
+
+def shard_of(url, n_shards):
+    """ urlのホスト名から振り分け先のワーカーの番号を求める
+
+    プロセスをまたいで同じ結果になるよう、hash()ではなくfingerprintを用いる
+    """
+
+    return fingerprint(urlparse(url.strip()).netloc.lower()) % n_shards
+
+
+def _build_crawler(shared=None, cache_path=None, cdx_cache_path=None, **kwargs):
+    """ ワーカー内でInternetArchivesCrawlerを作る、ParallelCrawlerの既定のfactory
+
+    SQLiteの接続はプロセス間で共有できないため、ResponseCacheとCdxResolverはワーカーごとに開く
+
+    Args:
+        shared (dict): ホスト名 -> 全ワーカーで共有するSharedTokenBucket
+        cache_path (str): ResponseCacheのパス、Noneの場合はキャッシュしない
+        cdx_cache_path (str): CdxResolverのキャッシュのパス、Noneの場合はCDX APIを使わない
+        kwargs: InternetArchivesCrawlerに渡す引数
+    """
+
+    scheduler = HostScheduler(shared=shared)
+    return InternetArchivesCrawler(
+            scheduler=scheduler,
+            cache=None if cache_path == None else ResponseCache(cache_path),
+            resolver=None if cdx_cache_path == None else CdxResolver(cache_path=cdx_cache_path, scheduler=scheduler),
+            **kwargs
+    )
+
+
+def _scrape(crawler, target, logger):
+    """ 1つの記事をスクレイピングする
+
+    サーキットブレーカが開いている間は待ち、それ以外の失敗は直列のクローラと同じく間をあけて
+    MAX_RETRIES_PER_TARGET回までやり直す
+
+    Returns:
+        tuple: (ScrapedArticleDataのリスト or None, 失敗した場合のエラーメッセージ or None)
+    """
+
+    failures = 0
+    while True:
+        try:
+            # Internet Archiveへの問い合わせはscrapeの中でサーキットブレーカを通す
+            return crawler.scrape(target.url, target.title, target.published_at, logger), None
+        except CircuitOpenError:
+            sleep(max(crawler.breaker.retry_after(), 1))
+        except Exception as e:
+            failures += 1
+            if failures >= C.MAX_RETRIES_PER_TARGET:
+                return None, "{}".format(e)
+            wait = max(crawler.breaker.retry_after(), 1)
+            logger.info("Retry {} after {:.1f}s by Exception: {}".format(target.url, wait, e))
+            sleep(wait)
+
+
+def _work(shard, inbox, outbox, factory, logger_name, metrics_enabled):
+    """ ワーカープロセスの処理
+
+    inboxから(seq, TargetLine)を受け取り、outboxに(shard, seq, ScrapedArticleDataのリスト, エラー)を返す
+    Noneを受け取ると、(サーキットブレーカの統計, METRICSのsnapshot, RENDER_STATSのrates)を返して終了する
+    """
+
+    # 中断は親プロセスがまとめて行う
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # fork前のDBの接続、HTTPの接続、WebDriver、集計を子プロセスで使わない
+    connections.close_all()
+    reset_session_pool()
+    reset_driver_pool()
+    charset.DETECTOR.reset()
+    static_first_mode.RENDER_STATS.reset()
+    METRICS.reset()
+    if metrics_enabled:
+        METRICS.enable()
+    else:
+        METRICS.disable()
+    logger = logging.getLogger(logger_name)
+    crawler = factory()
+    crawler.logger = logger
+    for seq, target in iter(inbox.get, None):
+        atcl_list, error = _scrape(crawler, target, logger)
+        outbox.put((shard, seq, atcl_list, error))
+    stats = (crawler.breaker.metrics(), METRICS.snapshot(), static_first_mode.RENDER_STATS.rates())
+    outbox.put((shard, None, stats, None))
+
+
+class ParallelCrawler:
+    """ crawling_targetをn_workers個のプロセスでクローリングするクラス
+
+    親プロセスがcrawling_targetを読み込み、ホスト名のハッシュ値でワーカーに振り分ける
+    ワーカーはfactoryで作ったInternetArchivesCrawlerのscrapeで記事を取得し、親プロセスのwriterが保存する
+    読み込み位置は、処理中の記事のうち最も前の行の手前までを保存が完了した時点で進める
+    ワーカーの計測値(METRICS)と描画省略率(RENDER_STATS)は終了時に親プロセスで合算する
+
+    Attributes:
+        n_workers (int): ワーカープロセスの数
+        factory (function): ワーカー内でInternetArchivesCrawler(またはscrape、breakerを持つもの)を作る関数
+            ResponseCache、CdxResolver等のSQLiteの接続はプロセス間で共有できないため、この中で作ること
+            既定ではcache_path、cdx_cache_pathを指定するとワーカーごとに開き、Internet Archiveへの間隔はia_bucketで守る
+        ia_bucket (SharedTokenBucket): 全ワーカーで共有するInternet Archiveへのリクエストのトークンバケット
+        queue_size (int): 1つのワーカーに同時に渡しておく記事の数
+        targets (TargetReader): crawling_targetの読み込み
+        writer (BufferedArticleWriter): 保存を行うもの(sinkを指定した場合はsink)
+        crawled (CrawledIndex): スクレイピング済みのurl
+        stats (dict): スクレイピングした記事、スクレイピング済みで読み飛ばした記事、諦めた記事の数
+    """
+
+    def __init__(
+            self,
+            n_workers=C.PARALLEL_WORKERS,
+            factory=None,
+            queue_size=C.PARALLEL_QUEUE_SIZE,
+            target_file=C.CRAWLING_TARGET_FILE,
+            resume=True,
+            dedup=False,
+            batch_size=C.WRITER_BATCH_SIZE,
+            flush_interval=C.WRITER_FLUSH_INTERVAL,
+            use_bloom=False,
+            sink=None,
+            sleep_time=1,
+            static_first=False,
+            sufficient=static_first_mode.is_sufficient,
+            prefetch=False,
+            cache_path=None,
+            cdx_cache_path=None,
+            metrics_path=None
+    ):
+
+        self.n_workers = n_workers
+        self.__ctx = multiprocessing.get_context(C.PARALLEL_START_METHOD)
+        self.ia_bucket = SharedTokenBucket(GC.HOST_RATE, GC.HOST_BURST, GC.HOST_MIN_INTERVAL, ctx=self.__ctx)
+        self.factory = factory or partial(
+                _build_crawler,
+                shared={urlparse(C.IA_PREFIX).netloc: self.ia_bucket},
+                cache_path=cache_path,
+                cdx_cache_path=cdx_cache_path,
+                sleep_time=sleep_time,
+                static_first=static_first,
+                sufficient=sufficient,
+                target_file=target_file,
+                prefetch=prefetch
+        )
+        self.queue_size = queue_size
+        self.targets = TargetReader(target_file, dedup=dedup)
+        if not resume:
+            self.targets.reset()
+        self.__checkpoint = None  # 保存が完了した行の終了位置
+        if sink == None:
+            self.writer = BufferedArticleWriter(batch_size=batch_size, flush_interval=flush_interval)
+        else:
+            self.writer = sink
+        self.sink = sink
+        self.crawled = CrawledIndex(use_bloom=use_bloom and sink == None)
+        self.writer.add_flush_callback(self.__commit)
+        self.stats = {"scraped": 0, "skipped": 0, "failed": 0}
+        self.static_first = static_first
+        self.metrics_path = metrics_path  # 指定した場合は計測を有効にし、一定間隔でJSONに書き出す
+        self.worker_metrics = {}  # ワーカーの番号 -> 終了時のサーキットブレーカの統計
+
+    def __commit(self):
+        """ 保存が完了した位置までcrawling_targetの読み込み位置を進める
+        """
+
+        if self.__checkpoint != None:
+            self.targets.commit(self.__checkpoint)
+
+    def __start(self, logger):
+
+        # Djangoの接続やWebDriverを引き継がないよう、起動前に閉じておく
+        connections.close_all()
+        ctx = self.__ctx
+        self.__outbox = ctx.Queue()
+        self.__inboxes = [ctx.Queue() for _ in range(self.n_workers)]
+        self.__workers = [
+                ctx.Process(
+                    target=_work,
+                    args=(shard, self.__inboxes[shard], self.__outbox, self.factory, logger.name, METRICS.enabled),
+                    daemon=True
+                )
+                for shard in range(self.n_workers)
+        ]
+        for worker in self.__workers:
+            worker.start()
+
+    def __stop(self, logger, timeout=C.PARALLEL_SHUTDOWN_TIMEOUT):
+        """ ワーカーに終了を伝え、終了しないものは強制終了する
+
+        キューに結果が残っているとワーカーが終了できないため、待つ間も結果を受け取る
+        中断した場合にこの時点で返ってきた記事は保存せず、再開時にもう一度クローリングする
+        """
+
+        for inbox in self.__inboxes:
+            inbox.put(None)
+        deadline = monotonic() + timeout
+        while any(w.is_alive() for w in self.__workers) and monotonic() < deadline:
+            self.__drain()
+            for worker in self.__workers:
+                worker.join(C.PARALLEL_POLL_INTERVAL / len(self.__workers))
+        self.__drain()
+        for worker in self.__workers:
+            if worker.is_alive():
+                logger.warning("terminate worker {}".format(worker.pid))
+                worker.terminate()
+                worker.join()
+
+    def __drain(self):
+        """ キューに残っている結果を読み捨て、ワーカーが終了時に返した統計のみ保持・合算する
+        """
+
+        while True:
+            try:
+                shard, done_seq, stats, _ = self.__outbox.get_nowait()
+            except queue.Empty:
+                return
+            if done_seq == None:
+                breaker_metrics, snapshot, rates = stats
+                self.worker_metrics[shard] = breaker_metrics
+                METRICS.merge(snapshot)
+                static_first_mode.RENDER_STATS.merge(rates)
+
+    def __receive(self):
+        """ ワーカーの結果を1つ受け取る、ワーカーが異常終了していればRuntimeErrorを送出する
+        """
+
+        while True:
+            try:
+                return self.__outbox.get(timeout=C.PARALLEL_POLL_INTERVAL)
+            except queue.Empty:
+                dead = [w for w in self.__workers if not w.is_alive()]
+                if dead:
+                    raise RuntimeError(
+                            "worker {} exited with code {}".format(dead[0].pid, dead[0].exitcode)
+                    )
+                # 結果が返ってこない間も、flush_intervalを過ぎたバッファを保存する
+                if hasattr(self.writer, "flush_if_due"):
+                    self.writer.flush_if_due()
+
+    def parse(self, logger):
+
+        if self.metrics_path != None:
+            METRICS.enable()
+            METRICS.start_snapshots(self.metrics_path)
+        self.crawled.load(None if self.sink == None else self.sink.crawled_urls())
+        logger.info("{} urls have already been crawled.".format(len(self.crawled)))
+        total, done = self.targets.count()
+        pbar = tqdm(total=total, initial=done)
+
+        self.__start(logger)
+        targets = iter(self.targets)
+        read_end, exhausted = self.targets.offset(), False
+        backlog = [deque() for _ in range(self.n_workers)]  # ワーカーに渡す前の(seq, TargetLine)
+        inflight = [0] * self.n_workers  # ワーカーに渡して結果を受け取っていない記事の数
+        outstanding = {}  # seq -> TargetLine、読み込んで保存が完了していない記事
+        max_buffered = self.n_workers * self.queue_size * C.PARALLEL_READ_AHEAD
+        seq = 0
+        try:
+            while True:
+                # 振り分け待ちが上限に達するまでcrawling_targetを読み込む
+                while not exhausted and len(outstanding) < max_buffered:
+                    target = next(targets, None)
+                    if target == None:
+                        exhausted = True
+                        break
+                    read_end = target.end
+                    if target.url in self.crawled:
+                        self.stats["skipped"] += 1
+                        pbar.update(1)
+                        continue
+                    seq += 1
+                    outstanding[seq] = target
+                    backlog[shard_of(target.url, self.n_workers)].append((seq, target))
+
+                for shard in range(self.n_workers):
+                    while backlog[shard] and inflight[shard] < self.queue_size:
+                        self.__inboxes[shard].put(backlog[shard].popleft())
+                        inflight[shard] += 1
+
+                if not outstanding:
+                    self.__checkpoint = read_end
+                    if exhausted:
+                        break
+                    continue
+
+                shard, done_seq, atcl_list, error = self.__receive()
+                inflight[shard] -= 1
+                target = outstanding.pop(done_seq)
+                # 保存が完了した時点で、処理中の記事より前の行までを読み込み済みとする
+                self.__checkpoint = min((t.start for t in outstanding.values()), default=read_end)
+                if error != None:
+                    self.stats["failed"] += 1
+                    logger.error("Give up {} after {} failures: {}".format(
+                        target.url, C.MAX_RETRIES_PER_TARGET, error))
+                elif atcl_list != None:
+                    self.stats["scraped"] += 1
+                    self.writer.add(target.url, atcl_list)
+                    self.crawled.add(target.url)
+                pbar.update(1)
+        except KeyboardInterrupt:
+            logger.warning("Interrupted. {} targets in progress will be crawled on resume.".format(
+                len(outstanding)))
+        finally:
+            pbar.close()
+            self.__stop(logger)
+            self.writer.flush()
+            if self.metrics_path != None:
+                METRICS.stop_snapshots()
+
+        self.__report(logger)
+
+    def __report(self, logger):
+
+        for shard, metrics in sorted(self.worker_metrics.items()):
+            logger.info("worker {} circuit: {}".format(shard, metrics))
+        if self.static_first:
+            static_first_mode.RENDER_STATS.report(logger)
+        logger.info("parallel: {} scraped, {} skipped, {} failed with {} workers".format(
+            self.stats["scraped"], self.stats["skipped"], self.stats["failed"], self.n_workers))
+        self.writer.report(logger)
@@ -0,0 +1,213 @@
+# coding=utf-8
+
+"""
+Sourceに保存したhtmlの保存形式(圧縮、重複排除)を扱う機能を提供するモジュール
+"""
+
+from collections import OrderedDict, defaultdict
+from hashlib import blake2b
+from urllib.parse import urlparse
+
+from django.db import transaction
+from django.db.models.functions import Length
+
+from internet_archives.models import HtmlBlob, Source
+import internet_archives.lib.const as C
+from crawler.lib.compression import get_codec
+import crawler.lib.page_navigator as navi
+
+
+def html_digest(html):
+    """ htmlの内容のハッシュ値(BLAKE2b, 256bit)を16進数の文字列で返す
+    """
+
+    return blake2b(html.encode("utf-8"), digest_size=32).hexdigest()
+
+
+class BlobStore:
+    """ htmlをHtmlBlobに重複なく保存し、その主キーを返すクラス
+
+    直近に保存・参照したハッシュ値と主キーの対応をメモリ上に保持し、DBへの問い合わせを減らす
+
+    Attributes:
+        compression (str): 指定した場合、このコーデックでHtmlBlob.dataを圧縮する
+        cache_size (int): メモリ上に保持するハッシュ値の数
+    """
+
+    def __init__(self, compression=None, cache_size=C.BLOB_CACHE_SIZE):
+
+        self.compression = compression
+        self.cache_size = cache_size
+        self.stats = {"blobs": 0, "reused": 0}
+        self.__cache = OrderedDict()  # ハッシュ値 -> HtmlBlobの主キー
+
+    def __remember(self, digest, pk):
+
+        self.__cache[digest] = pk
+        self.__cache.move_to_end(digest)
+        if len(self.__cache) > self.cache_size:
+            self.__cache.popitem(last=False)
+
+    def __new_blob(self, digest, html):
+
+        data = html.encode("utf-8")
+        blob = HtmlBlob(digest=digest, size=len(data), codec=self.compression or "")
+        blob.data = get_codec(self.compression, C.HTML_DICT_DIR).compress(html) if self.compression else data
+        return blob
+
+    def resolve(self, htmls):
+        """ htmlのリストをHtmlBlobに保存し、それぞれの主キーを返す
+
+        既に保存されているhtmlは保存せず、その主キーを返す
+        トランザクションの中で呼び出すこと
+
+        Args:
+            htmls (list): htmlの生テキストのリスト
+
+        Returns:
+            list: HtmlBlobの主キーのリスト、htmlが空の場合はNone
+        """
+
+        digests = [html_digest(html) if html else None for html in htmls]
+        found = {}  # ハッシュ値 -> HtmlBlobの主キー
+        for digest in digests:
+            if digest != None and digest in self.__cache:
+                found[digest] = self.__cache[digest]
+        missing = {d for d in digests if d != None and d not in found}
+        if missing:
+            for digest, pk in HtmlBlob.objects.filter(digest__in=missing).values_list("digest", "pk"):
+                found[digest] = pk
+                missing.discard(digest)
+        n_new = 0
+        if missing:
+            new_blobs, seen = [], set()
+            for digest, html in zip(digests, htmls):
+                if digest in missing and digest not in seen:
+                    seen.add(digest)
+                    new_blobs.append(self.__new_blob(digest, html))
+            # 他のプロセスが同時に保存した場合に備え、重複は無視して主キーを読み直す
+            HtmlBlob.objects.bulk_create(new_blobs, ignore_conflicts=True)
+            for digest, pk in HtmlBlob.objects.filter(digest__in=missing).values_list("digest", "pk"):
+                found[digest] = pk
+            n_new = len(new_blobs)
+
+        pks = [None if digest == None else found[digest] for digest in digests]
+        n_reused = sum(1 for pk in pks if pk != None) - len(missing)
+        # ロールバックされた場合に保存されていないHtmlBlobの主キーを使わないよう、コミットした後に保持する
+        transaction.on_commit(lambda: self.__committed(found, n_new, n_reused))
+        return pks
+
+    def __committed(self, found, n_new, n_reused):
+
+        for digest, pk in found.items():
+            self.__remember(digest, pk)
+        self.stats["blobs"] += n_new
+        self.stats["reused"] += n_reused
+
+
+def compress_existing_sources(codec, batch_size=C.MIGRATION_BATCH_SIZE, logger=None):
+    """ 圧縮されていないSourceのhtmlを圧縮した形式に変換する
+
+    主キーの順にbatch_size件ずつ変換するため、途中で止めても再度実行すれば続きから変換される
+
+    Args:
+        codec (str): コーデック名("zlib"、"zstd"、"zlib:<辞書名>"など)
+        batch_size (int): 1回のトランザクションで変換する件数
+        logger (logger): loggerインスタンス
+
+    Returns:
+        tuple: (変換した件数, 変換前のバイト数, 変換後のバイト数)
+    """
+
+    n, raw_bytes, compressed_bytes, last_pk = 0, 0, 0, 0
+    while True:
+        sources = list(
+                Source.objects.filter(pk__gt=last_pk, html_codec="")
+                .exclude(html="")
+                .order_by("pk")[:batch_size]
+        )
+        if not sources:
+            break
+        for source in sources:
+            html = source.html
+            source.set_html(html, codec)
+            raw_bytes += len(html.encode("utf-8"))
+            compressed_bytes += len(source.html_blob)
+        with transaction.atomic():
+            Source.objects.bulk_update(sources, ["html", "html_blob", "html_codec"])
+        n += len(sources)
+        last_pk = sources[-1].pk
+        if logger != None:
+            logger.info("compressed {} sources ({} -> {} bytes)".format(n, raw_bytes, compressed_bytes))
+
+    return n, raw_bytes, compressed_bytes
+
+
+def dedup_existing_sources(compression=None, batch_size=C.MIGRATION_BATCH_SIZE, logger=None):
+    """ HtmlBlobを参照していないSourceのhtmlをHtmlBlobに移す
+
+    主キーの順にbatch_size件ずつ変換するため、途中で止めても再度実行すれば続きから変換される
+
+    Args:
+        compression (str): 指定した場合、このコーデックでHtmlBlob.dataを圧縮する
+        batch_size (int): 1回のトランザクションで変換する件数
+        logger (logger): loggerインスタンス
+
+    Returns:
+        int: 変換した件数
+    """
+
+    store, n, last_pk = BlobStore(compression), 0, 0
+    while True:
+        sources = list(
+                Source.objects.filter(pk__gt=last_pk, blob__isnull=True)
+                .order_by("pk")[:batch_size]
+        )
+        if not sources:
+            break
+        last_pk = sources[-1].pk
+        sources = [source for source in sources if source.get_html()]
+        with transaction.atomic():
+            for source, pk in zip(sources, store.resolve([source.get_html() for source in sources])):
+                source.blob_id = pk
+                source.html, source.html_blob, source.html_codec = "", None, ""
+            Source.objects.bulk_update(sources, ["blob", "html", "html_blob", "html_codec"])
+        n += len(sources)
+        if logger != None:
+            logger.info("moved {} sources to blobs ({} blobs)".format(n, store.stats["blobs"]))
+
+    return n
+
+
+def dedup_stats():
+    """ ドメインごとの重複排除の効果を集計する
+
+    Internet Archive上のurlはキャッシュ元のドメインで集計する
+
+    Returns:
+        dict: ドメイン -> {"sources", "blobs", "logical_bytes", "stored_bytes", "dedup_ratio"}
+            logical_bytes は元のhtmlのバイト数の合計、stored_bytes はHtmlBlob.data(圧縮した場合は圧縮後)のバイト数の合計
+    """
+
+    sources = defaultdict(int)
+    logical = defaultdict(int)
+    blobs = defaultdict(dict)  # ドメイン -> {blob_id: 圧縮後のバイト数}
+    rows = Source.objects.filter(blob__isnull=False).annotate(stored=Length("blob__data")).values_list(
+            "purl__pageurl_string", "blob_id", "blob__size", "stored"
+    ).iterator(chunk_size=C.CRAWLED_INDEX_CHUNK_SIZE)
+    for page_url, blob_id, size, stored in rows:
+        domain = urlparse(navi.original_url(page_url)).netloc
+        sources[domain] += 1
+        logical[domain] += size
+        blobs[domain][blob_id] = stored
+
+    return {
+            domain: {
+                "sources": sources[domain],
+                "blobs": len(blobs[domain]),
+                "logical_bytes": logical[domain],
+                "stored_bytes": sum(blobs[domain].values()),
+                "dedup_ratio": float(sources[domain]) / len(blobs[domain])
+            }
+            for domain in sources
+    }
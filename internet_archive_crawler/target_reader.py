@@ -0,0 +1,153 @@
+# coding=utf-8
+
+"""
+crawling_targetを先頭から順に読み込み、読み込んだ位置を保存する機能を提供するモジュール
+"""
+
+import os
+from collections import namedtuple
+
+import internet_archives.lib.const as C
+from crawler.lib.utils import fingerprint
+
+# crawling_targetの1行
+# start, endはファイル中の行の開始位置と終了位置(バイト)
+TargetLine = namedtuple("TargetLine", ("start", "end", "url", "title", "published_at"))
+
+
+class TargetReader:
+    """ url|||title|||published_at形式のファイルを1行ずつ読み込むクラス
+
+    commitで保存した位置(checkpoint)から読み込みを再開できる
+
+    Attributes:
+        path (str): 読み込むファイルのパス
+        checkpoint_path (str): 読み込んだ位置を保存するファイルのパス
+        dedup (bool): 同じurlの行を読み飛ばすか否か
+    """
+
+    def __init__(self, path=C.CRAWLING_TARGET_FILE, checkpoint_path=None, dedup=False):
+
+        self.path = path
+        self.checkpoint_path = checkpoint_path or path + C.CHECKPOINT_SUFFIX
+        self.dedup = dedup
+
+    def offset(self):
+        """ 保存されている読み込み位置を返す
+
+        Returns:
+            int: ファイル先頭からのバイト数、保存されていなければ0
+        """
+
+        try:
+            with open(self.checkpoint_path) as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def commit(self, offset):
+        """ 読み込み位置を保存する
+
+        書き込み途中で停止しても壊れないよう、一時ファイルに書いてから置き換える
+
+        Args:
+            offset (int): ファイル先頭からのバイト数
+        """
+
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def reset(self):
+        """ 保存されている読み込み位置を削除し、先頭から読み込むようにする
+        """
+
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+    def count(self):
+        """ 読み込む行数と、読み込み位置までの行数を返す
+
+        通常は行の内容は解釈せず、改行の数のみを数える(形式が正しくない行も数える)
+        dedupの場合のみ、__iter__と同じく形式が正しくない行と重複したurlの行を除いて数える
+        __iter__は読み込み位置から重複を判定するため、読み込み位置の前後でそれぞれ判定する
+
+        Returns:
+            tuple: (全体の行数, 読み込み位置までの行数)
+        """
+
+        if not self.dedup:
+            return self.__count_lines(self.offset())
+
+        offset = self.offset()
+        total, done, pos = 0, 0, 0
+        seen = (set(), set())  # 読み込み位置の前、後で判定したurlのハッシュ値
+        with open(self.path, "rb") as f:
+            for raw in f:
+                start, pos = pos, pos + len(raw)
+                fields = self.__fields(raw)
+                if fields == None:
+                    continue
+                fps, fp = seen[start >= offset], fingerprint(fields[0])
+                if fp in fps:
+                    continue
+                fps.add(fp)
+                total += 1
+                if start < offset:
+                    done += 1
+        return total, done
+
+    def __count_lines(self, offset):
+        """ COUNT_CHUNK_SIZEずつ読み込み、ファイルの改行の数と読み込み位置までの改行の数を数える
+        """
+
+        total, done, pos, last = 0, 0, 0, b"\n"
+        with open(self.path, "rb") as f:
+            for chunk in iter(lambda: f.read(C.COUNT_CHUNK_SIZE), b""):
+                n = chunk.count(b"\n")
+                total += n
+                if pos + len(chunk) <= offset:
+                    done += n
+                elif pos < offset:
+                    done += chunk.count(b"\n", 0, offset - pos)
+                pos += len(chunk)
+                last = chunk[-1:]
+        if last != b"\n":  # 末尾に改行がない場合
+            total += 1
+            if offset >= pos:
+                done += 1
+        return total, done
+
+    @staticmethod
+    def __fields(raw):
+        """ 1行をurl、title、published_atに分ける
+
+        Returns:
+            list: [url, title, published_at]、形式が正しくない場合はNone
+        """
+
+        fields = raw.decode("utf-8").strip().split("|||")[:3]
+        return fields if len(fields) == 3 else None
+
+    def __iter__(self):
+        """ 読み込み位置から1行ずつTargetLineを返す
+        """
+
+        seen = set()
+        with open(self.path, "rb") as f:
+            pos = self.offset()
+            f.seek(pos)
+            for raw in f:
+                start, pos = pos, pos + len(raw)
+                fields = self.__fields(raw)
+                if fields == None:
+                    continue
+                if self.dedup:
+                    fp = fingerprint(fields[0])
+                    if fp in seen:
+                        continue
+                    seen.add(fp)
+                yield TargetLine(start, pos, *fields)
@@ -0,0 +1,272 @@
+# coding=utf-8
+
+"""
+スクレイピングした記事をまとめてDBに保存する機能を提供するモジュール
+"""
+
+import atexit
+import threading
+import weakref
+from collections import OrderedDict
+from time import monotonic
+
+from django.db import transaction
+
+from internet_archives.models import Url, PageUrl, Source
+import internet_archives.lib.const as C
+from internet_archives.lib.storage import BlobStore
+from crawler.lib.metrics import METRICS
+
+_writers = weakref.WeakSet()  # プロセス終了時にバッファに残ったものを保存するBufferedArticleWriter
+_writers_lock = threading.Lock()
+
+
+def _close_all():
+
+    for writer in list(_writers):
+        if len(writer):
+            writer.close()
+
+
+def _track(writer):
+    """ writerをプロセス終了時に閉じる対象に加える
+
+    atexitの関数は登録と逆順に呼ばれるため、最初のwriterを作った時点で1回だけ登録する
+    (それより前に登録された一時ディレクトリの削除などより先に保存する)
+    """
+
+    with _writers_lock:
+        if not _writers:
+            atexit.unregister(_close_all)
+            atexit.register(_close_all)
+        _writers.add(writer)
+
+
+class BufferedArticleWriter:
+    """ ScrapedArticleDataをバッファに溜め、bulk_createでまとめて保存するクラス
+
+    バッファに溜まったurlの数がbatch_sizeに達するか、前回の保存からflush_interval秒経過した時点で保存する
+    flush_intervalはタイマーではなくaddやflush_if_dueを呼んだ時点で判定するため、
+    記事の追加が止まっている間も保存したい場合は、呼び出し側で定期的にflush_if_dueを呼ぶ
+    (DjangoのDB接続はスレッドごとに作られるため、保存は呼び出し側のスレッドで行う)
+    プロセス終了時にもバッファに残ったものを保存する
+    既にDBにあるurlは、get_or_createを用いていた時と同様に何も保存しない
+
+    Attributes:
+        batch_size (int): 1回で保存するurlの数
+        flush_interval (float): 保存する間隔の最大秒数
+        compression (str): 指定した場合、このコーデックでhtmlを圧縮して保存する
+        blobs (BlobStore): dedup=Trueの場合、同一のhtmlを1つのHtmlBlobにまとめて保存する
+        stats (dict): 保存した回数、url数、行数、所要時間の累計
+    """
+
+    def __init__(
+            self,
+            batch_size=C.WRITER_BATCH_SIZE,
+            flush_interval=C.WRITER_FLUSH_INTERVAL,
+            logger=None,
+            compression=None,
+            dedup=False
+    ):
+
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.logger = logger
+        self.compression = compression
+        self.blobs = BlobStore(compression) if dedup else None
+        self.stats = {"flushes": 0, "urls": 0, "rows": 0, "seconds": 0.0}
+        self.__pending = OrderedDict()  # url -> ScrapedArticleDataのリスト
+        self.__partial = {}  # url -> add_pageで渡され、end_targetを待っているScrapedArticleDataのリスト
+        self.__callbacks = []
+        self.__last_flush = monotonic()
+        self.__lock = threading.Lock()
+        self.__flush_lock = threading.Lock()
+        _track(self)
+
+    def __contains__(self, url):
+
+        with self.__lock:
+            return url in self.__pending
+
+    def __len__(self):
+
+        with self.__lock:
+            return len(self.__pending)
+
+    def add_flush_callback(self, callback):
+        """ 保存が完了するたびに呼び出す関数を登録する
+
+        Args:
+            callback (function): 引数なしで呼び出される関数
+        """
+
+        self.__callbacks.append(callback)
+
+    def add(self, url, atcl_list):
+        """ 1つの記事のScrapedArticleDataのリストをバッファに追加する
+
+        Args:
+            url (str): 記事のurl(Url.url_string)
+            atcl_list (list): ScrapedArticleDataのリスト
+        """
+
+        with self.__lock:
+            if url not in self.__pending:
+                self.__pending[url] = list(atcl_list)
+            full = len(self.__pending) >= self.batch_size
+        if full:
+            self.flush()
+        else:
+            self.flush_if_due()
+
+    def flush_if_due(self):
+        """ バッファが空でなく、前回の保存からflush_interval秒経過していれば保存する
+
+        Returns:
+            bool: 保存した場合はTrue
+        """
+
+        with self.__lock:
+            due = self.__pending and monotonic() - self.__last_flush >= self.flush_interval
+        if due:
+            self.flush()
+        return bool(due)
+
+    def add_page(self, url, atcl):
+        """ 記事の1ページを追加する、end_targetが呼ばれるまで保存の対象にしない
+
+        Args:
+            url (str): 記事のurl(Url.url_string)
+            atcl (ScrapedArticleData): 記事の1ページ
+        """
+
+        with self.__lock:
+            self.__partial.setdefault(url, []).append(atcl)
+
+    def end_target(self, url):
+        """ add_pageで追加した記事のページを、addと同様にバッファに追加する
+        """
+
+        with self.__lock:
+            atcl_list = self.__partial.pop(url, [])
+        self.add(url, atcl_list)
+
+    def discard(self, url):
+        """ add_pageで追加した記事のページを破棄する
+        """
+
+        with self.__lock:
+            self.__partial.pop(url, None)
+
+    def flush(self):
+        """ バッファに溜まったものを保存する
+        """
+
+        with self.__flush_lock:
+            with self.__lock:
+                batch, self.__pending = self.__pending, OrderedDict()
+                self.__last_flush = monotonic()
+            if batch:
+                start = monotonic()
+                n_urls, n_rows = self.__write(batch)
+                elapsed = monotonic() - start
+                self.stats["flushes"] += 1
+                self.stats["urls"] += n_urls
+                self.stats["rows"] += n_rows
+                self.stats["seconds"] += elapsed
+                METRICS.observe("writer_flush_seconds", elapsed)
+                METRICS.inc("writer_rows_total", n_rows)
+                if self.logger != None:
+                    self.logger.debug(
+                            "saved {} rows of {} urls in {:.3f}s".format(n_rows, n_urls, elapsed)
+                    )
+            for callback in self.__callbacks:
+                callback()
+
+    @transaction.atomic
+    def __write(self, batch):
+        """ バッファの内容をUrl -> PageUrl -> Sourceの順にbulk_createで保存する
+
+        bulk_createで主キーが返されないDBの場合は、保存した行を読み直して外部キーを設定する
+
+        Returns:
+            tuple: (保存したurlの数, 保存した行数)
+        """
+
+        existing = set(
+                Url.objects.filter(url_string__in=list(batch)).values_list("url_string", flat=True)
+        )
+        urls = Url.objects.bulk_create(
+                [Url(url_string=url) for url in batch if url not in existing]
+        )
+        if any(url.pk == None for url in urls):
+            urls = list(Url.objects.filter(url_string__in=[url.url_string for url in urls]))
+
+        purls, atcls = [], []
+        for url in urls:
+            for atcl in batch[url.url_string]:
+                purls.append(
+                        PageUrl(
+                            url=url,
+                            pageurl_string=atcl.page_url,
+                            page=atcl.page,
+                            status_code=atcl.status_code
+                        )
+                )
+                atcls.append(atcl)
+        purls = PageUrl.objects.bulk_create(purls)
+        if any(purl.pk == None for purl in purls):
+            saved = {
+                    (purl.url_id, purl.page, purl.pageurl_string): purl
+                    for purl in PageUrl.objects.filter(url__in=urls)
+            }
+            purls = [saved[(purl.url_id, purl.page, purl.pageurl_string)] for purl in purls]
+
+        if self.blobs != None:
+            blob_ids = self.blobs.resolve([atcl.html for atcl in atcls])
+        else:
+            blob_ids = [None] * len(atcls)
+        sources = []
+        for purl, atcl, blob_id in zip(purls, atcls, blob_ids):
+            source = Source(
+                    purl=purl,
+                    title=atcl.title,
+                    published_at=atcl.published_at
+            )
+            if blob_id != None:
+                source.blob_id = blob_id
+            else:
+                source.set_html(atcl.html, self.compression)
+            sources.append(source)
+        sources = Source.objects.bulk_create(sources)
+
+        return len(urls), len(urls) + len(purls) + len(sources)
+
+    def rows_per_sec(self):
+        """ これまでの保存の平均スループット(行/秒)を返す
+        """
+
+        if self.stats["seconds"] == 0:
+            return 0.0
+        return self.stats["rows"] / self.stats["seconds"]
+
+    def report(self, logger):
+        """ これまでの保存の統計をloggerに出力する
+        """
+
+        logger.info(
+                "writer: {} urls, {} rows in {} flushes ({:.1f} rows/sec, batch_size={})".format(
+                    self.stats["urls"], self.stats["rows"], self.stats["flushes"],
+                    self.rows_per_sec(), self.batch_size)
+        )
+        if self.blobs != None:
+            logger.info(
+                    "writer: {} new html blobs, {} pages reused an existing blob".format(
+                        self.blobs.stats["blobs"], self.blobs.stats["reused"])
+            )
+
+    def close(self):
+        """ バッファに残ったものを保存する
+        """
+
+        self.flush()
@@ -0,0 +1,221 @@
+# coding=utf-8
+
+"""
+utils.getを非同期に実行する機能を提供するモジュール
+"""
+
+import asyncio
+import threading
+import weakref
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import urlparse
+
+import crawler.lib.const as GC
+import crawler.lib.utils as utils
+
+class AsyncFetcher:
+    """ 全体とホストごとの同時接続数を制限しつつ、utils.getを並行に実行するクラス
+
+    Attributes:
+        logger (logger): loggerインスタンス
+        sleep_time (int): utils.getに渡すsleepの最大秒数
+        max_concurrency (int): 全体で同時に実行するリクエストの最大数
+        max_per_host (int): 1ホストあたりに同時に実行するリクエストの最大数
+        scheduler (HostScheduler): 指定した場合、ホストごとのリクエストの間隔をこれで制御する
+        cache (ResponseCache): 指定した場合、utils.getでレスポンスのキャッシュを使う
+    """
+
+    def __init__(
+            self,
+            logger,
+            sleep_time,
+            max_concurrency=GC.ASYNC_MAX_CONCURRENCY,
+            max_per_host=GC.ASYNC_MAX_PER_HOST,
+            timeout=GC.TIMEOUT,
+            scheduler=None,
+            cache=None
+    ):
+
+        self.logger = logger
+        self.sleep_time = sleep_time
+        self.max_concurrency = max_concurrency
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.scheduler = scheduler
+        self.cache = cache
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        # asyncio.Semaphoreは最初に使ったイベントループに結び付くため、ループごとに作る
+        self.__sems = weakref.WeakKeyDictionary()  # イベントループ -> (全体のSemaphore, ホスト -> Semaphore)
+
+    def __semaphores(self, host):
+        """ 実行中のイベントループで使う、全体とhostのSemaphoreを返す
+        """
+
+        loop = asyncio.get_running_loop()
+        if loop not in self.__sems:
+            self.__sems[loop] = (
+                    asyncio.Semaphore(self.max_concurrency),
+                    defaultdict(lambda: asyncio.Semaphore(self.max_per_host))
+            )
+        global_sem, host_sems = self.__sems[loop]
+        return global_sem, host_sems[host]
+
+    @staticmethod
+    def __release(global_sem, host_sem):
+
+        host_sem.release()
+        global_sem.release()
+
+    async def get(self, url, use_selenium=False, is_ia=False):
+        """ urlにGETリクエストを送り、htmlを取得する
+
+        Args:
+            url (str): GETリクエストを送るurl
+            use_selenium (bool): seleniumを使用するか否か
+            is_ia (bool): Internet Archiveのページか否か
+
+        Returns:
+            tuple: (html, status_code) utils.getと同じ形式
+        """
+
+        global_sem, host_sem = self.__semaphores(urlparse(url).netloc)
+
+        # タイムアウトしても実行中のutils.getは止められないため、同時接続数の枠はスレッドでの実行が終わるまで保持する
+        await global_sem.acquire()
+        try:
+            await host_sem.acquire()
+        except BaseException:
+            global_sem.release()
+            raise
+        loop = asyncio.get_running_loop()
+        func = partial(
+                utils.get,
+                url,
+                self.logger,
+                self.sleep_time,
+                use_selenium=use_selenium,
+                is_ia=is_ia,
+                scheduler=self.scheduler,
+                cache=self.cache
+        )
+        try:
+            future = loop.run_in_executor(self.executor, func)
+        except BaseException:
+            self.__release(global_sem, host_sem)
+            raise
+        # 完了のコールバックはイベントループで呼ばれるため、Semaphoreを操作できる
+        future.add_done_callback(lambda _: self.__release(global_sem, host_sem))
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            self.logger.error("async timeout on {}".format(url))
+            raise TimeoutError
+
+    async def fetch_many(self, urls, use_selenium=False, is_ia=False):
+        """ 複数のurlを並行に取得する
+
+        Args:
+            urls (list): GETリクエストを送るurlのリスト
+            use_selenium (bool): seleniumを使用するか否か
+            is_ia (bool): Internet Archiveのページか否か
+
+        Returns:
+            list: urlsと同じ順序の(html, status_code)のリスト、例外が発生した場合はその例外が格納される
+        """
+
+        return await asyncio.gather(
+                *[self.get(url, use_selenium=use_selenium, is_ia=is_ia) for url in urls],
+                return_exceptions=True
+        )
+
+    def close(self):
+
+        self.executor.shutdown(wait=False)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """ async_getで共有するThreadPoolExecutorを返す
+
+    初回呼び出し時に生成する
+
+    Returns:
+        ThreadPoolExecutor: 共有のThreadPoolExecutor
+    """
+
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=GC.ASYNC_MAX_CONCURRENCY)
+        return _executor
+
+
+async def async_get(url, logger, sleep_time, use_selenium=False, is_ia=False):
+    """ utils.getの非同期版
+
+    呼び出しごとにスレッドを作らないよう、get_executorのスレッドで実行する
+
+    Args:
+        url (str): GETリクエストを送るurl
+        logger (logger): loggerインスタンス
+        sleep_time (int): sleepをはさむ最大秒数
+        use_selenium (bool): seleniumを使用するか否か
+        is_ia (bool): Internet Archiveのページか否か
+
+    Returns:
+        tuple: (html, status_code)
+    """
+
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(
+            get_executor(),
+            partial(utils.get, url, logger, sleep_time, use_selenium=use_selenium, is_ia=is_ia)
+    )
+    try:
+        return await asyncio.wait_for(future, GC.TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.error("async timeout on {}".format(url))
+        raise TimeoutError
+
+
+def fetch_many(
+        urls,
+        logger,
+        sleep_time,
+        use_selenium=False,
+        is_ia=False,
+        max_concurrency=GC.ASYNC_MAX_CONCURRENCY,
+        max_per_host=GC.ASYNC_MAX_PER_HOST
+):
+    """ 複数のurlを並行に取得する同期インタフェース
+
+    Args:
+        urls (list): GETリクエストを送るurlのリスト
+        logger (logger): loggerインスタンス
+        sleep_time (int): sleepをはさむ最大秒数
+        use_selenium (bool): seleniumを使用するか否か
+        is_ia (bool): Internet Archiveのページか否か
+        max_concurrency (int): 全体で同時に実行するリクエストの最大数
+        max_per_host (int): 1ホストあたりに同時に実行するリクエストの最大数
+
+    Returns:
+        list: urlsと同じ順序の(html, status_code)のリスト、例外が発生した場合はその例外が格納される
+    """
+
+    fetcher = AsyncFetcher(
+            logger,
+            sleep_time,
+            max_concurrency=max_concurrency,
+            max_per_host=max_per_host
+    )
+    try:
+        return asyncio.run(
+                fetcher.fetch_many(urls, use_selenium=use_selenium, is_ia=is_ia)
+        )
+    finally:
+        fetcher.close()
@@ -0,0 +1,208 @@
+# coding=utf-8
+
+"""
+レスポンスの文字コードを判定する機能を提供するモジュール
+
+cchardetでレスポンス全体を判定すると時間がかかるため、以下の順に判定し、最初に見つかったものを使う
+    1. Content-Typeヘッダのcharset
+    2. BOM
+    3. 先頭の数KBにあるmetaタグ(またはxml宣言)のcharset
+    4. 同じドメイン(Internet Archive上のurlはキャッシュ元のドメイン)で前回判定した文字コード(先頭部分を正しくデコードできる場合のみ)
+    5. 先頭の一部に対するcchardetの判定結果
+    6. utf-8
+"""
+
+import codecs
+import re
+import threading
+from collections import Counter
+from urllib.parse import urlparse
+
+import cchardet
+
+import crawler.lib.const as GC
+from crawler.lib.page_navigator import original_url
+
+HEADER_CHARSET_PAT = re.compile(r"charset\s*=\s*[\"']?\s*([\w.:\-]+)", re.I)
+META_CHARSET_PAT = re.compile(
+        rb"<meta[^>]+?charset\s*=\s*[\"']?\s*([\w.:\-]+)|<\?xml[^>]+?encoding\s*=\s*[\"']([\w.:\-]+)",
+        re.I
+)
+BOMS = (
+        (codecs.BOM_UTF32_LE, "utf-32"),
+        (codecs.BOM_UTF32_BE, "utf-32"),
+        (codecs.BOM_UTF8, "utf-8-sig"),
+        (codecs.BOM_UTF16_LE, "utf-16"),
+        (codecs.BOM_UTF16_BE, "utf-16"),
+)
+# Shift_JISと宣言していても機種依存文字(①、髙など)を含むページが多いため、上位互換のcp932で読む
+SUPERSETS = {
+        "shift_jis": "cp932",
+}
+
+
+def normalize(name):
+    """ 文字コード名をPythonのcodec名に正規化する
+
+    Args:
+        name (str): 文字コード名(Shift_JIS, EUC-JP, x-sjis等)
+
+    Returns:
+        str: codec名、Pythonで扱えない文字コードの場合はNone
+    """
+
+    if not name:
+        return None
+    try:
+        codec = codecs.lookup(name.strip()).name
+    except LookupError:
+        return None
+    return SUPERSETS.get(codec, codec)
+
+
+def from_header(content_type):
+    """ Content-Typeヘッダからcharsetを取り出す
+    """
+
+    if not content_type:
+        return None
+    m = HEADER_CHARSET_PAT.search(content_type)
+    return normalize(m.group(1)) if m else None
+
+
+def from_bom(content):
+    """ 先頭のBOMから文字コードを判定する
+    """
+
+    for bom, name in BOMS:
+        if content.startswith(bom):
+            return name
+    return None
+
+
+def from_meta(content, size=GC.CHARSET_META_BYTES):
+    """ 先頭size bytesにあるmetaタグ(またはxml宣言)からcharsetを取り出す
+    """
+
+    m = META_CHARSET_PAT.search(content[:size])
+    if m == None:
+        return None
+    name = normalize((m.group(1) or m.group(2)).decode("ascii", "ignore"))
+    if name in ("utf-16", "utf-16-le", "utf-16-be"):
+        return "utf-8"  # BOMが無いのにutf-16と宣言しているものはasciiで読めている時点で誤り
+    return name
+
+
+def domain_of(url):
+    """ 判定結果を記録するドメインを返す
+
+    Internet Archive上のurlはすべてweb.archive.orgになるため、キャッシュ元のurlのドメインとする
+    """
+
+    return urlparse(original_url(url)).netloc
+
+
+def decodable(content, encoding, size=GC.CHARSET_SAMPLE_BYTES):
+    """ 先頭size bytesをencodingでデコードできるか否か
+
+    末尾でマルチバイト文字が途切れている場合はデコードできるものとみなす
+    """
+
+    try:
+        codecs.getincrementaldecoder(encoding)().decode(content[:size], final=False)
+    except (UnicodeDecodeError, LookupError):
+        return False
+    return True
+
+
+class CharsetDetector:
+    """ 文字コードを判定し、ドメインごとに判定結果を保持するクラス
+
+    Attributes:
+        sample_size (int): cchardetで判定する先頭部分のbytes数
+        meta_size (int): metaタグを探す先頭部分のbytes数
+        stats (Counter): 判定に用いた方法(header, bom, meta, domain, detect, default)ごとの回数
+    """
+
+    def __init__(self, sample_size=GC.CHARSET_SAMPLE_BYTES, meta_size=GC.CHARSET_META_BYTES):
+
+        self.sample_size = sample_size
+        self.meta_size = meta_size
+        self.stats = Counter()
+        self.__domains = {}  # ドメイン -> 文字コード
+        self.__lock = threading.Lock()
+
+    def detect(self, content, content_type=None, url=None):
+        """ レスポンスの文字コードを判定する
+
+        Args:
+            content (bytes): レスポンスの本文
+            content_type (str): Content-Typeヘッダ
+            url (str): レスポンスのurl、指定した場合はドメインごとの判定結果を利用・更新する
+
+        Returns:
+            str: 文字コード(codec名)
+        """
+
+        encoding, method = self.__detect(content, content_type, url)
+        with self.__lock:
+            self.stats[method] += 1
+            if url != None and method != "default":
+                self.__domains[domain_of(url)] = encoding
+        return encoding
+
+    def __detect(self, content, content_type, url):
+
+        encoding = from_header(content_type)
+        if encoding != None:
+            return encoding, "header"
+        encoding = from_bom(content)
+        if encoding != None:
+            return encoding, "bom"
+        encoding = from_meta(content, self.meta_size)
+        if encoding != None:
+            return encoding, "meta"
+
+        if url != None:
+            with self.__lock:
+                encoding = self.__domains.get(domain_of(url))
+            if encoding != None and decodable(content, encoding, self.sample_size):
+                return encoding, "domain"
+
+        encoding = normalize(cchardet.detect(content[:self.sample_size])["encoding"])
+        if encoding != None:
+            return encoding, "detect"
+        return GC.DEFAULT_CHARSET, "default"
+
+    def domains(self):
+        """ ドメインごとの判定結果を返す
+        """
+
+        with self.__lock:
+            return dict(self.__domains)
+
+    def reset(self):
+        """ ドメインごとの判定結果と統計を消す
+        """
+
+        with self.__lock:
+            self.stats.clear()
+            self.__domains.clear()
+
+
+DETECTOR = CharsetDetector()
+
+
+def detect(content, content_type=None, url=None):
+    """ プロセス内で共有するCharsetDetectorで文字コードを判定する
+
+    Args:
+        content (bytes): レスポンスの本文
+        content_type (str): Content-Typeヘッダ
+        url (str): レスポンスのurl
+
+    Returns:
+        str: 文字コード(codec名)
+    """
+
+    return DETECTOR.detect(content, content_type, url)
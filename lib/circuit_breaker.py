@@ -0,0 +1,199 @@
+# coding=utf-8
+
+"""
+障害が続いているサーバへのアクセスを一時的に止めるサーキットブレーカを提供するモジュール
+"""
+
+import random
+import threading
+from collections import Counter
+from time import monotonic
+
+import crawler.lib.const as GC
+from crawler.lib.metrics import METRICS
+
+CLOSED = "closed"  # 通常どおりアクセスする
+OPEN = "open"  # アクセスを止めている
+HALF_OPEN = "half_open"  # 復旧を確認するため1つだけアクセスする
+
+
+class CircuitOpenError(Exception):
+    """ サーキットブレーカが開いておりアクセスできない場合に送出する例外
+    """
+    pass
+
+
+class CircuitBreaker:
+    """ closed, open, half-openの3状態を持つサーキットブレーカ
+
+    連続してfailure_threshold回失敗するとopenになり、指数バックオフ(ジッタ付き)で決めた時間だけアクセスを止める
+    時間が経つとhalf-openになり、1つだけアクセスを許可し、成功すればclosed、失敗すれば再びopenになる
+
+    Attributes:
+        name (str): ログやメトリクスに用いる名前
+        failure_threshold (int): openになるまでの連続失敗回数
+        base_delay (float): 最初にopenになった際にアクセスを止める秒数
+        max_delay (float): アクセスを止める最大秒数
+        jitter (float): アクセスを止める秒数をランダムに増減させる割合
+    """
+
+    def __init__(
+            self,
+            name="",
+            failure_threshold=GC.BREAKER_FAILURE_THRESHOLD,
+            base_delay=GC.BREAKER_BASE_DELAY,
+            max_delay=GC.BREAKER_MAX_DELAY,
+            jitter=GC.BREAKER_JITTER
+    ):
+
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.__state = CLOSED
+        self.__failures = 0  # 連続失敗回数
+        self.__opened = 0  # closedに戻るまでにopenになった回数
+        self.__reopen_at = 0.0
+        self.__probing = False
+        self.__lock = threading.Lock()
+        self.__listeners = []
+        self.transitions = Counter()  # "closed->open"などの状態遷移の回数
+        self.rejected = 0  # openのため拒否したアクセスの数
+
+    @property
+    def state(self):
+
+        with self.__lock:
+            self.__refresh()
+            return self.__state
+
+    def add_listener(self, listener):
+        """ 状態が遷移した際に(name, 遷移前の状態, 遷移後の状態)を引数として呼び出す関数を登録する
+        """
+
+        self.__listeners.append(listener)
+
+    def __transit(self, state):
+
+        old, self.__state = self.__state, state
+        self.transitions["{}->{}".format(old, state)] += 1
+        METRICS.inc("breaker_transitions_total", breaker=self.name, from_state=old, to_state=state)
+        for listener in self.__listeners:
+            listener(self.name, old, state)
+
+    def __refresh(self):
+
+        if self.__state == OPEN and monotonic() >= self.__reopen_at:
+            self.__probing = False
+            self.__transit(HALF_OPEN)
+
+    def ready(self):
+        """ 今アクセスを許可できるか否かを返す、allowと異なり状態は変えない
+        """
+
+        with self.__lock:
+            self.__refresh()
+            return self.__state == CLOSED or (self.__state == HALF_OPEN and not self.__probing)
+
+    def allow(self):
+        """ アクセスを許可するか否かを返す
+
+        half-openの場合は、復旧確認のための1つのアクセスのみ許可する
+
+        Returns:
+            bool: アクセスしてよい場合はTrue
+        """
+
+        return self.__acquire() != None
+
+    def __acquire(self):
+        """ アクセスを許可する場合に、half-openの復旧確認としての許可か否かを返す
+
+        Returns:
+            bool: 復旧確認として許可した場合はTrue、closedで許可した場合はFalse、許可しない場合はNone
+        """
+
+        with self.__lock:
+            self.__refresh()
+            if self.__state == CLOSED:
+                return False
+            if self.__state == HALF_OPEN and not self.__probing:
+                self.__probing = True
+                return True
+            self.rejected += 1
+            return None
+
+    def retry_after(self):
+        """ アクセスを再開できるまでの秒数を返す
+        """
+
+        with self.__lock:
+            if self.__state != OPEN:
+                return 0.0
+            return max(0.0, self.__reopen_at - monotonic())
+
+    def record_success(self):
+
+        with self.__lock:
+            self.__failures = 0
+            self.__opened = 0
+            self.__probing = False
+            if self.__state != CLOSED:
+                self.__transit(CLOSED)
+
+    def record_failure(self):
+
+        with self.__lock:
+            self.__failures += 1
+            self.__probing = False
+            if self.__state == HALF_OPEN or self.__failures >= self.failure_threshold:
+                delay = min(self.max_delay, self.base_delay * (2 ** self.__opened))
+                delay *= 1 + random.uniform(-self.jitter, self.jitter)
+                self.__opened += 1
+                self.__reopen_at = monotonic() + delay
+                if self.__state != OPEN:
+                    self.__transit(OPEN)
+
+    def call(self, function, *args, **kwargs):
+        """ サーキットブレーカを通してfunctionを呼び出す
+
+        functionが例外を送出した場合は失敗として記録し、例外をそのまま送出する
+
+        Returns:
+            functionの返り値
+        """
+
+        probe = self.__acquire()
+        if probe == None:
+            raise CircuitOpenError("circuit {} is open".format(self.name))
+        try:
+            result = function(*args, **kwargs)
+        except Exception:
+            self.record_failure()
+            raise
+        except BaseException:
+            # KeyboardInterrupt等は成功・失敗のいずれとも記録しないが、復旧確認は終えたものとして次のアクセスを許可する
+            if probe:
+                with self.__lock:
+                    self.__probing = False
+            raise
+        self.record_success()
+        return result
+
+    def metrics(self):
+        """ 現在の状態と状態遷移の回数を返す
+
+        Returns:
+            dict: state, failures, retry_after, rejected, transitions
+        """
+
+        state = self.state
+        with self.__lock:
+            return {
+                    "state": state,
+                    "failures": self.__failures,
+                    "retry_after": max(0.0, self.__reopen_at - monotonic()) if state == OPEN else 0.0,
+                    "rejected": self.rejected,
+                    "transitions": dict(self.transitions)
+            }
@@ -0,0 +1,171 @@
+# coding=utf-8
+
+"""
+htmlを圧縮して保存するためのコーデックを提供するモジュール
+
+zlibは標準ライブラリ、zstdはzstandardがインストールされている場合のみ使用できる
+コーデック名は"zlib"、"zstd"、辞書を使う場合は"zlib:<辞書名>"のように指定する
+"""
+
+import os
+import threading
+import zlib
+from collections import Counter
+from functools import lru_cache
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+import crawler.lib.const as GC
+
+ZLIB = "zlib"
+ZSTD = "zstd"
+DICT_SUFFIX = ".dict"
+
+
+class HtmlCodec:
+    """ htmlの文字列とbytesを相互に変換するコーデック
+
+    スレッド間で共有できる
+
+    Attributes:
+        name (str): コーデック名、Source.html_codecに保存される
+        algorithm (str): "zlib"または"zstd"
+        dictionary (bytes): 圧縮に用いる辞書、使わない場合はNone
+    """
+
+    def __init__(self, algorithm=ZLIB, level=None, dictionary=None, dict_name=None):
+
+        if algorithm == ZSTD and zstandard == None:
+            raise ImportError("zstandard is required for zstd compression.")
+        if algorithm not in (ZLIB, ZSTD):
+            raise ValueError("unknown compression algorithm: {}".format(algorithm))
+        self.algorithm = algorithm
+        self.dictionary = dictionary
+        self.name = algorithm if dict_name == None else "{}:{}".format(algorithm, dict_name)
+        if algorithm == ZLIB:
+            self.level = GC.ZLIB_LEVEL if level == None else level
+        else:
+            self.level = GC.ZSTD_LEVEL if level == None else level
+        # get_codecで共有されるが、ZstdCompressor/ZstdDecompressorはスレッドセーフではないため、スレッドごとに作る
+        self.__local = threading.local()
+
+    def __zstd(self):
+        """ このスレッドの(ZstdCompressor, ZstdDecompressor)を返す
+        """
+
+        pair = getattr(self.__local, "zstd", None)
+        if pair == None:
+            zdict = zstandard.ZstdCompressionDict(self.dictionary) if self.dictionary else None
+            pair = (
+                    zstandard.ZstdCompressor(level=self.level, dict_data=zdict),
+                    zstandard.ZstdDecompressor(dict_data=zdict)
+            )
+            self.__local.zstd = pair
+        return pair
+
+    def compress(self, html):
+        """ htmlをutf-8でエンコードして圧縮する
+
+        Args:
+            html (str): htmlの生テキスト
+
+        Returns:
+            bytes: 圧縮したデータ
+        """
+
+        data = html.encode("utf-8")
+        if self.algorithm == ZSTD:
+            return self.__zstd()[0].compress(data)
+        if self.dictionary:
+            c = zlib.compressobj(self.level, zdict=self.dictionary)
+            return c.compress(data) + c.flush()
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data):
+        """ compressで圧縮したデータをhtmlに戻す
+
+        Args:
+            data (bytes): 圧縮したデータ
+
+        Returns:
+            str: htmlの生テキスト
+        """
+
+        if self.algorithm == ZSTD:
+            raw = self.__zstd()[1].decompress(data)
+        elif self.dictionary:
+            d = zlib.decompressobj(zdict=self.dictionary)
+            raw = d.decompress(data) + d.flush()
+        else:
+            raw = zlib.decompress(data)
+        return raw.decode("utf-8")
+
+
+def train_dictionary(samples, algorithm=ZLIB, size=GC.HTML_DICT_SIZE):
+    """ htmlのサンプルから圧縮用の辞書を作成する
+
+    zstdの場合はzstandard.train_dictionaryを用いる
+    zlibの場合は複数のサンプルに共通して現れる行を頻度順に並べたものを辞書とする
+    (zlibは辞書の末尾ほど参照しやすいため、頻度の高い行を末尾に置く)
+
+    Args:
+        samples (list): htmlの生テキストのリスト
+        algorithm (str): "zlib"または"zstd"
+        size (int): 辞書の最大バイト数
+
+    Returns:
+        bytes: 辞書
+    """
+
+    if algorithm == ZSTD:
+        if zstandard == None:
+            raise ImportError("zstandard is required for zstd compression.")
+        data = [html.encode("utf-8") for html in samples]
+        return zstandard.train_dictionary(size, data).as_bytes()
+
+    size = min(size, GC.ZLIB_MAX_DICT_SIZE)
+    counter = Counter()
+    for html in samples:
+        counter.update(set(line.strip() for line in html.encode("utf-8").splitlines()))
+    lines, total = [], 0
+    for line, n in counter.most_common():
+        if n < 2 or total + len(line) + 1 > size:
+            continue
+        lines.append(line)
+        total += len(line) + 1
+    return b"\n".join(reversed(lines))
+
+
+def save_dictionary(dictionary, dict_name, dict_dir):
+    """ 辞書をdict_dir/<dict_name>.dictに保存する
+    """
+
+    os.makedirs(dict_dir, exist_ok=True)
+    with open(os.path.join(dict_dir, dict_name + DICT_SUFFIX), "wb") as f:
+        f.write(dictionary)
+
+
+@lru_cache(maxsize=None)
+def get_codec(name, dict_dir=None):
+    """ コーデック名からHtmlCodecを返す
+
+    同じ名前のものは辞書を読み込み直さないよう使い回す(HtmlCodecはスレッド間で共有できる)
+
+    Args:
+        name (str): "zlib"、"zstd"、"zlib:<辞書名>"、"zstd:<辞書名>"のいずれか
+        dict_dir (str): 辞書を格納したディレクトリ
+
+    Returns:
+        HtmlCodec: コーデック
+    """
+
+    algorithm, _, dict_name = name.partition(":")
+    if not dict_name:
+        return HtmlCodec(algorithm)
+    if dict_dir == None:
+        raise ValueError("dict_dir is required for codec {}".format(name))
+    with open(os.path.join(dict_dir, dict_name + DICT_SUFFIX), "rb") as f:
+        return HtmlCodec(algorithm, dictionary=f.read(), dict_name=dict_name)
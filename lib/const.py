@@ -3,11 +3,81 @@
 SLEEP_TIME = 4
 TIMEOUT = 60  #  タイムアウトにしようする秒数
 RECALL_THR = 0.5 
+IS_NEXT_URL_CACHE_SIZE = 4096  # is_next_urlの結果をキャッシュする件数
 
 MAX_QUEUE_SIZE = 5
 
 MAX_PAGES = 10
 
+# 非同期取得の同時接続数
+ASYNC_MAX_CONCURRENCY = 100  # 全体の同時接続数
+ASYNC_MAX_PER_HOST = 4  # ホストごとの同時接続数
+
+# 記事の後続ページを先読みする際の設定
+PREFETCH_DEPTH = 2  # urlが確定したページの先に、予測したurlで先読みするページ数
+PREFETCH_WORKERS = 4  # 先読みを行うスレッド数
+PREFETCH_MIN_SUPPORT = 2  # ドメインごとのページ送りのパターンを予測に使うまでに観測する回数
+PREFETCH_MIN_REACH = 0.5  # 先読みするページまで記事が続く割合(ドメインごとの記録)の下限
+PREFETCH_MAX_SPECULATIVE = 1  # 記事ごとに、必ず続くとは限らないページを先読みする回数の上限
+PREFETCH_MAX_DOMAINS = 10000  # パターンを保持するドメイン数の上限
+
+# クロールするurlのキュー(frontier)の設定
+FRONTIER_MEMORY_SIZE = 1000  # SQLiteからメモリ上に読み込んでおくurlの数
+FRONTIER_PATH = "frontier.sqlite3"  # urlを保存するSQLiteのファイル
+
+# ホストごとのリクエスト間隔の設定
+HOST_RATE = 1.0  # 1ホストあたりの1秒間のリクエスト数の上限
+HOST_BURST = 1  # 1ホストに連続して送れるリクエスト数
+HOST_MIN_INTERVAL = 1.0  # 同じホストへのリクエストの最小間隔(秒)
+
+# サーキットブレーカの設定
+BREAKER_FAILURE_THRESHOLD = 3  # openになるまでの連続失敗回数
+BREAKER_BASE_DELAY = 5  # 最初にopenになった際にアクセスを止める秒数
+BREAKER_MAX_DELAY = 300  # アクセスを止める最大秒数
+BREAKER_JITTER = 0.2  # アクセスを止める秒数をランダムに増減させる割合
+
+# htmlの圧縮の設定
+ZLIB_LEVEL = 6  # zlibの圧縮レベル
+ZSTD_LEVEL = 3  # zstdの圧縮レベル
+HTML_DICT_SIZE = 1 << 16  # 圧縮用の辞書の最大バイト数
+ZLIB_MAX_DICT_SIZE = 1 << 15  # zlibが参照できる辞書の最大バイト数
+
+# 文字コードの判定
+DEFAULT_CHARSET = "utf-8"  # 判定できなかった場合の文字コード
+CHARSET_META_BYTES = 8192  # metaタグを探す先頭部分のbytes数
+CHARSET_SAMPLE_BYTES = 65536  # cchardetで判定する先頭部分のbytes数
+
+# HTTP接続プールの設定
+HTTP_POOL_CONNECTIONS = 32  # 接続プールを保持するホストの数
+# 1つのホストに対して保持するkeep-aliveの接続数
+# AsyncFetcherの同時接続数より小さいと、溢れた接続を毎回作り直して破棄するため、同じ数にする
+HTTP_POOL_MAXSIZE = ASYNC_MAX_CONCURRENCY
+
+# レスポンスのキャッシュの設定
+HTTP_CACHE_PATH = "http_cache.sqlite3"  # キャッシュを保存するSQLiteのファイル
+HTTP_CACHE_TTL = 60 * 60 * 24 * 7  # 再検証せずに使う秒数
+HTTP_CACHE_MAX_BYTES = 1 << 32  # 保存するサイズの合計の上限
+HTTP_CACHE_LOW_WATER = 0.9  # 上限を超えた場合、上限のこの割合を下回るまで削除する
+
+# WARCファイルの設定
+WARC_PREFIX = "crawler"  # ファイル名の接頭辞
+WARC_MAX_SIZE = 1 << 30  # 1ファイルの最大サイズ(bytes)
+WARC_GZIP_LEVEL = 6  # レコードごとのgzipの圧縮レベル
+WARC_FLUSH_BATCH_SIZE = 100  # ディスクに書き出す間隔(url数)
+WARC_FLUSH_INTERVAL = 30  # ディスクに書き出す間隔の最大秒数
+WARC_INDEX_NAME = "crawled_urls.txt"  # 保存した記事のurlを1行ずつ追記する索引ファイルの名前
+
+# 計測の設定
+METRICS_ENABLED = False  # 既定で計測するか否か
+METRICS_PREFIX = "crawler_"  # Prometheusのメトリクス名の接頭辞
+METRICS_SNAPSHOT_INTERVAL = 60  # JSONに書き出す間隔(秒)
+METRICS_BUCKETS = (0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 180)  # ヒストグラムのbucketの上限(秒)
+
+# WebDriverプールの設定
+DRIVER_POOL_SIZE = 2  # 同時に起動しておくWebDriverの数
+DRIVER_MAX_PAGES = 100  # 1つのWebDriverで処理するページ数の上限
+DRIVER_MAX_RSS_MB = 500  # WebDriverの常駐メモリ量の上限(MB)
+
 HEADERS = {
         "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_12_6) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/62.0.3202.94 Safari/537.36"
 } 
@@ -21,6 +91,12 @@ INFORMATIONAL = "Informational"
 
 DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
 
+# Internet Archive上のurlから元のurlを取り出すためのパターン
+ARCHIVE_URL_PAT = "^(?:https?:)?//web\\.archive\\.org/web/[^/]*/(?P<original>.+)$"
+
+# static-firstモードでブラウザでの描画を省略するためのしきい値
+STATIC_MIN_TEXT_CHARS = 200  # タグを除いた本文の文字数
+
 # ステータスコード(HTTP Responceのステータスコードに便宜上追加)
 TIMEOUT_SEARCH_DISPURL = 521  # 続きを読むリンクの探索がタイムアウトした場合のステータスコード
 TIMEOUT_SEARCH_NEXTURL = 522  # 次のページリンクの探索がタイムアウトした場合のステータスコード
@@ -29,6 +105,11 @@ TIMEOUT = 520  # 接続がタイムアウトなどした場合
 REDIRECT_TOP_PAGES = 600
 TOO_MANY_SERVER_OR_CLIENT_ERROR = 601
 
+# タイムアウト
+URL_DEADLINE = 180  # 1つのurlの取得、描画、リンクの探索で共有する期限(秒)
+TIMEOUT_START_METHOD = "fork"  # メインスレッド以外で正規表現の探索を実行する子プロセスの起動方法
+TIMEOUT_IDLE_WORKERS = 8  # 正規表現の探索を実行する子プロセスを、使い終わった後に保持しておく数
+
 # GETで例外が発生したときにリトライする回数
 STOP_MAX_ATTEMPT_NUMBER = 5 
 STOP_MAX_DELAY = 10000  # リトライする時間は最大10秒間
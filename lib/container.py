@@ -1,22 +1,130 @@
 # coding=utf-8
 
+import codecs
 from collections import namedtuple
 
 # 記事の情報を格納するnamedtuple
-ScrapedArticleData = namedtuple(
+_ScrapedArticleData = namedtuple(
     'ScrapedArticleData',
     ('origin_url', 'page_url', 'title', 'html', 'page', 'published_at', 'status_code')
 )
+_HTML = _ScrapedArticleData._fields.index('html')
 
-class ScrapedArticleDataWithDocstring(ScrapedArticleData):
+
+def _compact(html, encoding=None):
+    """ htmlを保持する形式に変換する
+
+    bytesはutf-8であればそのまま、それ以外のエンコーディングであればデコードしてstrと同様に扱う
+    strはutf-8でエンコードした方が小さければbytesに、そうでなければstrのまま保持する
+    (strは1文字でも日本語を含むと全体が1文字2bytesになるため、タグの多いhtmlはutf-8の方が小さい)
+    """
+
+    if isinstance(html, (bytes, bytearray)):
+        encoding = encoding or "utf-8"
+        if codecs.lookup(encoding).name == "utf-8":
+            return bytes(html)
+        html = bytes(html).decode(encoding, "replace")
+    if html and not html.isascii():
+        try:
+            content = html.encode("utf-8")
+        except UnicodeEncodeError:  # 対になっていないサロゲートを含む
+            return html
+        if len(content) < 2 * len(html):
+            return content
+    return html
+
+
+class ScrapedArticleData(_ScrapedArticleData):
     """ Scrapingしたデータを格納するnamedtuple
 
+    htmlのフィールドはutf-8のbytesかstrで保持し、html属性やインデックスで参照した時点でデコードする
+    比較やハッシュ値、_replace、_asdictはデコードしたhtmlで行うため、従来のnamedtupleと同様に扱える
+
     Attributes:
         origin_url (str): 元記事の1ページ目のurl
         page_url (str): 元記事のnページ目のurl
         title (str): 元記事のタイトル
-        html (str): 元記事のhtmlソース
+        html (str): 元記事のhtmlソース、bytesで渡す場合はencodingを指定する(省略した場合はutf-8)
         page (int): 参照している元記事のページ番号
         published_at (datetime): ceron上に記事が登録されたdatetime
         status_code (int): レスポンスのステータスコード
-    """  
+        encoding (str): htmlをbytesで保持している場合のエンコーディング(utf-8)、strで保持している場合はNone
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, origin_url, page_url, title, html, page, published_at, status_code, encoding=None):
+
+        return super().__new__(
+                cls, origin_url, page_url, title, _compact(html, encoding), page, published_at, status_code
+        )
+
+    @classmethod
+    def _make(cls, iterable):
+
+        return cls(*iterable)
+
+    @property
+    def html(self):
+
+        html = tuple.__getitem__(self, _HTML)
+        if isinstance(html, bytes):
+            return html.decode("utf-8", "replace")
+        return html
+
+    @property
+    def encoding(self):
+
+        return "utf-8" if isinstance(tuple.__getitem__(self, _HTML), bytes) else None
+
+    def encoded(self, encoding="utf-8"):
+        """ htmlをencodingでエンコードしたbytesを返す、同じエンコーディングで保持していればそのまま返す
+        """
+
+        if self.encoding == encoding:
+            return tuple.__getitem__(self, _HTML)
+        return (self.html or "").encode(encoding, "replace")
+
+    def __getitem__(self, index):
+
+        if isinstance(index, slice):
+            return tuple(self)[index]
+        if index in (_HTML, _HTML - len(self)):
+            return self.html
+        return tuple.__getitem__(self, index)
+
+    def __iter__(self):
+
+        for i, value in enumerate(tuple.__iter__(self)):
+            yield self.html if i == _HTML else value
+
+    def __eq__(self, other):
+
+        if not isinstance(other, tuple):
+            return NotImplemented
+        return tuple(self) == tuple(other)
+
+    def __ne__(self, other):
+
+        if not isinstance(other, tuple):
+            return NotImplemented
+        return tuple(self) != tuple(other)
+
+    def __hash__(self):
+
+        return hash(tuple(self))
+
+    def __getnewargs__(self):
+
+        # プロセス間で受け渡す際にデコードしない
+        return tuple(tuple.__iter__(self))
+
+    def __repr__(self):
+
+        return "ScrapedArticleData(origin_url={!r}, page_url={!r}, page={!r}, status_code={!r}, {} bytes)".format(
+                self.origin_url, self.page_url, self.page, self.status_code,
+                len(tuple.__getitem__(self, _HTML) or ""))
+
+
+# 以前の名前(Attributesのdocstringを持たせるためのサブクラス)
+ScrapedArticleDataWithDocstring = ScrapedArticleData
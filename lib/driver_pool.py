@@ -0,0 +1,269 @@
+# coding=utf-8
+
+"""
+PhantomJSのWebDriverを使い回すためのプールを提供するモジュール
+"""
+
+import atexit
+import threading
+from contextlib import contextmanager
+from time import monotonic
+
+from selenium import webdriver
+
+import crawler.lib.const as GC
+
+
+def create_phantomjs():
+    """ utils.getが使用する設定でPhantomJSのWebDriverを起動する
+
+    Returns:
+        WebDriver: PhantomJSのWebDriver
+    """
+
+    dcap = {
+            "phantomjs.page.settings.userAgent": GC.HEADERS,
+            "marionette": True
+    }
+    args = [
+            "--ignore-ssl-errors=true",
+            "--ssl-protocol=any",
+            "--disk-cache=false",
+            "--load-images=false",
+            "--output-encoding=utf-8",
+            "--script-encoding=utf-8"
+    ]
+    driver = webdriver.PhantomJS(desired_capabilities=dcap, service_args=args)
+    driver.set_page_load_timeout(GC.TIMEOUT)
+    return driver
+
+
+def driver_rss_mb(driver):
+    """ WebDriverのブラウザプロセスの常駐メモリ量(MB)を返す
+
+    /procが使える環境(Linux)のみ対応しており、取得できなかった場合はNoneを返す
+
+    Args:
+        driver (WebDriver): 対象のWebDriver
+
+    Returns:
+        float: 常駐メモリ量(MB)
+    """
+
+    try:
+        pid = driver.service.process.pid
+        with open("/proc/{}/status".format(pid)) as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.0
+    except (AttributeError, OSError, ValueError):
+        pass
+    return None
+
+
+class DriverPool:
+    """ WebDriverの貸し出しと返却を管理するプール
+
+    返却されたWebDriverはmax_pagesページを処理するか、
+    常駐メモリがmax_rss_mbを超えた時点でquitし、新しいものに入れ替える
+
+    Attributes:
+        size (int): 同時に起動しておくWebDriverの最大数
+        max_pages (int): 1つのWebDriverで処理するページ数の上限
+        max_rss_mb (float): 1つのWebDriverの常駐メモリ量の上限(MB)
+    """
+
+    def __init__(
+            self,
+            size=GC.DRIVER_POOL_SIZE,
+            max_pages=GC.DRIVER_MAX_PAGES,
+            max_rss_mb=GC.DRIVER_MAX_RSS_MB,
+            factory=create_phantomjs
+    ):
+
+        self.size = size
+        self.max_pages = max_pages
+        self.max_rss_mb = max_rss_mb
+        self.factory = factory
+        self.stats = {"created": 0, "recycled": 0, "unhealthy": 0, "checkouts": 0}
+        self.__idle = []
+        self.__pages = {}  # id(driver) -> 処理したページ数
+        self.__cond = threading.Condition()
+        self.__closed = False
+
+    def __len__(self):
+
+        return len(self.__pages)
+
+    @staticmethod
+    def __quit(driver):
+        """ WebDriverを終了する
+
+        終了には時間がかかるため、他のスレッドを待たせないようロックの外で呼び出す
+        """
+
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    @staticmethod
+    def is_healthy(driver):
+        """ WebDriverが応答するか否かを確認する
+        """
+
+        try:
+            driver.current_url
+            return True
+        except Exception:
+            return False
+
+    def checkout(self, timeout=None):
+        """ WebDriverを借りる
+
+        空いているWebDriverがなく、起動数がsizeに達している場合は返却されるまで待つ
+
+        Args:
+            timeout (float): 待つ最大秒数、Noneの場合は無制限
+
+        Returns:
+            WebDriver: 貸し出すWebDriver
+        """
+
+        end = None if timeout == None else monotonic() + timeout
+        while True:
+            with self.__cond:
+                if self.__closed:
+                    raise RuntimeError("DriverPool is already shut down.")
+                if self.__idle:
+                    # 借りたものとして取り出し、応答の確認は他のスレッドを待たせないようロックの外で行う
+                    driver = self.__idle.pop()
+                elif len(self.__pages) < self.size:
+                    # 起動中は他のスレッドに枠を取られないよう予約しておく
+                    placeholder = object()
+                    self.__pages[id(placeholder)] = 0
+                    break
+                else:
+                    wait = None if end == None else max(0.0, end - monotonic())
+                    if not self.__cond.wait(wait):
+                        raise TimeoutError("no WebDriver is available in {}s".format(timeout))
+                    continue
+            if self.is_healthy(driver):
+                with self.__cond:
+                    self.stats["checkouts"] += 1
+                return driver
+            with self.__cond:
+                self.stats["unhealthy"] += 1
+                self.__pages.pop(id(driver), None)
+                self.__cond.notify()
+            self.__quit(driver)
+
+        try:
+            driver = self.factory()
+        except Exception:
+            with self.__cond:
+                del self.__pages[id(placeholder)]
+                self.__cond.notify()
+            raise
+        with self.__cond:
+            del self.__pages[id(placeholder)]
+            self.__pages[id(driver)] = 0
+            self.stats["created"] += 1
+            self.stats["checkouts"] += 1
+        return driver
+
+    def checkin(self, driver):
+        """ 借りたWebDriverを返却する
+
+        Args:
+            driver (WebDriver): checkoutで借りたWebDriver
+        """
+
+        # /procの読み込みは他のスレッドを待たせないようロックの外で行う
+        rss = driver_rss_mb(driver) if self.max_rss_mb else None
+        with self.__cond:
+            pages = self.__pages.get(id(driver), 0) + 1
+            retire = self.__closed or pages >= self.max_pages or (rss is not None and rss >= self.max_rss_mb)
+            if not retire:
+                self.__pages[id(driver)] = pages
+                self.__idle.append(driver)
+            else:
+                self.__pages.pop(id(driver), None)
+                if not self.__closed:
+                    self.stats["recycled"] += 1
+            self.__cond.notify()
+        if retire:
+            self.__quit(driver)
+
+    def discard(self, driver):
+        """ 例外などで状態が不明になったWebDriverを返却せずに終了する
+
+        Args:
+            driver (WebDriver): checkoutで借りたWebDriver
+        """
+
+        with self.__cond:
+            self.__pages.pop(id(driver), None)
+            self.__cond.notify()
+        self.__quit(driver)
+
+    @contextmanager
+    def driver(self, timeout=None):
+        """ with文でWebDriverを借りる
+
+        with文の中で例外が発生した場合、WebDriverはプールに戻さずに終了する
+        """
+
+        driver = self.checkout(timeout)
+        try:
+            yield driver
+        except BaseException:
+            self.discard(driver)
+            raise
+        else:
+            self.checkin(driver)
+
+    def shutdown(self):
+        """ 待機中のWebDriverをすべて終了する、貸出中のものは返却時に終了する
+        """
+
+        with self.__cond:
+            self.__closed = True
+            idle, self.__idle = self.__idle, []
+            for driver in idle:
+                self.__pages.pop(id(driver), None)
+            self.__cond.notify_all()
+        for driver in idle:
+            self.__quit(driver)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_driver_pool():
+    """ プロセス内で共有するDriverPoolを返す
+
+    初回呼び出し時に生成し、プロセス終了時にshutdownされるよう登録する
+
+    Returns:
+        DriverPool: 共有のDriverPool
+    """
+
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = DriverPool()
+            atexit.register(_pool.shutdown)
+        return _pool
+
+
+def reset_driver_pool():
+    """ forkした子プロセスで、親プロセスから引き継いだDriverPoolを使わないようにする
+
+    引き継いだWebDriverは親プロセスのものであるため閉じずに手放し、次のget_driver_poolで新たに生成する
+    """
+
+    global _pool, _pool_lock
+    _pool = None
+    _pool_lock = threading.Lock()
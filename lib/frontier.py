@@ -0,0 +1,277 @@
+# coding=utf-8
+
+"""
+クロールするurlを管理するキュー(frontier)を提供するモジュール
+
+urlはすべてSQLiteに保存し、優先度の高いものからFRONTIER_MEMORY_SIZE件ずつメモリ上のホストごとのdequeに読み込んで取り出す
+同じurlはurl列のUNIQUE制約で判定し、一度追加したもの(取得済みのものを含む)は追加しない
+(ハッシュ値で判定すると、衝突した別のurlを重複とみなして捨ててしまう)
+取り出したurlはdoneを呼ぶまで取得中として保存し、停止した後に再開した場合はキューに戻す
+InternetArchivesCrawlerはcrawling_targetをTargetReaderで読み込むため、Frontierは使わない
+(ページ内のリンクを辿る等、urlを後から追加するクローラのためのもの)
+"""
+
+import asyncio
+import sqlite3
+import threading
+from collections import OrderedDict, deque, namedtuple
+from datetime import datetime
+from time import monotonic
+from urllib.parse import urlparse
+
+import crawler.lib.const as GC
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS frontier (
+        id INTEGER PRIMARY KEY,
+        url TEXT NOT NULL UNIQUE,
+        host TEXT NOT NULL,
+        title TEXT,
+        published_at TEXT,
+        priority REAL NOT NULL,
+        seq INTEGER NOT NULL,
+        state INTEGER NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS frontier_queued ON frontier (state, priority, seq)"
+)
+
+# frontierテーブルのstate
+QUEUED = 0  # キューに入っている
+LEASED = 1  # メモリ上に読み込んだか、取り出して取得中
+DONE = 2  # 取得が完了した
+
+# Frontierから取り出すurl
+FrontierEntry = namedtuple("FrontierEntry", ("url", "title", "published_at", "priority"))
+
+
+def to_priority(published_at):
+    """ published_atが新しいほど小さくなる(先に取り出される)優先度を返す
+
+    Args:
+        published_at (str or datetime): GC.DATETIME_FORMAT形式の文字列、またはdatetime
+
+    Returns:
+        float: 優先度、published_atを解釈できない場合は0(どの日付よりも後に取り出される)
+    """
+
+    if not isinstance(published_at, datetime):
+        try:
+            published_at = datetime.strptime(str(published_at).strip(), GC.DATETIME_FORMAT)
+        except ValueError:
+            return 0.0
+    return -(published_at - datetime(1970, 1, 1)).total_seconds()
+
+
+class Frontier:
+    """ 重複を除き、優先度とホストごとの順番に従ってurlを取り出す永続化されたキュー
+
+    メモリ上に読み込んだurlは、ホストを順番に切り替えながら(同じホストが続かないように)優先度の高い順に取り出す
+    後から追加したurlは、メモリ上のurlを取り出し終えて次に読み込む際に優先度に従って並ぶ
+    スレッド間で共有でき、getはurlが追加されるかcloseされるまで待つことができる
+
+    Attributes:
+        path (str): urlを保存するSQLiteのファイル、":memory:"を指定した場合は永続化しない
+        memory_size (int): 一度にメモリ上に読み込むurlの数
+        stats (dict): added(追加した数)、duplicates(重複して追加しなかった数)、done、retried
+    """
+
+    def __init__(self, path=GC.FRONTIER_PATH, memory_size=GC.FRONTIER_MEMORY_SIZE, resume=True):
+
+        self.path = path
+        self.memory_size = memory_size
+        self.stats = {"added": 0, "duplicates": 0, "done": 0, "retried": 0}
+        self.__lock = threading.Lock()
+        self.__ready = threading.Condition(self.__lock)
+        self.__hosts = OrderedDict()  # ホスト -> メモリ上に読み込んだFrontierEntryのdeque
+        self.__closed = False
+        self.__conn = sqlite3.connect(path, check_same_thread=False)
+        # 1件ごとにcommitするため、WALでfsyncの回数を減らす(プロセスが停止しても失われない)
+        self.__conn.execute("PRAGMA journal_mode=WAL")
+        self.__conn.execute("PRAGMA synchronous=NORMAL")
+        for sql in SCHEMA:
+            self.__conn.execute(sql)
+        if resume:
+            # 前回停止した時点で取得中だったurlをキューに戻す
+            self.__conn.execute("UPDATE frontier SET state = ? WHERE state = ?", (QUEUED, LEASED))
+        else:
+            self.__conn.execute("DELETE FROM frontier")
+        self.__conn.commit()
+        self.__seq = self.__conn.execute("SELECT COALESCE(MAX(seq), 0) FROM frontier").fetchone()[0]
+
+    def put(self, url, title=None, published_at=None, priority=None):
+        """ urlを追加する
+
+        Args:
+            url (str): 追加するurl
+            title (str): 記事のタイトル
+            published_at (str): 記事がceronに登録された日時
+            priority (float): 優先度(小さいほど先に取り出す)、省略した場合はpublished_atから求める
+
+        Returns:
+            bool: 追加したか否か(一度追加したurlの場合はFalse)
+        """
+
+        return self.put_many([(url, title, published_at, priority)]) == 1
+
+    def put_many(self, entries):
+        """ 複数のurlをまとめて追加する
+
+        Args:
+            entries (iterable): (url, title, published_at)または(url, title, published_at, priority)のイテラブル
+
+        Returns:
+            int: 追加したurlの数
+        """
+
+        rows = []
+        for entry in entries:
+            url, title, published_at = entry[:3]
+            prio = entry[3] if len(entry) > 3 and entry[3] != None else to_priority(published_at)
+            rows.append((url, urlparse(url).netloc, title,
+                         None if published_at == None else str(published_at), prio))
+        with self.__ready:
+            self.__check_open()
+            added = 0
+            for row in rows:
+                self.__seq += 1
+                added += self.__conn.execute(
+                        "INSERT OR IGNORE INTO frontier (url, host, title, published_at, priority, seq, state)"
+                        " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        row + (self.__seq, QUEUED)
+                ).rowcount
+            self.__conn.commit()
+            self.stats["added"] += added
+            self.stats["duplicates"] += len(rows) - added
+            if added:
+                self.__ready.notify(added)
+        return added
+
+    def get(self, block=True, timeout=None):
+        """ 次に取得するurlを取り出す
+
+        取り出したurlは、doneまたはretryを呼ぶまで取得中として保存する
+
+        Args:
+            block (bool): キューが空の場合に、urlが追加されるまで待つか否か
+            timeout (float): 待つ最大秒数、Noneの場合はcloseされるまで待つ
+
+        Returns:
+            FrontierEntry: 取り出したurl、キューが空のまま待ち終えた場合やcloseされた場合はNone
+        """
+
+        end = None if timeout == None else monotonic() + timeout
+        with self.__ready:
+            while not self.__closed:
+                entry = self.__pop()
+                if entry != None:
+                    return entry
+                if not block:
+                    return None
+                wait = None if end == None else end - monotonic()
+                if wait != None and wait <= 0:
+                    return None
+                self.__ready.wait(wait)
+            return None
+
+    async def get_async(self, timeout=None):
+        """ getを別スレッドで実行し、イベントループを止めずにurlを取り出す
+
+        Args:
+            timeout (float): 待つ最大秒数、Noneの場合はcloseされるまで待つ
+
+        Returns:
+            FrontierEntry: getと同じもの
+        """
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.get, True, timeout)
+
+    def done(self, url):
+        """ urlの取得が完了したことを保存する、以降同じurlは追加されない
+        """
+
+        self.__set_state(url, DONE)
+        self.stats["done"] += 1
+
+    def retry(self, url):
+        """ 取り出したurlをキューに戻し、後で取り出し直す
+        """
+
+        self.__set_state(url, QUEUED)
+        self.stats["retried"] += 1
+        with self.__ready:
+            self.__ready.notify()
+
+    def __contains__(self, url):
+        """ urlが一度でも追加されたか否かを返す
+        """
+
+        with self.__lock:
+            return self.__conn.execute("SELECT 1 FROM frontier WHERE url = ?", (url,)).fetchone() != None
+
+    def __len__(self):
+        """ 取得が完了していないurlの数(取得中のものを含む)を返す
+        """
+
+        with self.__lock:
+            return self.__conn.execute("SELECT COUNT(*) FROM frontier WHERE state != ?", (DONE,)).fetchone()[0]
+
+    def report(self, logger):
+
+        logger.info("frontier: {} added, {} duplicates, {} done, {} retried, {} pending".format(
+            self.stats["added"], self.stats["duplicates"], self.stats["done"], self.stats["retried"], len(self)))
+
+    def close(self):
+        """ 待っているgetをNoneで返し、SQLiteを閉じる
+        """
+
+        with self.__ready:
+            if self.__closed:
+                return
+            self.__closed = True
+            self.__ready.notify_all()
+            self.__conn.close()
+
+    def __check_open(self):
+
+        if self.__closed:
+            raise ValueError("frontier is closed")
+
+    def __set_state(self, url, state):
+
+        with self.__lock:
+            self.__check_open()
+            self.__conn.execute("UPDATE frontier SET state = ? WHERE url = ?", (state, url))
+            self.__conn.commit()
+
+    def __pop(self):
+        """ メモリ上のurlをホストを順番に切り替えながら取り出す、空の場合はSQLiteから読み込む(__lockを取得した状態で呼ぶ)
+        """
+
+        if not self.__hosts:
+            self.__load()
+        if not self.__hosts:
+            return None
+        host, entries = self.__hosts.popitem(last=False)
+        entry = entries.popleft()
+        if entries:
+            self.__hosts[host] = entries
+        return entry
+
+    def __load(self):
+        """ 優先度の高い順にmemory_size件のurlをSQLiteから読み込み、取得中とする
+        """
+
+        rows = self.__conn.execute(
+                "SELECT id, url, host, title, published_at, priority FROM frontier"
+                " WHERE state = ? ORDER BY priority, seq LIMIT ?",
+                (QUEUED, self.memory_size)
+        ).fetchall()
+        if not rows:
+            return
+        self.__conn.executemany("UPDATE frontier SET state = ? WHERE id = ?", [(LEASED, row[0]) for row in rows])
+        self.__conn.commit()
+        for _, url, host, title, published_at, prio in rows:
+            self.__hosts.setdefault(host, deque()).append(FrontierEntry(url, title, published_at, prio))
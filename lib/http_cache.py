@@ -0,0 +1,284 @@
+# coding=utf-8
+
+"""
+utils.getのレスポンスをSQLiteに保存し、クローリングをやり直す際に再利用する機能を提供するモジュール
+
+正規化したurlをキーとして、レスポンスの本文・ヘッダ・ステータスコードと、seleniumで描画したhtmlを保存する
+有効期限(ttl)を過ぎたものはETag/Last-Modifiedで条件付きリクエストを送り、304が返れば保存したものを使う
+保存したサイズの合計がmax_bytesを超えた場合は、最後に参照した時刻が古いものから削除する
+"""
+
+import json
+import sqlite3
+import threading
+from time import time
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+import crawler.lib.const as GC
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    headers TEXT NOT NULL,
+    body BLOB NOT NULL,
+    rendered TEXT,
+    rendered_status INTEGER,
+    fetched_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at);
+"""
+
+
+def normalize_url(url):
+    """ キャッシュのキーとするためにurlを正規化する
+
+    スキームとホスト名を小文字にし、既定のポート番号とフラグメントを除き、クエリをキーの順に並べる
+
+    Args:
+        url (str): url
+
+    Returns:
+        str: 正規化したurl
+    """
+
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    netloc = (parts.hostname or "").lower()
+    if parts.port != None and parts.port != DEFAULT_PORTS.get(scheme):
+        netloc = "{}:{}".format(netloc, parts.port)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, netloc, parts.path or "/", query, ""))
+
+
+class CachedResponse:
+    """ キャッシュに保存したレスポンス
+
+    Attributes:
+        url (str): レスポンスのurl
+        status (int): ステータスコード
+        headers (dict): レスポンスヘッダ
+        body (bytes): レスポンスの本文
+        rendered (str): seleniumで描画したhtml、描画していなければNone
+        rendered_status (int): 描画した際にutils.getが返したステータスコード
+        fetched_at (float): 取得(または再検証)した時刻
+    """
+
+    def __init__(self, url, status, headers, body, rendered, rendered_status, fetched_at):
+
+        self.url = url
+        self.status = status
+        self.headers = CaseInsensitiveDict(headers)
+        self.body = body
+        self.rendered = rendered
+        self.rendered_status = rendered_status
+        self.fetched_at = fetched_at
+
+    def fresh(self, ttl):
+        """ 有効期限内か否か(ttlがNoneの場合は常に有効)
+        """
+
+        return ttl == None or time() - self.fetched_at < ttl
+
+    def validators(self):
+        """ 再検証のための条件付きリクエストのヘッダを返す
+        """
+
+        headers = {}
+        if "ETag" in self.headers:
+            headers["If-None-Match"] = self.headers["ETag"]
+        if "Last-Modified" in self.headers:
+            headers["If-Modified-Since"] = self.headers["Last-Modified"]
+        return headers
+
+    def response(self):
+        """ requests.Responseに戻す
+        """
+
+        res = requests.Response()
+        res.url = self.url
+        res.status_code = self.status
+        res.headers = CaseInsensitiveDict(self.headers)
+        res.encoding = None
+        res._content = self.body
+        return res
+
+
+class ResponseCache:
+    """ SQLiteに保存するレスポンスのキャッシュ
+
+    スレッド間で共有できる
+
+    Attributes:
+        path (str): SQLiteのファイルのパス
+        ttl (float): 再検証せずに使う秒数、Noneの場合は常に再検証しない
+        max_bytes (int): 保存する本文と描画したhtmlのサイズの合計の上限
+        stats (dict): hits(ネットワークを使わなかった回数)、revalidated(304で再利用した回数)、
+            misses、bytes_saved(再利用により取得せずに済んだbytes数)
+    """
+
+    def __init__(self, path=GC.HTTP_CACHE_PATH, ttl=GC.HTTP_CACHE_TTL, max_bytes=GC.HTTP_CACHE_MAX_BYTES):
+
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.stats = {"hits": 0, "revalidated": 0, "misses": 0, "bytes_saved": 0}
+        self.__lock = threading.Lock()
+        self.__conn = sqlite3.connect(path, check_same_thread=False)
+        self.__conn.execute("PRAGMA journal_mode=WAL")
+        self.__conn.executescript(SCHEMA)
+        self.__total = self.__conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def __len__(self):
+
+        with self.__lock:
+            return self.__conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def lookup(self, url):
+        """ urlのキャッシュを返す
+
+        Args:
+            url (str): url
+
+        Returns:
+            CachedResponse: キャッシュ、無ければNone
+        """
+
+        with self.__lock:
+            row = self.__conn.execute(
+                    "SELECT url, status, headers, body, rendered, rendered_status, fetched_at "
+                    "FROM responses WHERE key = ?",
+                    (normalize_url(url),)
+            ).fetchone()
+            if row == None:
+                self.stats["misses"] += 1
+                return None
+        url, status, headers, body, rendered, rendered_status, fetched_at = row
+        return CachedResponse(url, status, json.loads(headers), body, rendered, rendered_status, fetched_at)
+
+    def hit(self, url, entry, revalidated=False, rendered=False):
+        """ キャッシュを再利用したことを記録する
+
+        Args:
+            url (str): url
+            entry (CachedResponse): 再利用したキャッシュ
+            revalidated (bool): 条件付きリクエストで304が返った場合はTrue
+            rendered (bool): 描画したhtmlを再利用した場合はTrue
+        """
+
+        now = time()
+        with self.__lock:
+            if revalidated:
+                self.stats["revalidated"] += 1
+                self.__conn.execute(
+                        "UPDATE responses SET fetched_at = ?, accessed_at = ? WHERE key = ?",
+                        (now, now, normalize_url(url))
+                )
+            else:
+                self.stats["hits"] += 1
+                self.__conn.execute(
+                        "UPDATE responses SET accessed_at = ? WHERE key = ?",
+                        (now, normalize_url(url))
+                )
+            self.stats["bytes_saved"] += len(entry.body)
+            if rendered:
+                self.stats["bytes_saved"] += len(entry.rendered.encode("utf-8"))
+            self.__conn.commit()
+
+    def store(self, url, res):
+        """ レスポンスを保存する(描画したhtmlは削除される)
+
+        Args:
+            url (str): リクエストを送ったurl
+            res (Response): レスポンス
+        """
+
+        now = time()
+        body = res.content or b""
+        with self.__lock:
+            self.__replace(normalize_url(url), (
+                    normalize_url(url), res.url or url, res.status_code,
+                    json.dumps(dict(res.headers)), body, None, None, now, now, len(body)
+            ))
+            self.__evict()
+            self.__conn.commit()
+
+    def store_rendered(self, url, html, status):
+        """ seleniumで描画したhtmlを保存する
+
+        Args:
+            url (str): url(storeで保存済みのもの)
+            html (str): 描画したhtml
+            status (int): utils.getが返したステータスコード
+        """
+
+        key = normalize_url(url)
+        size = len(html.encode("utf-8"))
+        with self.__lock:
+            row = self.__conn.execute(
+                    "SELECT size, rendered FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row == None:
+                return
+            old = len(row[1].encode("utf-8")) if row[1] != None else 0
+            self.__conn.execute(
+                    "UPDATE responses SET rendered = ?, rendered_status = ?, size = ? WHERE key = ?",
+                    (html, status, row[0] - old + size, key)
+            )
+            self.__total += size - old
+            self.__evict()
+            self.__conn.commit()
+
+    def __replace(self, key, values):
+
+        row = self.__conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        if row != None:
+            self.__total -= row[0]
+        self.__conn.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(key, url, status, headers, body, rendered, rendered_status, fetched_at, accessed_at, size) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                values
+        )
+        self.__total += values[-1]
+
+    def __evict(self):
+        """ サイズの合計がmax_bytesを超えていれば、参照した時刻が古いものから削除する
+
+        削除を繰り返さないよう、max_bytesのGC.HTTP_CACHE_LOW_WATER倍を下回るまで削除する
+        """
+
+        if self.max_bytes == None or self.__total <= self.max_bytes:
+            return
+        target = self.max_bytes * GC.HTTP_CACHE_LOW_WATER
+        rows = self.__conn.execute("SELECT key, size FROM responses ORDER BY accessed_at")
+        victims = []
+        for key, size in rows:
+            if self.__total <= target:
+                break
+            victims.append((key,))
+            self.__total -= size
+        rows.close()
+        self.__conn.executemany("DELETE FROM responses WHERE key = ?", victims)
+
+    def close(self):
+
+        with self.__lock:
+            self.__conn.close()
+
+    def report(self, logger):
+        """ キャッシュの統計をloggerに出力する
+        """
+
+        logger.info(
+                "http cache: {} hits, {} revalidated, {} misses, {:.1f} MB saved".format(
+                    self.stats["hits"], self.stats["revalidated"], self.stats["misses"],
+                    self.stats["bytes_saved"] / float(1 << 20))
+        )
@@ -0,0 +1,164 @@
+# coding=utf-8
+
+"""
+keep-aliveで接続を再利用するHTTPセッションを提供するモジュール
+
+requests.getは呼び出すたびにSessionを作るため、同じホストへのリクエストでも毎回接続(とTLSハンドシェイク)をやり直す
+ここでは1つの接続プール(HTTPAdapter)をプロセス内で共有し、ホストごとに接続を再利用する
+requests.Sessionはスレッドセーフであることが保証されていないため、Sessionはスレッドごとに作り、接続プールのみを共有する
+"""
+
+import atexit
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import crawler.lib.const as GC
+
+
+class SessionPool:
+    """ 接続プールをスレッド間で共有するrequests.Sessionを提供するクラス
+
+    接続プール(urllib3)はスレッドセーフであり、ホストごとに最大pool_maxsize本の接続を保持する
+    プールが埋まっている場合は新しい接続を作り、使用後に破棄する(pool_block=Falseの場合)
+    Session(クッキーやヘッダなどの状態)はスレッドごとに作る
+
+    Attributes:
+        pool_connections (int): 接続プールを保持するホストの数
+        pool_maxsize (int): 1つのホストに対して保持する接続の数
+        pool_block (bool): Trueの場合、プールの接続が空くまで待つ
+    """
+
+    def __init__(
+            self,
+            pool_connections=GC.HTTP_POOL_CONNECTIONS,
+            pool_maxsize=GC.HTTP_POOL_MAXSIZE,
+            pool_block=False,
+            headers=GC.HEADERS
+    ):
+
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.__headers = headers
+        self.__lock = threading.Lock()
+        self.__adapter = None
+        self.__local = threading.local()  # スレッドごとのSession、終了したスレッドのものは破棄される
+
+    def __get_adapter(self):
+
+        if self.__adapter == None:
+            self.__adapter = HTTPAdapter(
+                    pool_connections=self.pool_connections,
+                    pool_maxsize=self.pool_maxsize,
+                    pool_block=self.pool_block
+            )
+        return self.__adapter
+
+    def session(self):
+        """ このスレッドのSessionを返す(スレッドごとに初回の呼び出しで作成する)
+        """
+
+        session = getattr(self.__local, "session", None)
+        if session != None:
+            return session
+        with self.__lock:
+            session = requests.Session()
+            adapter = self.__get_adapter()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers.update(self.__headers)
+        self.__local.session = session
+        return session
+
+    def get(self, url, **kwargs):
+        """ このスレッドのSession(接続プールは共有)でGETリクエストを送る
+
+        Args:
+            url (str): GETリクエストを送るurl
+            kwargs: requests.Session.getに渡す引数
+
+        Returns:
+            Response: レスポンス
+        """
+
+        return self.session().get(url, **kwargs)
+
+    def stats(self):
+        """ ホストごとの接続数とリクエスト数を返す
+
+        Returns:
+            dict: ホスト -> {"connections": 作成した接続数, "requests": リクエスト数, "reused": 接続を再利用したリクエスト数}
+        """
+
+        with self.__lock:
+            adapter = self.__adapter
+        if adapter == None:
+            return {}
+
+        stats = {}
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool == None:
+                continue
+            host = "{}://{}:{}".format(pool.scheme, pool.host, pool.port)
+            s = stats.setdefault(host, {"connections": 0, "requests": 0, "reused": 0})
+            s["connections"] += pool.num_connections
+            s["requests"] += pool.num_requests
+            s["reused"] += max(0, pool.num_requests - pool.num_connections)
+        return stats
+
+    def report(self, logger):
+        """ 接続の再利用状況をloggerに出力する
+        """
+
+        for host, s in sorted(self.stats().items()):
+            logger.info(
+                    "http pool: {} {} requests over {} connections ({} reused)".format(
+                        host, s["requests"], s["connections"], s["reused"])
+            )
+
+    def close(self):
+        """ 保持している接続を全て閉じる、以降にsessionを呼び出した場合は新しい接続プールを作る
+        """
+
+        # Sessionは接続を持たず、接続プールのみを閉じればよい
+        with self.__lock:
+            adapter, self.__adapter = self.__adapter, None
+            self.__local = threading.local()
+        if adapter != None:
+            adapter.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_session_pool():
+    """ プロセス内で共有するSessionPoolを返す
+
+    初回呼び出し時に生成し、プロセス終了時に接続を閉じるよう登録する
+
+    Returns:
+        SessionPool: 共有のSessionPool
+    """
+
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = SessionPool()
+            atexit.register(_pool.close)
+        return _pool
+
+
+def reset_session_pool():
+    """ forkした子プロセスで、親プロセスから引き継いだSessionPoolを使わないようにする
+
+    引き継いだ接続は親プロセスのものであるため閉じずに手放し、次のget_session_poolで新たに生成する
+    """
+
+    global _pool, _pool_lock
+    _pool = None
+    _pool_lock = threading.Lock()
@@ -0,0 +1,301 @@
+# coding=utf-8
+
+"""
+処理ごとの所要時間(ヒストグラム)と回数(カウンタ)を集計する機能を提供するモジュール
+
+既定では無効になっており、無効な間はtimed/timer/incは何もしない
+    METRICS.enable()
+    METRICS.start_snapshots("metrics.json")  # 一定間隔でJSONに書き出す
+    print(METRICS.prometheus())  # Prometheusのテキスト形式
+"""
+
+import json
+import os
+import threading
+from bisect import bisect_left
+from functools import wraps
+from time import perf_counter, time
+
+import crawler.lib.const as GC
+
+
+def _key(name, labels):
+
+    return name, tuple(sorted(labels.items()))
+
+
+def _format_labels(labels, extra=()):
+
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(
+            '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in pairs
+    ) + "}"
+
+
+class _NullTimer:
+    """ 無効な場合に返す何もしないタイマー
+    """
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *exc):
+
+        return False
+
+
+NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+
+    def __init__(self, registry, name, labels):
+
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+
+        self.registry.observe(self.name, perf_counter() - self.start, **self.labels)
+        return False
+
+
+class Registry:
+    """ カウンタとヒストグラムを保持するクラス
+
+    スレッド間で共有できる
+    メトリクスはnameとラベル(キーワード引数)の組ごとに集計する
+
+    Attributes:
+        enabled (bool): 集計するか否か
+        buckets (tuple): ヒストグラムの各bucketの上限(秒)
+    """
+
+    def __init__(self, enabled=False, buckets=GC.METRICS_BUCKETS):
+
+        self.enabled = enabled
+        self.buckets = tuple(buckets)
+        self.__counters = {}  # (name, labels) -> 値
+        self.__histograms = {}  # (name, labels) -> [各bucketの数..., +Infの数, 合計, 回数]
+        self.__lock = threading.Lock()
+        self.__snapshot_thread = None
+        self.__stop = threading.Event()
+
+    def enable(self):
+
+        self.enabled = True
+
+    def disable(self):
+
+        self.enabled = False
+
+    def reset(self):
+        """ 集計した値を全て消す
+        """
+
+        with self.__lock:
+            self.__counters.clear()
+            self.__histograms.clear()
+
+    def inc(self, name, value=1, **labels):
+        """ カウンタに加算する
+
+        Args:
+            name (str): メトリクス名
+            value (float): 加算する値
+            labels: ラベル
+        """
+
+        if not self.enabled:
+            return
+        key = _key(name, labels)
+        with self.__lock:
+            self.__counters[key] = self.__counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """ ヒストグラムに値を追加する
+
+        Args:
+            name (str): メトリクス名
+            value (float): 値(秒)
+            labels: ラベル
+        """
+
+        if not self.enabled:
+            return
+        key = _key(name, labels)
+        i = bisect_left(self.buckets, value)
+        with self.__lock:
+            hist = self.__histograms.get(key)
+            if hist == None:
+                hist = self.__histograms[key] = [0] * (len(self.buckets) + 3)
+            hist[i] += 1
+            hist[-2] += value
+            hist[-1] += 1
+
+    def timer(self, name, **labels):
+        """ with文の中の処理の所要時間をヒストグラムに追加する
+
+            with METRICS.timer("render_seconds", domain=domain):
+                ...
+        """
+
+        if not self.enabled:
+            return NULL_TIMER
+        return _Timer(self, name, labels)
+
+    def timed(self, name, **labels):
+        """ 関数の所要時間をヒストグラムに追加するデコレータ
+
+        lru_cacheのcache_info/cache_clearはそのまま使える
+        """
+
+        def __decorator(function):
+            @wraps(function)
+            def __wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                start = perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.observe(name, perf_counter() - start, **labels)
+            for attr in ("cache_info", "cache_clear"):
+                if hasattr(function, attr):
+                    setattr(__wrapper, attr, getattr(function, attr))
+            return __wrapper
+        return __decorator
+
+    def snapshot(self):
+        """ 集計した値をdictで返す
+
+        Returns:
+            dict: {"time": 時刻, "counters": [...], "histograms": [...]}
+        """
+
+        with self.__lock:
+            counters = dict(self.__counters)
+            histograms = {key: list(hist) for key, hist in self.__histograms.items()}
+        return {
+                "time": time(),
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(counters.items())
+                ],
+                "histograms": [
+                    {
+                        "name": name,
+                        "labels": dict(labels),
+                        "buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"], hist[:-2])),
+                        "sum": hist[-2],
+                        "count": hist[-1]
+                    }
+                    for (name, labels), hist in sorted(histograms.items())
+                ]
+        }
+
+    def merge(self, snapshot):
+        """ 別のRegistry(他のプロセス等)のsnapshotの値を加算する
+
+        Args:
+            snapshot (dict): snapshotの返り値、ヒストグラムのbucketは同じものであること
+        """
+
+        names = [str(b) for b in self.buckets] + ["+Inf"]
+        with self.__lock:
+            for counter in snapshot["counters"]:
+                key = _key(counter["name"], counter["labels"])
+                self.__counters[key] = self.__counters.get(key, 0) + counter["value"]
+            for histogram in snapshot["histograms"]:
+                key = _key(histogram["name"], histogram["labels"])
+                hist = self.__histograms.get(key)
+                if hist == None:
+                    hist = self.__histograms[key] = [0] * (len(self.buckets) + 3)
+                values = [histogram["buckets"][name] for name in names] + [histogram["sum"], histogram["count"]]
+                for i, value in enumerate(values):
+                    hist[i] += value
+
+    def prometheus(self, prefix=GC.METRICS_PREFIX):
+        """ 集計した値をPrometheusのテキスト形式で返す
+
+        Args:
+            prefix (str): メトリクス名の接頭辞
+
+        Returns:
+            str: Prometheusのテキスト形式
+        """
+
+        with self.__lock:
+            counters = dict(self.__counters)
+            histograms = {key: list(hist) for key, hist in self.__histograms.items()}
+
+        lines, typed = [], set()
+        for (name, labels), value in sorted(counters.items()):
+            name = prefix + name
+            if name not in typed:
+                typed.add(name)
+                lines.append("# TYPE {} counter".format(name))
+            lines.append("{}{} {}".format(name, _format_labels(labels), value))
+        for (name, labels), hist in sorted(histograms.items()):
+            name = prefix + name
+            if name not in typed:
+                typed.add(name)
+                lines.append("# TYPE {} histogram".format(name))
+            cumulative = 0
+            for le, n in zip([str(b) for b in self.buckets] + ["+Inf"], hist[:-2]):
+                cumulative += n
+                lines.append("{}_bucket{} {}".format(name, _format_labels(labels, [("le", le)]), cumulative))
+            lines.append("{}_sum{} {}".format(name, _format_labels(labels), hist[-2]))
+            lines.append("{}_count{} {}".format(name, _format_labels(labels), hist[-1]))
+        return "\n".join(lines) + "\n"
+
+    def write_snapshot(self, path):
+        """ snapshotをJSONでファイルに書き出す
+
+        読み込み途中のファイルが壊れないよう、一時ファイルに書いてから置き換える
+        """
+
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def start_snapshots(self, path, interval=GC.METRICS_SNAPSHOT_INTERVAL):
+        """ interval秒ごとにsnapshotをファイルに書き出すスレッドを開始する
+
+        Args:
+            path (str): 書き出すファイルのパス
+            interval (float): 書き出す間隔(秒)
+        """
+
+        self.stop_snapshots()
+        self.__stop.clear()
+
+        def run():
+            while not self.__stop.wait(interval):
+                self.write_snapshot(path)
+            self.write_snapshot(path)
+
+        self.__snapshot_thread = threading.Thread(target=run, daemon=True)
+        self.__snapshot_thread.start()
+
+    def stop_snapshots(self):
+        """ 書き出すスレッドを止める(止める前に最後の値を書き出す)
+        """
+
+        if self.__snapshot_thread != None:
+            self.__stop.set()
+            self.__snapshot_thread.join()
+            self.__snapshot_thread = None
+
+
+METRICS = Registry(enabled=GC.METRICS_ENABLED)
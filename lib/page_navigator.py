@@ -1,30 +1,94 @@
 # coding=utf-8
 
 import re
-from crawler.lib.timeout import on_timeout 
-from difflib import SequenceMatcher
+from collections import namedtuple
+from functools import lru_cache
+from crawler.lib.timeout import on_timeout, check_deadline
+from crawler.lib.metrics import METRICS
+from urllib.parse import urljoin, urlsplit
 import crawler.lib.const as GC
 
 
+ARCHIVE_URL_RE = re.compile(GC.ARCHIVE_URL_PAT)
+
+
+def original_url(url):
+    """ Internet Archive上のurlであれば、キャッシュ元のurlを返す
+
+        https://web.archive.org/web/20171201000000/http://hogehoge.com/article -> http://hogehoge.com/article
+        http://hogehoge.com/article -> http://hogehoge.com/article
+
+    Args:
+        url (str): url文字列
+
+    Returns:
+        str: キャッシュ元のurl、Internet Archive上のurlでなければurlをそのまま返す
+    """
+
+    m = ARCHIVE_URL_RE.match(url)
+    if m != None:
+        return m.group("original")
+    return url
+
+
+def split_path(path):
+    """ urlのpathを空でない要素のリストに分割する
+
+        /article/1234/5678/ -> ["article", "1234", "5678"]
+    """
+
+    return [seg for seg in path.split("/") if seg]
+
+
+def common_segments(segs1, segs2):
+    """ 2つのpathの要素のリストが先頭から何要素一致しているかを返す
+
+    最後に比較する要素は、拡張子を除いた部分が前方一致していれば一致とみなす
+        ["a", "123.html"], ["a", "123_2.html"] -> 2
+    """
+
+    n = 0
+    for seg1, seg2 in zip(segs1, segs2):
+        if seg1 != seg2:
+            stem = seg1.rsplit(".", 1)[0]
+            if n == len(segs1) - 1 and stem and seg2.startswith(stem):
+                n += 1
+            break
+        n += 1
+    return n
+
+
+def normalize_host(netloc):
+
+    netloc = netloc.lower()
+    if netloc.startswith("www."):
+        return netloc[4:]
+    return netloc
+
+
+@METRICS.timed("is_next_url_seconds")
+@lru_cache(maxsize=GC.IS_NEXT_URL_CACHE_SIZE)
 def is_next_url(next_url, item_link):
     """ next_urlが次ページへのリンクか否かを判定する
 
-    判定をする際は、次ページリンク候補の文字列(next_url)と、スクレイピング元urlの文字列(item_link)の比較を行い、
-    item_link中に含まれるnext_urlの割合, i.e. recall が0.5以上であれば次ページへのリンクとみなす
+    判定をする際は、次ページリンク候補(next_url)をスクレイピング元url(item_link)を基準に解決し、
+    ホスト、pathの前方一致、クエリパラメータの構造を比較する
+    ホストが一致し、item_linkのpathの要素のうち先頭からRECALL_THR以上がnext_urlと一致していれば次ページへのリンクとみなす
+    Internet Archive上のurlはキャッシュ元のurl同士で比較する
         http://youtube.com, http://hogehoge.com -> False
         http://hogehoge.com/article, http://hogehoge.com -> True
-        http://hogehoge.com/article/1234/5678, /article/1234/5678?page=2 - > True 
+        http://hogehoge.com/article/1234/5678, /article/1234/5678?page=2 -> True
 
     例外として、next_urlがitem_linkと比較して#がinsertされている場合のみはアンカなのでFalseを返す
-        http://hogehoge.com/article#overview, http://hogehoge.com/article
+        http://hogehoge.com/article#overview, http://hogehoge.com/article -> False
 
-    また、next_urlが?から始まるパラメータの場合は、Trueを返す
+    また、next_urlが?から始まるパラメータの場合や、pathが同じでパラメータのみ異なる場合は、Trueを返す
     このとき、ドメインが一致していない場合はFalseとなる
         http://hogehoge.com/article, http://hogehoge.com/article?page=2 -> True
         http://hogehoge.com/article, ?page=2 -> True
         http://hogehoge.com/article, http://youtube.com/article?page=2 -> False
 
-    
+    同じ引数に対する結果はキャッシュされる
 
     Args:
         next_url (str): 次ページへのリンク候補
@@ -34,61 +98,58 @@ def is_next_url(next_url, item_link):
         bool: 次ページへのリンクだった場合はTrue、そうでない場合はFalse
     """
 
-    TAG = 0
-    SEQ1_START = 1
-    SEQ1_END = 2 
-
-    def is_anchor(m):
-        
-        opcodes = m.get_opcodes()
-        if opcodes[-1][TAG] == "delete":  # ページ内リンクの場合は末尾がdelete
-            start = opcodes[-1][SEQ1_START]
-            end = opcodes[-1][SEQ1_END]
-            if opcodes[-1][start:end][:1] == "#":
-                return True
+    if next_url == None:
         return False
+    if next_url[:1] == "#":  # ページ内リンク
+        return False
+    if next_url[:1] == "?":  # パラメータを与えるリンク
+        return True
 
-    def is_param(m, cand):
+    item = urlsplit(original_url(item_link))
+    if item.netloc:
+        nxt = urlsplit(original_url(urljoin(item_link, next_url)))
+    else:
+        nxt = urlsplit(original_url(next_url))
 
-        if cand[:1] == "?":
-            return True
-        opcodes = m.get_opcodes()
-        if opcodes[-1][TAG] == "delete":
-            start = opcodes[-1][SEQ1_START]
-            end = opcodes[-1][SEQ1_END]
-            if opcodes[-1][start:end][:1] == "?":
-                return True 
+    if nxt.netloc and item.netloc and normalize_host(nxt.netloc) != normalize_host(item.netloc):
         return False
 
-    def calc_recall(m, whole_len):
+    item_segs, next_segs = split_path(item.path), split_path(nxt.path)
+    if item_segs == next_segs:
+        # pathが同じ場合、パラメータが異なれば次ページ、#のみ異なる場合はアンカ
+        return nxt.query != item.query
 
-        # 一致する部分の長さを求める
-        matched_len = sum([opcode[SEQ1_END] - opcode[SEQ1_START]
-                for opcode in m.get_opcodes() if opcode[TAG] == "equal"])
+    if not item_segs:
+        return True
+    # pathの前方一致の割合が一定値以上なら次ページへのリンクとする
+    recall = float(common_segments(item_segs, next_segs)) / len(item_segs)
+    return recall >= GC.RECALL_THR
 
-        return float(matched_len) / whole_len
 
-    if next_url == None:
-        return False
+NEXT_ATEXT = "(?:次のページ|次へ|次ページ)"
+DISP_ATEXT = "(?:記事全文を表示する|全文を表示する|全文を表示|続きを読む)"
 
-    matcher = SequenceMatcher()
-    matcher.set_seq1(next_url)
-    matcher.set_seq2(item_link)
 
-    # ページ内リンクの場合
-    if is_anchor(matcher):
-        return False
-    # パラメータを与えるリンクの場合
-    if is_param(matcher, next_url):
-        return True
-    # 部分一致文字列からnext_urlのrecall計算し一定値以上なら
-    # 次ページへのリンクとする
-    if calc_recall(matcher, len(next_url)) >= RECALL_THR:
-        return True
+def format_link_pat(atext):
+    """ アンカテキストがatextにマッチするリンクの正規表現文字列を返す
+
+    Args:
+        atext (str): アンカテキストの正規表現
 
-    return False  
+    Returns:
+        str: GC.LINK_PATにatextを埋め込んだ正規表現文字列
+    """
 
+    return GC.LINK_PAT.format(
+            link=GC.LINK_GROUP_NAME,
+            url=GC.URL_PAT,
+            atext=atext,
+            open_brackets=GC.OPEN_BRACKETS_PAT,
+            closed_brackets=GC.CLOSED_BRACKETS_PAT
+    )
 
+
+@lru_cache(maxsize=None)
 def get_nextpat():
     """ クローリングしている記事が複数ページにまたがっているか否か判定する正規表現を返す
 
@@ -98,19 +159,10 @@ def get_nextpat():
        re.pattern: 次ページリンクがあるか否か判定する正規表現パターン 
     """
 
-    next_pat = re.compile(
-            GC.LINK_PAT.format(
-                link=GC.LINK_GROUP_NAME,
-                url=GC.URL_PAT,
-                atext="(?:次のページ|次へ|次ページ)",
-                open_brackets=GC.OPEN_BRACKETS_PAT,
-                closed_brackets=GC.CLOSED_BRACKETS_PAT
-            )
-    ) 
-
-    return next_pat
+    return re.compile(format_link_pat(NEXT_ATEXT))
 
 
+@lru_cache(maxsize=GC.MAX_PAGES + 1)
 def get_nextpat_by_pagectr(ctr):
     """ クローリングしている記事が複数ページにまたがっているか否か判定する正規表現を返す
 
@@ -122,19 +174,10 @@ def get_nextpat_by_pagectr(ctr):
         re.pattern: 次ページリンクがあるか否か判定する正規表現パターン  
     """ 
 
-    next_pat = re.compile(
-            GC.LINK_PAT.format(
-                link=GC.LINK_GROUP_NAME, 
-                url=GC.URL_PAT,
-                atext=str(ctr + 1),
-                open_brackets=GC.OPEN_BRACKETS_PAT,
-                closed_brackets=GC.CLOSED_BRACKETS_PAT
-            )
-    )
-
-    return next_pat
+    return re.compile(format_link_pat(str(ctr + 1)))
 
 
+@lru_cache(maxsize=None)
 def get_disppat():
     """ クローリングしている記事が全文表示になっているか否かを判定する正規表現を返す
 
@@ -142,17 +185,62 @@ def get_disppat():
        re.pattern: 続きを読むリンクがあるか否か判定する正規表現パターン   
     """ 
 
-    disp_pat = re.compile(
-            GC.LINK_PAT.format(
-                link=GC.LINK_GROUP_NAME, 
-                url=GC.URL_PAT,
-                atext="(?:記事全文を表示する|全文を表示する|全文を表示|続きを読む)",
-                open_brackets=GC.OPEN_BRACKETS_PAT,
-                closed_brackets=GC.CLOSED_BRACKETS_PAT
-            )
-    )
+    return re.compile(format_link_pat(DISP_ATEXT))
+
+
+# scan_linksの結果
+ScannedLinks = namedtuple("ScannedLinks", ("disp_url", "next_url"))
+
+
+class LinkScanner:
+    """ 続きを読むリンク、次へリンク、ページ番号による次ページリンクを1回の走査で検出するクラス
+
+    3種類のアンカテキストを名前付きグループの選択としてGC.LINK_PATに埋め込んだ正規表現を用いる
+    1つのaタグがマッチするアンカテキストは高々1種類なので、
+    各種類の最初のマッチはそれぞれの正規表現でsearchした結果と一致する
+    """
+
+    DISP = "disp"
+    NEXT = "next"
+    CTR = "ctr"
+
+    @staticmethod
+    @lru_cache(maxsize=GC.MAX_PAGES + 1)
+    def get_pat(ctr):
+        """ ページ番号ctrの記事を走査する正規表現を返す
 
-    return disp_pat
+        Args:
+            ctr (int): 現在参照しているページのページ番号
+
+        Returns:
+            re.pattern: 3種類のリンクを検出する正規表現パターン
+        """
+
+        atext = "(?:(?P<{}>{})|(?P<{}>{})|(?P<{}>{}))".format(
+                LinkScanner.DISP, DISP_ATEXT,
+                LinkScanner.NEXT, NEXT_ATEXT,
+                LinkScanner.CTR, str(ctr + 1)
+        )
+        return re.compile(format_link_pat(atext))
+
+    def scan(self, html, page_cnt):
+        """ htmlを1回走査し、続きを読むリンクと次ページへのリンクを返す
+
+        Args:
+            html (str): htmlの生テキスト
+            page_cnt (int): 現在参照しているページのページ番号（>=1）
+
+        Returns:
+            ScannedLinks: search_dispurl、search_nexturlと同じ結果
+        """
+
+        found = scan_url(self.get_pat(page_cnt), html)
+        disp_url = found.get(self.DISP)
+        next_url = found.get(self.NEXT)
+        if next_url == None or next_url[:1] == "#": # #から始まるものはアンカなのでスキップ
+            next_url = found.get(self.CTR)
+
+        return ScannedLinks(disp_url, next_url)
 
 
 def handler_func(msg):
@@ -162,7 +250,7 @@ def handler_func(msg):
     raise TimeoutError
 
 
-@on_timeout(limit=10, handler=handler_func, hint="search_url")
+@on_timeout(limit=10, handler=handler_func, hint="search_url", isolate=True)
 def search_url(p, html):
     """ 与えられたパターンにマッチする文字列がhtmlにあるか否か判定、group_nameで指定した要素を返す
 
@@ -184,6 +272,62 @@ def search_url(p, html):
     return None
 
 
+@on_timeout(limit=10, handler=handler_func, hint="scan_url", isolate=True)
+def scan_url(p, html):
+    """ LinkScannerの正規表現でhtmlを走査し、種類ごとに最初に検出したurlを返す
+
+    結果が確定した時点で走査を打ち切る
+
+    Args:
+        p (re.pattern): LinkScanner.get_patが返す正規表現
+        html (str): htmlの生テキスト
+
+    Returns:
+        dict: リンクの種類 -> url
+    """
+
+    found = {}
+    for m in p.finditer(html):
+        check_deadline()
+        for kind in (LinkScanner.DISP, LinkScanner.NEXT, LinkScanner.CTR):
+            if kind not in found and m.group(kind) != None:
+                found[kind] = m.group(GC.LINK_GROUP_NAME)
+        # 次へリンクはページ番号のリンクより優先されるので、次へリンクが見つかるまでは打ち切らない
+        if LinkScanner.DISP in found and LinkScanner.NEXT in found:
+            if found[LinkScanner.NEXT][:1] != "#" or LinkScanner.CTR in found:
+                break
+
+    return found
+
+
+_scanner = LinkScanner()
+_last_scan = (None, None, None)  # 最後に走査した(html, page_cnt, ScannedLinks)
+
+
+@METRICS.timed("link_search_seconds", func="scan_links")
+def scan_links(html, page_cnt):
+    """ 「続きを読む」などのリンクと「次ページへ」などのリンクを1回の走査で検出する
+
+    Args:
+        html (str): htmlの生テキスト
+        page_cnt (int): 現在参照しているページのページ番号（>=1）
+
+    Returns:
+        ScannedLinks: disp_url、next_urlの組、検出されなかったものはNone
+    """
+
+    # static-firstモードの判定で走査したhtmlを、クローラが同じページ番号で走査する場合は結果を再利用する
+    # (同一のオブジェクトの場合のみ再利用し、保持するhtmlは直前の1件のみ)
+    global _last_scan
+    last_html, last_page_cnt, links = _last_scan
+    if last_html is html and last_page_cnt == page_cnt:
+        return links
+    links = _scanner.scan(html, page_cnt)
+    _last_scan = (html, page_cnt, links)
+    return links
+
+
+@METRICS.timed("link_search_seconds", func="search_dispurl")
 def search_dispurl(html):
     """ 「続きを読む」などのリンクがあるか否か検出し、存在した場合はそのurlを返す
 
@@ -201,6 +345,7 @@ def search_dispurl(html):
     return None
 
 
+@METRICS.timed("link_search_seconds", func="search_nexturl")
 def search_nexturl(html, page_cnt):
     """ 「次ページへ」などのリンクがあるか否か検出し、存在した場合はそのurlを返す
 
@@ -0,0 +1,255 @@
+# coding=utf-8
+
+"""
+ホストごとにリクエストの間隔を制御するスケジューラを提供するモジュール
+"""
+
+import multiprocessing
+import os
+import threading
+from collections import defaultdict
+from time import monotonic, sleep
+from urllib.parse import urlparse
+
+import crawler.lib.const as GC
+
+
+class TokenBucket:
+    """ 予約型のトークンバケット
+
+    トークンが足りない場合も予約はでき、トークンが貯まるまでの待ち時間を返す
+
+    Attributes:
+        rate (float): 1秒あたりに補充されるトークン数
+        capacity (float): 貯めておけるトークンの最大数
+    """
+
+    def __init__(self, rate, capacity):
+
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+
+    def reserve(self, now):
+        """ トークンを1つ予約し、使えるようになるまでの秒数を返す
+        """
+
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+
+class SharedTokenBucket:
+    """ 複数のプロセスで共有する予約型のトークンバケット
+
+    状態をmultiprocessingの共有メモリに置き、プロセスをまたいで1つのホストへのリクエストの間隔を守る
+    monotonic()はプロセス間で共通の時計を用いるため、予約した時刻をそのまま比較できる
+    ワーカープロセスの起動前に作り、引数として渡すこと
+
+    Attributes:
+        rate (float): 1秒あたりに補充されるトークン数
+        capacity (float): 貯めておけるトークンの最大数
+        min_interval (float): リクエストの最小間隔(秒)
+    """
+
+    def __init__(self, rate, capacity, min_interval=0.0, ctx=multiprocessing):
+
+        self.rate = rate
+        self.capacity = capacity
+        self.min_interval = min_interval
+        self.__state = ctx.Array("d", [capacity, monotonic(), 0.0])  # トークン数、更新時刻、次に送れる時刻
+
+    def reserve(self, now):
+        """ トークンを1つ予約し、使えるようになるまでの秒数を返す
+        """
+
+        with self.__state.get_lock():
+            tokens, updated, next_allowed = self.__state[:]
+            tokens = min(self.capacity, tokens + max(now - updated, 0.0) * self.rate) - 1
+            wait = max(-tokens / self.rate if tokens < 0 else 0.0, next_allowed - now, 0.0)
+            self.__state[:] = [tokens, max(now, updated), now + wait + self.min_interval]
+        return wait
+
+
+def parse_crawl_delay(lines, user_agent="*"):
+    """ robots.txtの各行からuser_agentに適用されるCrawl-delayを読み込む
+
+    urllib.robotparserは整数のCrawl-delayしか扱えないため、小数も読み込めるように独自に解釈する
+    user_agentに一致するグループの指定を、*のグループの指定より優先する
+
+    Args:
+        lines (list): robots.txtの各行
+        user_agent (str): User-Agent
+
+    Returns:
+        float: Crawl-delay(秒)、指定がなければNone
+    """
+
+    delays, agents, in_rules = {}, [], False
+    for line in lines:
+        line = line.split("#", 1)[0].strip()
+        if ":" not in line:
+            continue
+        key, value = [x.strip() for x in line.split(":", 1)]
+        key = key.lower()
+        if key == "user-agent":
+            if in_rules:
+                agents, in_rules = [], False
+            agents.append(value.lower())
+        else:
+            in_rules = True
+            if key == "crawl-delay":
+                try:
+                    delay = float(value)
+                except ValueError:
+                    continue
+                for agent in agents:
+                    delays.setdefault(agent, delay)
+
+    user_agent = user_agent.lower()
+    for agent, delay in delays.items():
+        if agent != "*" and agent in user_agent:
+            return delay
+    return delays.get("*")
+
+
+class HostScheduler:
+    """ ホストごとのトークンバケットと最小間隔でリクエストの時刻を決めるスケジューラ
+
+    異なるホストへのリクエストは待たずに実行でき、同じホストへのリクエストのみ間隔をあける
+    robots_dirを指定した場合、robots_dir/<ホスト名>.txtにあるrobots.txtのCrawl-delayも最小間隔として用いる
+    sharedに含まれるホストは、プロセス内のバケットの代わりにプロセス間で共有するSharedTokenBucketで間隔をあける
+
+    Attributes:
+        rate (float): 1ホストあたりの1秒間のリクエスト数の上限
+        burst (int): 1ホストに連続して送れるリクエスト数
+        min_interval (float): 同じホストへのリクエストの最小間隔(秒)
+        robots_dir (str): robots.txtを格納したディレクトリ
+        user_agent (str): robots.txtを参照する際のUser-Agent
+        shared (dict): ホスト名 -> SharedTokenBucket
+    """
+
+    def __init__(
+            self,
+            rate=GC.HOST_RATE,
+            burst=GC.HOST_BURST,
+            min_interval=GC.HOST_MIN_INTERVAL,
+            robots_dir=None,
+            user_agent="*",
+            shared=None
+    ):
+
+        self.rate = rate
+        self.burst = burst
+        self.min_interval = min_interval
+        self.robots_dir = robots_dir
+        self.user_agent = user_agent
+        self.shared = shared or {}
+        self.__lock = threading.Lock()
+        self.__buckets = {}
+        self.__next_allowed = defaultdict(float)
+        self.__intervals = {}
+        self.__waiting = defaultdict(int)
+        self.__stats = defaultdict(lambda: {"requests": 0, "total_wait": 0.0, "max_wait": 0.0})
+
+    def crawl_delay(self, host):
+        """ robots_dirにあるhostのrobots.txtからCrawl-delayを読み込む
+
+        Args:
+            host (str): ホスト名
+
+        Returns:
+            float: Crawl-delay(秒)、指定がなければNone
+        """
+
+        if self.robots_dir == None:
+            return None
+        path = os.path.join(self.robots_dir, "{}.txt".format(host.split(":")[0]))
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8", errors="replace") as f:
+            return parse_crawl_delay(f.read().splitlines(), self.user_agent)
+
+    def interval(self, host):
+        """ hostへのリクエストの最小間隔を返す
+        """
+
+        if host not in self.__intervals:
+            delay = self.crawl_delay(host)
+            self.__intervals[host] = max(self.min_interval, delay or 0)
+        return self.__intervals[host]
+
+    def reserve(self, url):
+        """ urlのホストへのリクエストの時刻を予約し、それまでの秒数を返す
+
+        Args:
+            url (str): リクエストを送るurl
+
+        Returns:
+            tuple: (ホスト名, 待つ秒数)
+        """
+
+        host = urlparse(url).netloc
+        with self.__lock:
+            now = monotonic()
+            if host in self.shared:
+                wait = self.shared[host].reserve(now)
+            else:
+                if host not in self.__buckets:
+                    self.__buckets[host] = TokenBucket(self.rate, self.burst)
+                wait = max(
+                        self.__buckets[host].reserve(now),
+                        self.__next_allowed[host] - now,
+                        0.0
+                )
+                self.__next_allowed[host] = now + wait + self.interval(host)
+            stats = self.__stats[host]
+            stats["requests"] += 1
+            stats["total_wait"] += wait
+            stats["max_wait"] = max(stats["max_wait"], wait)
+            self.__waiting[host] += 1
+        return host, wait
+
+    def __done(self, host):
+
+        with self.__lock:
+            self.__waiting[host] -= 1
+
+    def acquire(self, url):
+        """ urlのホストにリクエストを送れるようになるまで待つ
+
+        Args:
+            url (str): リクエストを送るurl
+
+        Returns:
+            float: 待った秒数
+        """
+
+        host, wait = self.reserve(url)
+        try:
+            if wait > 0:
+                sleep(wait)
+        finally:
+            self.__done(host)
+        return wait
+
+    def stats(self):
+        """ ホストごとの待ち行列の長さと待ち時間を返す
+
+        Returns:
+            dict: ホスト名 -> {"queue_depth", "requests", "total_wait", "max_wait", "avg_wait"}
+        """
+
+        with self.__lock:
+            return {
+                    host: dict(
+                        stats,
+                        queue_depth=self.__waiting[host],
+                        avg_wait=stats["total_wait"] / stats["requests"]
+                    )
+                    for host, stats in self.__stats.items()
+            }
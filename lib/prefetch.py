@@ -0,0 +1,303 @@
+# coding=utf-8
+
+"""
+複数ページの記事の後続ページを先読みする機能を提供するモジュール
+
+search_nexturlで見つかった次ページのurlから、1ページ目のurlに対するページ送りのパターン
+(?page=2、_2.html、/2/ 等)をドメインごとに学習し、次ページへのリンクを探す前に予測したurlを並行に取得しておく
+予測したurlが実際に見つかったリンクと異なる場合、先読みした結果は使わずに破棄する
+記事のページ数もドメインごとに記録し、そのページまで続く記事が少ない場合は先読みしない
+Internet Archive上のurlは、キャッシュ元のurlでパターンを学習し、1ページ目と同じ接頭辞を付けて予測する
+"""
+
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from os.path import commonprefix
+from urllib.parse import urlparse
+
+import crawler.lib.const as GC
+from crawler.lib.page_navigator import original_url
+from crawler.lib.timeout import remaining
+
+
+def split_archive(url):
+    """ urlをInternet Archiveの接頭辞とキャッシュ元のurlに分ける
+
+        https://web.archive.org/web/20171201000000/http://hogehoge.com/a -> (https://web.archive.org/web/20171201000000/, http://hogehoge.com/a)
+        http://hogehoge.com/a -> ("", http://hogehoge.com/a)
+    """
+
+    original = original_url(url)
+    return url[:len(url) - len(original)], original
+
+
+def derive_rule(origin_url, page_url, page):
+    """ 1ページ目のurlとpageページ目のurlから、ページ送りのパターンを求める
+
+    1ページ目のurlの末尾(suffix)の手前にあるremovedを、head + ページ番号 + tailに置き換えるとpageページ目のurlになる
+        http://hogehoge.com/a/123.html, http://hogehoge.com/a/123_2.html -> ("", "_", "", ".html")
+        http://hogehoge.com/a/123, http://hogehoge.com/a/123?page=2 -> ("", "?page=", "", "")
+
+    Args:
+        origin_url (str): 1ページ目のurl(Internet Archiveの接頭辞を除いたもの)
+        page_url (str): pageページ目のurl(Internet Archiveの接頭辞を除いたもの)
+        page (int): page_urlのページ番号
+
+    Returns:
+        tuple: (removed, head, tail, suffix)、page_urlにページ番号が含まれない場合はNone
+    """
+
+    p = len(commonprefix([origin_url, page_url]))
+    o_rest, p_rest = origin_url[p:], page_url[p:]
+    s = len(commonprefix([o_rest[::-1], p_rest[::-1]]))
+    removed, inserted = o_rest[:len(o_rest) - s], p_rest[:len(p_rest) - s]
+    n = str(page)
+    i = inserted.rfind(n)
+    if i < 0:
+        return None
+    return removed, inserted[:i], inserted[i + len(n):], o_rest[len(o_rest) - s:]
+
+
+def apply_rule(rule, origin_url, page):
+    """ ページ送りのパターンから、1ページ目のurlに対するpageページ目のurlを求める
+
+    Returns:
+        str: pageページ目のurl、パターンが当てはまらない場合はNone
+    """
+
+    removed, head, tail, suffix = rule
+    if not origin_url.endswith(removed + suffix):
+        return None
+    return "{}{}{}{}{}".format(origin_url[:len(origin_url) - len(removed + suffix)], head, page, tail, suffix)
+
+
+class PaginationTemplates:
+    """ ドメインごとにページ送りのパターンと記事のページ数を学習し、後続ページのurlを予測するクラス
+
+    スレッド間で共有できる
+
+    Attributes:
+        min_support (int): 予測に使うまでに同じパターン(ページ数の場合は記事)を観測する回数
+        max_domains (int): パターンを保持するドメイン数の上限(超えた場合は古いものから捨てる)
+    """
+
+    def __init__(self, min_support=GC.PREFETCH_MIN_SUPPORT, max_domains=GC.PREFETCH_MAX_DOMAINS):
+
+        self.min_support = min_support
+        self.max_domains = max_domains
+        self.__domains = OrderedDict()  # ドメイン -> (Counter(パターン -> 観測回数), Counter(ページ数 -> 記事数))
+        self.__lock = threading.Lock()
+
+    def __update(self, domain):
+        """ domainの学習結果を最近使ったものとして返す(ロックを取得して呼び出す)
+        """
+
+        entry = self.__domains.pop(domain, None) or (Counter(), Counter())
+        self.__domains[domain] = entry
+        while len(self.__domains) > self.max_domains:
+            self.__domains.popitem(last=False)
+        return entry
+
+    def learn(self, origin_url, page_url, page):
+        """ 実際に見つかった次ページのurlからパターンを学習する
+
+        Args:
+            origin_url (str): 記事の1ページ目のurl
+            page_url (str): pageページ目のurl
+            page (int): page_urlのページ番号(>=2)
+        """
+
+        _, origin = split_archive(origin_url)
+        rule = derive_rule(origin, split_archive(page_url)[1], page)
+        if rule == None:
+            return
+        with self.__lock:
+            self.__update(urlparse(origin).netloc)[0][rule] += 1
+
+    def learn_length(self, origin_url, pages):
+        """ 取得を終えた記事のページ数を記録する
+
+        Args:
+            origin_url (str): 記事の1ページ目のurl
+            pages (int): 記事のページ数
+        """
+
+        with self.__lock:
+            self.__update(urlparse(split_archive(origin_url)[1]).netloc)[1][pages] += 1
+
+    def reach_rate(self, origin_url, page, n):
+        """ ドメインの記事のうち、pageページ目まで続いたものがnページ目まで続いた割合を返す
+
+        Returns:
+            float: 割合、pageページ目まで続いた記事をmin_support回観測していない場合はNone
+        """
+
+        with self.__lock:
+            entry = self.__domains.get(urlparse(split_archive(origin_url)[1]).netloc)
+            lengths = dict(entry[1]) if entry else {}
+        reached = sum(count for pages, count in lengths.items() if pages >= page)
+        if reached < self.min_support:
+            return None
+        return float(sum(count for pages, count in lengths.items() if pages >= n)) / reached
+
+    def predict(self, origin_url, page):
+        """ 記事のpageページ目のurlを予測する
+
+        Returns:
+            str: 予測したurl、十分に観測したパターンが無い場合はNone
+        """
+
+        prefix, origin = split_archive(origin_url)
+        with self.__lock:
+            entry = self.__domains.get(urlparse(origin).netloc)
+            best = entry[0].most_common(1) if entry else []
+        if not best or best[0][1] < self.min_support:
+            return None
+        url = apply_rule(best[0][0], origin, page)
+        return None if url == None else prefix + url
+
+
+class Prefetcher:
+    """ 記事の後続ページを予測したurlで並行に取得しておくクラス
+
+    次ページのurlが確定するたびにadvanceを呼び、その先の最大depthページを先読みする
+    ただし、ドメインの記事のうちそのページまで続いたものがmin_reach未満であれば先読みしない
+    (記事がそのページまで続いた記録が無い間は、存在しないページへのリクエストになりやすいため先読みしない)
+    先読みした結果はtakeで受け取る、予測が外れたものや記事の最後のページより先のものは破棄する
+    ドメインの記事が必ずしも続いていないページの先読みは、記事ごとにmax_speculative回までとする
+    破棄した時点で既にリクエストを送っていたものはwastedとして数える
+
+    Attributes:
+        fetch (function): urlとページ番号を受け取り(html, status_code)を返す関数(utils.getと同じ形式)
+        depth (int): urlが確定したページの先に先読みするページ数の上限
+        min_reach (float): 先読みするページまで記事が続く割合の下限
+        max_speculative (int): 記事ごとに、続く割合が1未満のページを先読みする回数の上限
+        templates (PaginationTemplates): ページ送りのパターン
+        stats (dict): submitted(先読みした数)、hits(使われた数)、mismatched(予測が外れた数)、unused(記事の最後より先だった数)、
+            wasted(破棄したもののうちリクエストを送った数)
+    """
+
+    def __init__(
+            self,
+            fetch,
+            depth=GC.PREFETCH_DEPTH,
+            max_workers=GC.PREFETCH_WORKERS,
+            templates=None,
+            max_pages=GC.MAX_PAGES,
+            min_reach=GC.PREFETCH_MIN_REACH,
+            max_speculative=GC.PREFETCH_MAX_SPECULATIVE
+    ):
+
+        self.fetch = fetch
+        self.depth = depth
+        self.min_reach = min_reach
+        self.max_speculative = max_speculative
+        self.max_pages = max_pages
+        self.templates = templates or PaginationTemplates()
+        self.stats = {"submitted": 0, "hits": 0, "mismatched": 0, "unused": 0, "wasted": 0}
+        self.__executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.__pending = {}  # 記事の1ページ目のurl -> {ページ番号: (予測したurl, Future)}
+        self.__pages = {}  # 記事の1ページ目のurl -> urlが確定した最後のページ番号
+        self.__speculative = Counter()  # 記事の1ページ目のurl -> 続く割合が1未満のページを先読みした回数
+        self.__lock = threading.Lock()
+
+    def __discard(self, futures, reason):
+
+        for _, future in futures:
+            if not future.cancel():  # 実行中か実行済みのものはリクエストを送っている
+                self.stats["wasted"] += 1
+        self.stats[reason] += len(futures)
+
+    def advance(self, origin_url, page_url, page):
+        """ 記事のpageページ目のurlが確定した際に呼び出す
+
+        パターンを学習し、予測が外れていた先読みを破棄してから、page + 1ページ目以降を先読みする
+        ドメインの記事がそのページまで続く割合がmin_reach未満か、まだ記録が無いページより先は先読みしない
+        続く割合が1未満のページは、記事ごとにmax_speculative回まで先読みする
+
+        Args:
+            origin_url (str): 記事の1ページ目のurl
+            page_url (str): 実際に見つかったpageページ目のurl
+            page (int): ページ番号(>=2)
+        """
+
+        self.templates.learn(origin_url, page_url, page)
+        with self.__lock:
+            self.__pages[origin_url] = page
+            pending = self.__pending.setdefault(origin_url, {})
+            expected = pending.get(page)
+            if expected != None and expected[0] != page_url:
+                # 予測が外れた場合、それ以降のページの予測も外れているとみなす
+                self.__discard([pending.pop(n) for n in sorted(pending) if n >= page], "mismatched")
+            for n in range(page + 1, min(page + self.depth, self.max_pages) + 1):
+                if n in pending:
+                    continue
+                rate = self.templates.reach_rate(origin_url, page, n)
+                if rate == None or rate < self.min_reach:
+                    break
+                if rate < 1.0 and self.__speculative[origin_url] >= self.max_speculative:
+                    break
+                url = self.templates.predict(origin_url, n)
+                if url == None:
+                    break
+                if rate < 1.0:
+                    self.__speculative[origin_url] += 1
+                pending[n] = (url, self.__executor.submit(self.fetch, url, n))
+                self.stats["submitted"] += 1
+
+    def take(self, origin_url, page_url, page):
+        """ 先読みした結果を返す
+
+        Returns:
+            tuple: (html, status_code)、先読みしていない場合はNone
+                先読みで例外が送出された場合はその例外を送出する
+                期限までに先読みが終わらなければTimeoutErrorを送出する
+        """
+
+        with self.__lock:
+            pending = self.__pending.get(origin_url, {})
+            entry = pending.get(page)
+            if entry == None or entry[0] != page_url:
+                return None
+            del pending[page]
+            self.stats["hits"] += 1
+        try:
+            return entry[1].result(timeout=remaining())
+        except FutureTimeoutError:
+            entry[1].cancel()
+            raise TimeoutError("prefetch of {} exceeded the deadline".format(page_url))
+
+    def finish(self, origin_url):
+        """ 記事の取得を終えた際に呼び出し、記事のページ数を記録して残っている先読みを破棄する
+        """
+
+        with self.__lock:
+            pending = self.__pending.pop(origin_url, {})
+            pages = self.__pages.pop(origin_url, 1)
+            self.__speculative.pop(origin_url, None)
+            self.__discard(list(pending.values()), "unused")
+        self.templates.learn_length(origin_url, pages)
+
+    def hit_rate(self):
+        """ 先読みしたページのうち使われたものの割合を返す
+        """
+
+        if self.stats["submitted"] == 0:
+            return 0.0
+        return float(self.stats["hits"]) / self.stats["submitted"]
+
+    def report(self, logger):
+        """ 先読みの統計をloggerに出力する
+        """
+
+        logger.info(
+                "prefetch: {} submitted, {} hits ({:.1%}), {} mismatched, {} past the last page, {} wasted requests".format(
+                    self.stats["submitted"], self.stats["hits"], self.hit_rate(),
+                    self.stats["mismatched"], self.stats["unused"], self.stats["wasted"])
+        )
+
+    def close(self):
+
+        self.__executor.shutdown(wait=False, cancel_futures=True)
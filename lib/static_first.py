@@ -0,0 +1,139 @@
+# coding=utf-8
+
+"""
+requestsで取得したhtmlで十分な場合にブラウザでの描画を省略する、static-firstモードのための機能を提供するモジュール
+"""
+
+import re
+import threading
+from collections import defaultdict
+from urllib.parse import urlparse
+
+import crawler.lib.const as GC
+import crawler.lib.page_navigator as navi
+import internet_archives.lib.const as C
+
+INVISIBLE_RE = re.compile(r"<(script|style|noscript)[^>]*>.*?</\1\s*>", re.S | re.I)
+TAG_RE = re.compile(r"<[^>]+>")
+SPACE_RE = re.compile(r"\s+")
+IA_LINK_RE = re.compile(
+        r"<div[^>]*id=[\"']{}[\"'][^>]*>.*?<a [^>]*href=".format(C.TARGET_LINK_ID),
+        re.S
+)
+IA_ERROR_RE = re.compile(
+        r"<div[^>]*class=[\"']{}[\"']".format(" ".join(C.TARGET_ERROR_CSS_SELECTOR.split(".")[1:]))
+)
+
+
+def text_length(html):
+    """ script等とタグを除いた本文の文字数を返す
+
+    Args:
+        html (str): htmlの生テキスト
+
+    Returns:
+        int: 空白を除いた本文の文字数
+    """
+
+    text = TAG_RE.sub("", INVISIBLE_RE.sub("", html))
+    return len(SPACE_RE.sub("", text))
+
+
+def is_sufficient(html, is_ia=False, page_cnt=1):
+    """ requestsで取得したhtmlがブラウザで描画しなくても十分か否か判定する
+
+    Internet Archiveのページの場合は、div#wb-metaにキャッシュへのリンクがあるか、
+    キャッシュが存在しない旨のエラーが表示されていれば十分とする
+    記事のページの場合は、クローラがpage_cntページ目で辿る「続きを読む」「次ページへ」などのリンクがあれば十分とする
+    (走査した結果はscan_linksが保持し、クローラが同じhtmlを走査する際に再利用する)
+    リンクが無い場合(1ページのみの記事や最後のページ)は、本文がGC.STATIC_MIN_TEXT_CHARS文字以上あれば十分とする
+
+    Args:
+        html (str): requestsで取得したhtml
+        is_ia (bool): Internet Archiveのページか否か
+        page_cnt (int): 取得したページのページ番号（>=1）
+
+    Returns:
+        bool: ブラウザでの描画が不要な場合はTrue
+    """
+
+    if not html:
+        return False
+    if is_ia:
+        return IA_LINK_RE.search(html) != None or IA_ERROR_RE.search(html) != None
+    try:
+        links = navi.scan_links(html, page_cnt)
+    except TimeoutError:
+        return False
+    if links.disp_url != None or links.next_url != None:
+        return True
+    return text_length(html) >= GC.STATIC_MIN_TEXT_CHARS
+
+
+class RenderStats:
+    """ static-firstモードでブラウザでの描画を省略できた割合をドメインごとに集計するクラス
+
+    Internet Archive上のurlはキャッシュ元のドメインで集計する
+    """
+
+    def __init__(self):
+
+        self.__lock = threading.Lock()
+        self.__counts = defaultdict(lambda: [0, 0])  # domain -> [省略した数, 描画した数]
+
+    def record(self, url, avoided):
+        """ 1ページ分の結果を記録する
+
+        Args:
+            url (str): 取得したurl
+            avoided (bool): ブラウザでの描画を省略したか否か
+        """
+
+        domain = urlparse(navi.original_url(url)).netloc
+        with self.__lock:
+            self.__counts[domain][0 if avoided else 1] += 1
+
+    def merge(self, rates):
+        """ 別のRenderStats(他のプロセス等)のratesの値を加算する
+
+        Args:
+            rates (dict): ratesの返り値
+        """
+
+        with self.__lock:
+            for domain, (avoided, total, _) in rates.items():
+                self.__counts[domain][0] += avoided
+                self.__counts[domain][1] += total - avoided
+
+    def reset(self):
+        """ 集計した値を全て消す
+        """
+
+        with self.__lock:
+            self.__counts.clear()
+
+    def rates(self):
+        """ ドメインごとの描画省略率を返す
+
+        Returns:
+            dict: ドメイン -> (省略した数, 全体の数, 省略率)
+        """
+
+        with self.__lock:
+            return {
+                    domain: (avoided, avoided + rendered, float(avoided) / (avoided + rendered))
+                    for domain, (avoided, rendered) in self.__counts.items()
+            }
+
+    def report(self, logger):
+        """ ドメインごとの描画省略率をloggerに出力する
+        """
+
+        for domain, (avoided, total, rate) in sorted(self.rates().items()):
+            logger.info(
+                    "static-first {}: {}/{} pages without rendering ({:.1%})".format(
+                        domain, avoided, total, rate)
+            )
+
+
+RENDER_STATS = RenderStats()
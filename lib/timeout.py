@@ -1,26 +1,387 @@
 # coding=utf-8
 
-# timeout-decoratorを使えばよい
+"""
+タイムアウト機能を提供するモジュール
 
+メインスレッドではsignal.setitimerによるSIGALRMで関数を打ち切る(正規表現のバックトラッキングも中断できる)
+SIGALRMはメインスレッドでしか受け取れないため、それ以外のスレッドでは次のいずれかで実行する
+    ・別スレッドで実行し、呼び出し元で完了を待つ(実行中の処理は止められない)
+    ・子プロセスで実行し、期限を過ぎたら子プロセスを終了する(isolate=True)
+    ・呼び出し元のスレッドで期限だけを設定して実行し、関数自身が期限で打ち切る(in_thread=False)
+期限(deadline)はcontextvarsで管理するため、スレッドやasyncioのタスクごとに独立している
+"""
+
+import multiprocessing
+import signal
+import threading
+from contextlib import contextmanager
+from contextvars import Context, ContextVar, copy_context
 from functools import wraps
+from time import monotonic
+
+import crawler.lib.const as GC
+
+_current_deadline = ContextVar("deadline", default=None)
+
+
+class Deadline:
+    """ 1つのurlの処理(取得、描画、探索)全体で共有する期限
+
+    Attributes:
+        expires_at (float): 期限となるtime.monotonic()の値
+    """
+
+    def __init__(self, seconds):
+
+        self.expires_at = monotonic() + seconds
+
+    def remaining(self):
+        """ 期限までの残り秒数を返す
+        """
+
+        return max(0.0, self.expires_at - monotonic())
+
+    def expired(self):
+
+        return monotonic() >= self.expires_at
+
+
+@contextmanager
+def deadline(seconds):
+    """ with文の中の処理で共有する期限を設定する
+
+    入れ子にした場合、外側の期限より後ろに延ばすことはできない
+        with deadline(30):
+            get(...)
+            search_nexturl(...)
+
+    Args:
+        seconds (float): 期限までの秒数
+    """
+
+    d = Deadline(seconds)
+    outer = _current_deadline.get()
+    if outer != None and outer.expires_at < d.expires_at:
+        d = outer
+    token = _current_deadline.set(d)
+    try:
+        yield d
+    finally:
+        _current_deadline.reset(token)
+
+
+def remaining(default=None):
+    """ 現在の期限までの残り秒数を返す
+
+    Args:
+        default (float): 期限が設定されていない場合に返す値
+
+    Returns:
+        float: 残り秒数、期限が設定されていなければdefault
+    """
+
+    d = _current_deadline.get()
+    if d == None:
+        return default
+    if default == None:
+        return d.remaining()
+    return min(default, d.remaining())
+
+
+def check_deadline():
+    """ 期限を過ぎていればTimeoutErrorを送出する
+
+    時間のかかるループの中で呼び出すことで、タイムアウトした処理を途中で打ち切ることができる
+    """
+
+    d = _current_deadline.get()
+    if d != None and d.expired():
+        raise TimeoutError("deadline exceeded")
+
+
+def call_with_timeout(function, limit, *args, **kwargs):
+    """ functionを実行し、limit秒以内に終わらなければTimeoutErrorを送出する
+
+    期限が設定されている場合は、limitと期限までの残り時間の短い方を使う
+    メインスレッド以外ではfunctionを別スレッドで実行するため、タイムアウトした処理の実行は続くが、
+    実行中の処理にも同じ期限が設定されるため、check_deadlineを呼んでいれば打ち切られる
+
+    Args:
+        function (function): 実行する関数
+        limit (float): 制限時間(秒)、小数も指定できる
+
+    Returns:
+        functionの返り値
+    """
+
+    return timeout(limit)(function)(*args, **kwargs)
+
+
+def _use_alarm():
+    """ SIGALRMで関数を打ち切れるか否か
+    """
+
+    return hasattr(signal, "setitimer") and threading.current_thread() is threading.main_thread()
+
+
+def _call_with_alarm(function, limit, args, kwargs, expire):
+    """ メインスレッドでfunctionを実行し、limit秒を過ぎたらSIGALRMのハンドラでexpireを呼び出す
+
+    expireが例外を送出すると実行中の処理が中断され、送出しなければ処理を続ける
+    外側で設定したタイマーの方が先に切れる場合はそちらに任せ、終了後は外側のタイマーを元に戻す
+    """
+
+    outer_delay = signal.getitimer(signal.ITIMER_REAL)[0]
+    if outer_delay > 0 and outer_delay <= limit:
+        return function(*args, **kwargs)
+
+    start = monotonic()
+    previous = signal.signal(signal.SIGALRM, lambda signum, frame: expire())
+    signal.setitimer(signal.ITIMER_REAL, limit)
+    try:
+        return function(*args, **kwargs)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous if previous != None else signal.SIG_DFL)
+        if outer_delay > 0:
+            # 外側のタイマーが既に切れている場合もすぐにSIGALRMが届くよう、0にはしない
+            signal.setitimer(signal.ITIMER_REAL, max(outer_delay - (monotonic() - start), 1e-6))
+
+
+class _Call:
+    """ 別スレッドで実行している関数呼び出し
+    """
+
+    def __init__(self, function, limit, args, kwargs, bind_deadline=True):
+
+        self.limit = remaining(limit)
+        self.__outcome = {}
+        self.__thread = None
+        if self.limit <= 0:
+            return
+
+        if bind_deadline:
+            # 呼び出し元の期限と制限時間の短い方を、実行する関数の期限とする
+            with deadline(self.limit):
+                ctx = copy_context()
+        else:
+            ctx = copy_context()
+
+        def target():
+            try:
+                self.__outcome["value"] = ctx.run(function, *args, **kwargs)
+            except BaseException as e:
+                self.__outcome["error"] = e
+
+        self.__thread = threading.Thread(target=target, daemon=True)
+        self.__thread.start()
+
+    def wait(self, timeout=None):
+        """ 関数の終了を待つ
+
+        Returns:
+            bool: 関数が終了していればTrue
+        """
+
+        if self.__thread == None:
+            return False
+        self.__thread.join(timeout)
+        return not self.__thread.is_alive()
+
+    def result(self):
 
-def on_timeout(limit, handler, hint=None):
+        if "error" in self.__outcome:
+            raise self.__outcome["error"]
+        return self.__outcome["value"]
+
+
+# isolate=Trueで修飾した関数、子プロセスには関数そのものではなく名前を渡す
+_isolated = {}
+_generation = 0  # _isolatedに関数を追加するたびに増やし、それより前に起動した子プロセスは使わない
+_idle_workers = []
+_workers_lock = threading.Lock()
+
+
+def _register(function):
+
+    global _generation
+    name = "{}.{}".format(function.__module__, function.__qualname__)
+    with _workers_lock:
+        _isolated[name] = function
+        _generation += 1
+    return name
+
+
+def _serve(conn):
+    """ 子プロセスで、受け取った名前の関数を実行して結果を返す
+    """
+
+    while True:
+        try:
+            name, args, kwargs = conn.recv()
+        except EOFError:
+            return
+        try:
+            # 親プロセスのスレッドで設定した期限を引き継がないよう、空のコンテキストで実行する
+            outcome = ("value", Context().run(_isolated[name], *args, **kwargs))
+        except Exception as e:
+            outcome = ("error", e)
+        try:
+            conn.send(outcome)
+        except Exception as e:  # 返り値や例外をpickleできない場合
+            conn.send(("error", RuntimeError("{}: {!r}".format(name, e))))
+
+
+class _Worker:
+    """ _isolatedの関数を実行する子プロセス
+
+    forkで起動するため、子プロセスは起動した時点の_isolatedを持つ
+    """
+
+    def __init__(self):
+
+        ctx = multiprocessing.get_context(GC.TIMEOUT_START_METHOD)
+        self.generation = _generation
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(target=_serve, args=(child,), daemon=True)
+        self.process.start()
+        child.close()
+
+    def submit(self, name, args, kwargs):
+
+        self.conn.send((name, args, kwargs))
+
+    def wait(self, timeout=None):
+        """ 結果が返るまで待つ
+
+        Returns:
+            bool: 結果が返っていればTrue
+        """
+
+        return self.conn.poll(timeout)
+
+    def result(self):
+        """ 返された結果を("value", 返り値)か("error", 例外)の形式で返す
+        """
+
+        return self.conn.recv()
+
+    def kill(self):
+
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+def _checkout():
+
+    with _workers_lock:
+        while _idle_workers:
+            worker = _idle_workers.pop()
+            if worker.generation == _generation and worker.process.is_alive():
+                return worker
+            worker.kill()
+    return _Worker()
+
+
+def _checkin(worker):
+
+    with _workers_lock:
+        if len(_idle_workers) < GC.TIMEOUT_IDLE_WORKERS:
+            _idle_workers.append(worker)
+            return
+    worker.kill()
+
+
+def _call_in_process(name, limit, args, kwargs, expire):
+    """ 子プロセスでnameの関数を実行し、limit秒を過ぎたらexpireを呼び出す
+
+    expireが例外を送出した場合は子プロセスを終了し、送出しなかった場合は結果を待つ
+    """
+
+    worker = _checkout()
+    try:
+        worker.submit(name, args, kwargs)
+        if not worker.wait(limit):
+            expire()
+            worker.wait()
+        kind, value = worker.result()
+    except BaseException:
+        worker.kill()
+        raise
+    _checkin(worker)
+    if kind == "error":
+        raise value
+    return value
+
+
+def timeout(limit, timeout_exception=TimeoutError, in_thread=True):
+    """ 指定した実行時間に終了しなかった場合、timeout_exceptionを送出するデコレータ
+
+    timeout_decorator.timeoutと異なり、メインスレッド以外でも使用できる
+    @timeout(limit=0.5)
+    def short_time_function():
+
+    in_thread=Falseの場合、メインスレッド以外では別スレッドを作らずに期限を設定して実行する
+    (期限をremainingで参照して打ち切る関数に用いる、期限を過ぎても関数が返らなければ例外は送出されない)
+    """
+
+    def __decorator(function):
+        def __wrapper(*args, **kwargs):
+            left = remaining(limit)
+            message = "{} is not finished in {} seconds.".format(function.__name__, left)
+            if left <= 0:
+                raise timeout_exception(message)
+
+            if _use_alarm():
+                def expire():
+                    raise timeout_exception(message)
+                with deadline(left):
+                    return _call_with_alarm(function, left, args, kwargs, expire)
+
+            if not in_thread:
+                with deadline(left):
+                    return function(*args, **kwargs)
+
+            call = _Call(function, limit, args, kwargs)
+            if not call.wait(call.limit):
+                raise timeout_exception(message)
+            return call.result()
+        return wraps(function)(__wrapper)
+    return __decorator
+
+
+def on_timeout(limit, handler, hint=None, isolate=False):
     '''
     指定した実行時間に終了しなかった場合、handlerをhint/limitを引数にして呼び出します
+    handlerが例外を送出しなかった場合は、関数の終了を待ってその返り値を返します
     @on_timeout(limit=3600, handler=notify_func, hint=u'calculation')
     def long_time_function():
-    '''
 
-    def notify_handler(signum, frame):
-        handler("WARNING: {} is not finished in {} seconds.".format(hint, limit))
+    isolate=Trueの場合、メインスレッド以外では関数を子プロセスで実行し、handlerが例外を送出したら子プロセスを終了します
+    (正規表現の探索のように、スレッドでは中断できない処理に用いる、引数と返り値はpickleできる必要があります)
+    '''
 
     def __decorator(function):
+        name = _register(function) if isolate else None
+
         def __wrapper(*args, **kwargs):
-            import signal
-            signal.signal(signal.SIGALRM, notify_handler)
-            signal.alarm(limit)
-            result = function(*args, **kwargs)
-            signal.alarm(0)
-            return result
+            message = "WARNING: {} is not finished in {} seconds.".format(hint, limit)
+            left = remaining(limit)
+            if left <= 0:
+                return handler(message)  # 期限切れで関数を実行できなかった場合
+
+            if _use_alarm():
+                return _call_with_alarm(function, left, args, kwargs, lambda: handler(message))
+
+            if isolate and GC.TIMEOUT_START_METHOD in multiprocessing.get_all_start_methods():
+                return _call_in_process(name, left, args, kwargs, lambda: handler(message))
+
+            call = _Call(function, limit, args, kwargs, bind_deadline=False)
+            if not call.wait(call.limit):
+                value = handler(message)
+                if not call.wait():
+                    return value
+            return call.result()
         return wraps(function)(__wrapper)
-    return __decorator 
+    return __decorator
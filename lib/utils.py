@@ -1,31 +1,41 @@
 # coding=utf-8
 
 from time import sleep
+from collections import deque
+from hashlib import blake2b
 import numpy.random as random 
 from urllib.parse import urlparse 
 from retrying import retry
-import requests
-import cchardet
 from selenium.webdriver.support import expected_conditions as ec
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.common.by import By
-from selenium import webdriver
 from selenium.common.exceptions import TimeoutException
-import timeout_decorator
 
 import crawler.lib.const as GC
+from crawler.lib.driver_pool import get_driver_pool
+from crawler.lib.http_pool import get_session_pool
+import crawler.lib.charset as charset
+from crawler.lib.metrics import METRICS
+from crawler.lib.page_navigator import original_url
+from crawler.lib.timeout import timeout, remaining
+import crawler.lib.static_first as static_first_mode
 import internet_archives.lib.const as C
 import internet_archives.lib.custom_conditions as cec
 
 class Queue:
-    
-    def __init__(self, queue=None, max_size=5):
+    """ 上限のあるFIFOのキュー
 
-        if type(queue) is type([]):
-            self.queue = queue
-        elif queue is None:
-            self.queue = []
+    先頭の要素の取り出しをO(1)で行えるよう、dequeで保持する
+    永続化や重複の除去が必要な場合はfrontier.Frontierを使う
+
+    Attributes:
+        queue (deque): キューの要素
+        max_size (int): is_fullで満杯とみなす要素数
+    """
 
+    def __init__(self, queue=None, max_size=5):
+
+        self.queue = deque(queue or [])
         self.max_size = max_size
 
     def enqueue(self, e):
@@ -34,17 +44,13 @@ class Queue:
         return self.queue
 
     def dequeue(self):
-        
-        elem = self.queue[0]
-        del self.queue[0]
 
-        return elem
+        return self.queue.popleft()
 
     def is_full(self):
 
         return len(self.queue) >= self.max_size
 
-    
 
 def random_sleep(max_sleep_time):
     """ 1 - max_sleep_timeの間でランダムにsleepをはさむ関数
@@ -83,6 +89,21 @@ def normalize_url(url, source_url):
     return url  
 
 
+def fingerprint(url):
+    """ urlの64bitのハッシュ値を返す
+
+    大量のurlをメモリ上で管理する際に、文字列の代わりに用いる
+
+    Args:
+        url (str): url文字列
+
+    Returns:
+        int: blake2bによる64bitのハッシュ値
+    """
+
+    return int.from_bytes(blake2b(url.encode("utf-8"), digest_size=8).digest(), "big")
+
+
 def status_code2str(status_code):
 
     if status_code >= 500 and status_code <= 520:
@@ -97,95 +118,147 @@ def status_code2str(status_code):
         return GC.INFORMATIONAL 
 
 
-@timeout_decorator.timeout(GC.TIMEOUT, timeout_exception=TimeoutError)
-def get(url, logger, sleep_time, use_selenium=False, is_ia=False):
+@timeout(GC.TIMEOUT, in_thread=False)  # リクエストや描画は期限までしか待たないため、メインスレッド以外ではスレッドを作らない
+def get(url, logger, sleep_time, use_selenium=False, is_ia=False,
+        static_first=False, sufficient=static_first_mode.is_sufficient, scheduler=None, cache=None, page_cnt=1):
         """ urlにGETリクエストを送り、htmlを取得する
 
         Args:
             url (str): GETリクエストを送るurl
             logger (logger): loggerインスタンス
             use_selenium (bool): seleniumを使用するか否か
+            is_ia (bool): Internet Archiveのページか否か
+            static_first (bool): requestsで取得したhtmlがsufficientを満たす場合はseleniumを使用しない
+            sufficient (function): (html, is_ia, page_cnt)を受け取り、seleniumでの描画が不要な場合にTrueを返す関数
+            scheduler (HostScheduler): 指定した場合、リクエストの前にホストごとの間隔を待ち、random_sleepは行わない
+            cache (ResponseCache): 指定した場合、保存したレスポンス・描画したhtmlを再利用し、取得したものを保存する
+            page_cnt (int): 記事のページ番号、static-firstモードでsufficientに渡す
 
         Returns:
             Responce: HttpResponce　取得できなければNone
         """
 
+        def pause():
+            if scheduler == None and not from_cache:
+                random_sleep(sleep_time)
+
         @retry(
                 stop_max_attempt_number=GC.STOP_MAX_ATTEMPT_NUMBER,
                 stop_max_delay=GC.STOP_MAX_DELAY,
-                wait_fixed=GC.WAIT_FIXED
+                wait_fixed=GC.WAIT_FIXED,
+                retry_on_exception=lambda e: not isinstance(e, TimeoutError)  # 期限切れはやり直さない
         )
-        def __get(url):
-            return requests.get(url, headers=GC.HEADERS, timeout=GC.TIMEOUT)
-
-        try:
-            res = __get(url)
-        except Exception as e:
-            logger.error("requests exception {}".format(e))
-            raise TimeoutError
+        def __get(url, headers=None):
+            if scheduler != None:
+                scheduler.acquire(url)
+            # 期限を過ぎている場合、timeout=0ではrequestsがValueErrorを送出するため、リクエストを送らずに打ち切る
+            limit = remaining(GC.TIMEOUT)
+            if limit <= 0:
+                raise TimeoutError("deadline exceeded before requesting {}".format(url))
+            return get_session_pool().get(
+                    url,
+                    headers=dict(GC.HEADERS, **(headers or {})),
+                    timeout=limit
+            )
 
-        encoding = cchardet.detect(res.content)['encoding'].lower() 
-        res.encoding = encoding
+        domain = urlparse(original_url(url)).netloc  # Internet Archive上のurlはキャッシュ元のドメインで集計する
+        from_cache = False  # ネットワークを使わずにキャッシュから返す場合はsleepしない
+        entry = cache.lookup(url) if cache != None else None
+        if entry != None and entry.fresh(cache.ttl):
+            from_cache = True
+            if use_selenium and entry.rendered != None:  # 取得も描画も行わない
+                cache.hit(url, entry, rendered=True)
+                return entry.rendered, entry.rendered_status
+            cache.hit(url, entry)
+            res = entry.response()
+        else:
+            try:
+                with METRICS.timer("http_fetch_seconds"):
+                    res = __get(url, entry.validators() if entry != None else None)
+            except Exception as e:
+                logger.error("requests exception {}".format(e))
+                METRICS.inc("http_errors_total", domain=domain)
+                raise TimeoutError
+            if entry != None and res.status_code == 304:
+                if use_selenium and entry.rendered != None:
+                    cache.hit(url, entry, revalidated=True, rendered=True)
+                    pause()
+                    return entry.rendered, entry.rendered_status
+                cache.hit(url, entry, revalidated=True)
+                res = entry.response()
+            elif cache != None and status_code2str(res.status_code) != GC.SERVER_ERROR:
+                cache.store(url, res)
+
+        with METRICS.timer("charset_seconds"):
+            res.encoding = charset.detect(res.content, res.headers.get("Content-Type"), url)
         status_str = status_code2str(res.status_code)
+        METRICS.inc("http_responses_total", status=res.status_code, domain=domain)
         if status_str in [GC.SERVER_ERROR, GC.CLIENT_ERROR, GC.REDIRECTION]:  # ニュースサイト等のリダイレクトはたいていトップページへ飛ばされるだけ 
             logger.warning(
                     "{}: status_code {} on {}".format(status_str, res.status_code, url)
             ) 
-            random_sleep(sleep_time)
+            pause()
             return None, res.status_code
         elif status_str in [GC.INFORMATIONAL]:
             logger.info(
                     "{}: status_code {} on {}".format(status_str, res.status_code, url)
             )
         
+        if use_selenium and static_first:
+            html = res.text  # 判定で走査した結果を呼び出し側で再利用できるよう、同じstrを返す
+            if sufficient(html, is_ia, page_cnt):
+                static_first_mode.RENDER_STATS.record(url, avoided=True)
+                pause()
+                # seleniumで描画した場合と同様に、リダイレクトされたものはSELENIUM_REDIRECTとする
+                # (キャッシュから復元したレスポンスはhistoryを持たないため、保存したurlと比べる)
+                redirected = bool(res.history) if res.request != None else res.url != url
+                if redirected:
+                    logger.warning("requests redirect on {} but html has saved on db.".format(url))
+                return html, GC.SELENIUM_REDIRECT if redirected else res.status_code
+            static_first_mode.RENDER_STATS.record(url, avoided=False)
+
         if use_selenium:
-            dcap = {
-                    "phantomjs.page.settings.userAgent": GC.HEADERS,
-                    "marionette": True
-            }
-            args = [
-                    "--ignore-ssl-errors=true",
-                    "--ssl-protocol=any",
-                    "--disk-cache=false",
-                    "--load-images=false",
-                    "--output-encoding=utf-8",
-                    "--script-encoding={}".format(encoding)
-            ]
+            from_cache = False
+            pool = get_driver_pool()
             try:
-                driver = webdriver.PhantomJS(desired_capabilities=dcap, service_args=args)
-                # GET
-                driver.set_page_load_timeout(GC.TIMEOUT)
-                driver_wait = WebDriverWait(driver, GC.TIMEOUT)
-                driver.get(url)
-                if is_ia:
-                    driver_wait.until(
-                            cec.visibility_of_multiple_element_located(
-                                    (By.CSS_SELECTOR, C.TARGET_ERROR_CSS_SELECTOR),
-                                    (By.CSS_SELECTOR, C.TARGET_LINK_CSS_SELECTOR)
-                            )
-                    )
-                else:
-                    driver_wait.until(ec.presence_of_all_elements_located)
-                html = driver.page_source
+                if scheduler != None:
+                    scheduler.acquire(url)
+                # 呼び出し元がタイムアウトした後もWebDriverを待ち続けないよう、期限までしか待たない
+                with METRICS.timer("render_seconds"), pool.driver(remaining()) as driver:
+                    # GET
+                    driver_wait = WebDriverWait(driver, remaining(GC.TIMEOUT))
+                    driver.get(url)
+                    if is_ia:
+                        driver_wait.until(
+                                cec.visibility_of_multiple_element_located(
+                                        (By.CSS_SELECTOR, C.TARGET_ERROR_CSS_SELECTOR),
+                                        (By.CSS_SELECTOR, C.TARGET_LINK_CSS_SELECTOR)
+                                )
+                        )
+                    else:
+                        driver_wait.until(ec.presence_of_all_elements_located)
+                    html = driver.page_source
+                    current_url = driver.current_url
             except TimeoutException:
                 logger.error("selenium TimeoutException on {}".format(url))
-                random_sleep(sleep_time)
+                METRICS.inc("render_errors_total", domain=domain)
+                pause()
                 raise TimeoutError
             except Exception as e:
                 logger.error("selenium {} on {}".format(e, url))
+                METRICS.inc("render_errors_total", domain=domain)
                 raise TimeoutError
 
-            random_sleep(sleep_time)
+            pause()
             
-            if driver.current_url != url:
+            status_code = GC.SELENIUM_REDIRECT if current_url != url else res.status_code
+            if cache != None:
+                cache.store_rendered(url, html, status_code)
+            if current_url != url:
                 logger.warning(
                         "selenium redirect on {} but html has saved on db.".format(url)
                 )
-                driver.close()
-                return html, GC.SELENIUM_REDIRECT
-            else:
-                driver.close()
-                return html, res.status_code
+            return html, status_code
         else:
-            random_sleep(sleep_time)
+            pause()
             return res.text, res.status_code
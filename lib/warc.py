@@ -0,0 +1,545 @@
+# coding=utf-8
+
+"""
+スクレイピングした記事をWARC形式(1レコードごとにgzip圧縮)で読み書きする機能を提供するモジュール
+
+1ページにつき以下の3つのレコードを書き込む
+    request: ページへのGETリクエスト
+    response: ステータスコードとhtml(utf-8)からなるHTTPレスポンス
+    metadata: ScrapedArticleDataの残りの情報(記事のurl、タイトル、ページ番号、日付)
+
+保存した記事のurlは、再開時にWARCファイルを展開せずに済むよう索引ファイル(GC.WARC_INDEX_NAME)にも追記する
+"""
+
+import atexit
+import gzip
+import http.client
+import os
+import threading
+import uuid
+from collections import namedtuple
+from datetime import datetime, timezone
+from glob import glob
+from time import monotonic
+from urllib.parse import urlsplit
+
+import crawler.lib.const as GC
+from crawler.lib.container import ScrapedArticleData
+
+WARC_VERSION = "WARC/1.1"
+CRLF = b"\r\n"
+
+# WARCの1レコード、headersはヘッダ名 -> 値のdict、contentはレコードのブロック(bytes)
+WarcRecord = namedtuple("WarcRecord", ("headers", "content"))
+
+
+def record_id():
+
+    return "<urn:uuid:{}>".format(uuid.uuid4())
+
+
+def warc_date():
+
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def encode_fields(fields):
+    """ dictをapplication/warc-fields形式のbytesにする
+    """
+
+    lines = []
+    for key, value in fields.items():
+        value = "" if value == None else str(value)
+        lines.append("{}: {}".format(key, value.replace("\r", " ").replace("\n", " ")))
+    return ("\r\n".join(lines) + "\r\n").encode("utf-8")
+
+
+def decode_fields(block):
+    """ application/warc-fields形式のbytesをdictにする
+    """
+
+    fields = {}
+    for line in block.decode("utf-8").split("\r\n"):
+        if ": " in line:
+            key, value = line.split(": ", 1)
+            fields[key] = value
+    return fields
+
+
+def encode_record(warc_type, headers, block):
+    """ WARCの1レコードをgzip圧縮したbytesにする
+
+    Args:
+        warc_type (str): WARC-Type
+        headers (dict): WARC-Type、WARC-Date、Content-Length以外のヘッダ
+        block (bytes): レコードのブロック
+
+    Returns:
+        bytes: 1つのgzipメンバーとしたレコード
+    """
+
+    lines = [WARC_VERSION, "WARC-Type: {}".format(warc_type)]
+    if "WARC-Date" not in headers:
+        lines.append("WARC-Date: {}".format(warc_date()))
+    lines += ["{}: {}".format(key, value) for key, value in headers.items()]
+    lines.append("Content-Length: {}".format(len(block)))
+    head = ("\r\n".join(lines) + "\r\n\r\n").encode("utf-8")
+    return gzip.compress(head + block + CRLF + CRLF, compresslevel=GC.WARC_GZIP_LEVEL)
+
+
+class WarcWriter:
+    """ WARCファイルにレコードを追記し、max_sizeを超えたら次のファイルに切り替えるクラス
+
+    書き込み中のファイルは末尾に.openを付け、閉じた時点で.warc.gzに名前を変える
+
+    Attributes:
+        directory (str): WARCファイルを置くディレクトリ
+        prefix (str): ファイル名の接頭辞
+        max_size (int): 1ファイルの最大サイズ(bytes)、1記事分のレコードは同じファイルに書く
+        path (str): 書き込み中のファイルのパス(閉じた後の名前)
+    """
+
+    def __init__(self, directory, prefix=GC.WARC_PREFIX, max_size=GC.WARC_MAX_SIZE):
+
+        self.directory = directory
+        self.prefix = prefix
+        self.max_size = max_size
+        self.path = None
+        self.__f = None
+        self.__serial = 0
+        os.makedirs(directory, exist_ok=True)
+        self.__recover()
+
+    def __recover(self):
+        """ 前回の実行で閉じられなかったファイルを書き込み完了の名前にする
+
+        最後のレコードが途中で切れている場合は、iter_recordsがそのレコードの手前で読み込みを終える
+        """
+
+        for path in glob(os.path.join(self.directory, "*.warc.gz.open")):
+            os.replace(path, path[:-len(".open")])
+
+    def __open(self):
+
+        self.__serial += 1
+        name = "{}-{}-{:05d}.warc.gz".format(
+                self.prefix, datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S"), self.__serial
+        )
+        self.path = os.path.join(self.directory, name)
+        self.__f = open(self.path + ".open", "wb")
+        self.__f.write(encode_record(
+                "warcinfo",
+                {
+                    "WARC-Record-ID": record_id(),
+                    "WARC-Filename": name,
+                    "Content-Type": "application/warc-fields"
+                },
+                encode_fields({"software": "crawler_utils", "format": "WARC File Format 1.1"})
+        ))
+
+    def write(self, records, roll=True):
+        """ レコードを書き込む
+
+        Args:
+            records (list): (warc_type, headers, block)のリスト、同じファイルに続けて書き込む
+            roll (bool): Falseの場合はmax_sizeを超えても次のファイルに切り替えない
+        """
+
+        if self.__f == None:
+            self.__open()
+        for warc_type, headers, block in records:
+            self.__f.write(encode_record(warc_type, headers, block))
+        if roll:
+            self.roll()
+
+    def roll(self):
+        """ 書き込み中のファイルがmax_sizeを超えていれば閉じる
+        """
+
+        if self.__f != None and self.__f.tell() >= self.max_size:
+            self.close()
+
+    def mark(self):
+        """ 書き込み中のファイルの現在の位置を返す、truncateでこの位置まで書き込みを取り消せる
+        """
+
+        if self.__f == None:
+            self.__open()
+        return self.__f.tell()
+
+    def truncate(self, position):
+        """ markで得た位置より後に書き込んだレコードを取り消す(その間にファイルを切り替えていないこと)
+        """
+
+        self.__f.seek(position)
+        self.__f.truncate()
+
+    def flush(self):
+        """ 書き込んだレコードをディスクに書き出す
+        """
+
+        if self.__f != None:
+            self.__f.flush()
+            os.fsync(self.__f.fileno())
+
+    def close(self):
+        """ 書き込み中のファイルを閉じる、次のwriteで新しいファイルを開く
+        """
+
+        if self.__f != None:
+            self.flush()
+            self.__f.close()
+            os.replace(self.path + ".open", self.path)
+            self.__f = None
+
+
+def article_records(target_url, atcl):
+    """ ScrapedArticleDataをrequest/response/metadataのレコードにする
+
+    Args:
+        target_url (str): crawling_targetに記載された記事のurl
+        atcl (ScrapedArticleData): 記事の1ページ
+
+    Returns:
+        list: WarcWriter.writeに渡す(warc_type, headers, block)のリスト
+    """
+
+    date = warc_date()
+    response_id, request_id = record_id(), record_id()
+    parts = urlsplit(atcl.page_url)
+    path = parts.path or "/"
+    if parts.query:
+        path = "{}?{}".format(path, parts.query)
+
+    html = atcl.encoded("utf-8")
+    response = "HTTP/1.1 {} {}\r\nContent-Type: text/html; charset=utf-8\r\nContent-Length: {}\r\n\r\n".format(
+            atcl.status_code, http.client.responses.get(atcl.status_code, "Unknown"), len(html)
+    ).encode("ascii") + html
+    request = "GET {} HTTP/1.1\r\nHost: {}\r\n\r\n".format(path, parts.netloc).encode("utf-8")
+    metadata = encode_fields({
+            "target-url": target_url,
+            "origin-url": atcl.origin_url,
+            "title": atcl.title,
+            "page": atcl.page,
+            "published-at": atcl.published_at,
+            "status-code": atcl.status_code
+    })
+
+    common = {"WARC-Target-URI": atcl.page_url, "WARC-Date": date}
+    return [
+            ("response", dict(common, **{
+                "WARC-Record-ID": response_id,
+                "Content-Type": "application/http; msgtype=response"
+            }), response),
+            ("request", dict(common, **{
+                "WARC-Record-ID": request_id,
+                "WARC-Concurrent-To": response_id,
+                "Content-Type": "application/http; msgtype=request"
+            }), request),
+            ("metadata", dict(common, **{
+                "WARC-Record-ID": record_id(),
+                "WARC-Refers-To": response_id,
+                "Content-Type": "application/warc-fields"
+            }), metadata),
+    ]
+
+
+def warc_files(directory):
+    """ ディレクトリ内の書き込みが完了したWARCファイルを名前の順に返す
+    """
+
+    return sorted(glob(os.path.join(directory, "*.warc.gz")))
+
+
+def iter_records(path):
+    """ WARCファイルのレコードを先頭から順に返すジェネレータ
+
+    Args:
+        path (str): WARCファイル(.warc.gz)のパス
+
+    Yields:
+        WarcRecord: レコード
+    """
+
+    with gzip.open(path, "rb") as f:
+        try:
+            yield from _read_records(f, path)
+        except EOFError:
+            pass  # 書き込み中に終了したファイルの末尾
+
+
+def _read_records(f, path):
+
+    while True:
+        line = f.readline()
+        if not line:
+            break
+        if not line.strip():
+            continue
+        if not line.startswith(b"WARC/"):
+            raise ValueError("invalid WARC record in {}: {!r}".format(path, line[:40]))
+        headers = {}
+        for line in iter(f.readline, CRLF):
+            if not line:
+                raise EOFError
+            key, value = line.decode("utf-8").rstrip("\r\n").split(":", 1)
+            headers[key] = value.strip()
+        content = f.read(int(headers["Content-Length"]))
+        if len(content) < int(headers["Content-Length"]):
+            raise EOFError
+        f.read(len(CRLF + CRLF))
+        yield WarcRecord(headers, content)
+
+
+def iter_articles(directory):
+    """ WARCファイルに保存した記事を先頭から順に返すジェネレータ
+
+    Args:
+        directory (str): WARCファイルを置いたディレクトリ
+
+    Yields:
+        tuple: (crawling_targetに記載された記事のurl, ScrapedArticleData)
+    """
+
+    for path in warc_files(directory):
+        responses = {}
+        for record in iter_records(path):
+            warc_type = record.headers.get("WARC-Type")
+            if warc_type == "response":
+                responses[record.headers["WARC-Record-ID"]] = record.content
+            elif warc_type == "metadata" and record.headers.get("WARC-Refers-To") in responses:
+                response = responses.pop(record.headers["WARC-Refers-To"])
+                meta = decode_fields(record.content)
+                html = response.split(CRLF + CRLF, 1)[1]  # utf-8のまま渡し、参照した時点でデコードする
+                yield meta["target-url"], ScrapedArticleData(
+                        meta["origin-url"],
+                        record.headers["WARC-Target-URI"],
+                        meta["title"],
+                        html,
+                        int(meta["page"]),
+                        meta["published-at"],
+                        int(meta["status-code"])
+                )
+
+
+def index_path(directory):
+    """ WARCファイルに保存した記事のurlの索引ファイルのパスを返す
+    """
+
+    return os.path.join(directory, GC.WARC_INDEX_NAME)
+
+
+def scan_crawled_urls(directory):
+    """ WARCファイルを読み、保存した記事のurl(crawling_targetに記載されたもの)をページごとに返すジェネレータ
+
+    htmlを含むresponseレコードは読み飛ばし、metadataレコードのみを読む
+    """
+
+    for path in warc_files(directory):
+        for record in iter_records(path):
+            if record.headers.get("WARC-Type") == "metadata":
+                url = decode_fields(record.content).get("target-url")
+                if url:
+                    yield url
+
+
+def rebuild_index(directory):
+    """ WARCファイルを読んで索引ファイルを作り直す
+
+    索引ファイルが無いディレクトリ(索引を書くようになる前に書き込んだもの)で一度だけ行う
+    """
+
+    path = index_path(directory)
+    seen = set()  # metadataレコードはページごとにあるため、記事ごとに1行にする
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        for url in scan_crawled_urls(directory):
+            if url not in seen:
+                seen.add(url)
+                f.write(url + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def crawled_urls(directory):
+    """ WARCファイルに保存した記事のurl(crawling_targetに記載されたもの)を返すジェネレータ
+
+    WARCファイルを展開せずに済むよう、索引ファイルから読む(索引ファイルが無い場合は作る)
+    """
+
+    path = index_path(directory)
+    if not os.path.exists(path):
+        if not os.path.isdir(directory):
+            return
+        rebuild_index(directory)
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            url = line.rstrip("\n")
+            if url:
+                yield url
+
+
+class WarcArticleSink:
+    """ BufferedArticleWriterの代わりに、記事をWARCファイルに書き込むクラス
+
+    記事はaddした時点でファイルに書き込み、batch_size件ごとかflush_interval秒ごとにディスクに書き出して
+    flush_callbackを呼び出す
+
+    Attributes:
+        writer (WarcWriter): WARCファイルへの書き込みを行うインスタンス
+        batch_size (int): ディスクに書き出す間隔(url数)
+        flush_interval (float): ディスクに書き出す間隔の最大秒数
+        stats (dict): 書き込んだurl数、ページ数、bytes数(圧縮前のhtml)
+    """
+
+    def __init__(
+            self,
+            directory,
+            prefix=GC.WARC_PREFIX,
+            max_size=GC.WARC_MAX_SIZE,
+            batch_size=GC.WARC_FLUSH_BATCH_SIZE,
+            flush_interval=GC.WARC_FLUSH_INTERVAL
+    ):
+
+        self.writer = WarcWriter(directory, prefix, max_size)
+        if not os.path.exists(index_path(directory)):
+            rebuild_index(directory)
+        # 記事のurlは、WARCファイルをディスクに書き出した後に索引ファイルに追記する
+        self.__index = open(index_path(directory), "a", encoding="utf-8")
+        self.__indexed = []  # ディスクに書き出していない記事のurl
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.stats = {"urls": 0, "pages": 0, "bytes": 0}
+        self.__unflushed = 0
+        self.__last_flush = monotonic()
+        self.__callbacks = []
+        self.__mark = None  # add_pageで書き込み中の記事の最初のページを書き込む前の位置
+        self.__metadata = []  # add_pageで書き込み中の記事のmetadataレコード
+        self.__lock = threading.Lock()
+        atexit.register(self.close)
+
+    def __contains__(self, url):
+
+        return False  # addした時点で書き込むため、バッファに残っているurlは無い
+
+    def __len__(self):
+
+        return 0
+
+    def add_flush_callback(self, callback):
+        """ ディスクへの書き出しが完了するたびに呼び出す関数を登録する
+
+        Args:
+            callback (function): 引数なしで呼び出される関数
+        """
+
+        self.__callbacks.append(callback)
+
+    def add(self, url, atcl_list):
+        """ 1つの記事のScrapedArticleDataのリストを書き込む
+
+        Args:
+            url (str): crawling_targetに記載された記事のurl
+            atcl_list (list): ScrapedArticleDataのリスト
+        """
+
+        with self.__lock:
+            # 全ページのレコードを同時に保持しないよう1ページずつ書き込み、記事の最後でファイルを切り替える
+            for atcl in atcl_list:
+                self.writer.write(article_records(url, atcl), roll=False)
+                self.stats["bytes"] += len(atcl.encoded("utf-8"))
+            self.writer.roll()
+            self.__indexed.append(url)
+            self.stats["urls"] += 1
+            self.stats["pages"] += len(atcl_list)
+            self.__unflushed += 1
+            full = self.__unflushed >= self.batch_size
+            expired = monotonic() - self.__last_flush >= self.flush_interval
+        if full or expired:
+            self.flush()
+
+    def add_page(self, url, atcl):
+        """ 記事の1ページのhtmlをすぐに書き込む
+
+        metadataレコードはend_targetまで書き込まないため、途中で終了した記事はcrawled_urls、iter_articlesに含まれない
+        add_pageは1つの記事ずつ、end_targetかdiscardを呼んでから次の記事に移ること
+
+        Args:
+            url (str): crawling_targetに記載された記事のurl
+            atcl (ScrapedArticleData): 記事の1ページ
+        """
+
+        response, request, metadata = article_records(url, atcl)
+        with self.__lock:
+            if self.__mark == None:
+                self.__mark = self.writer.mark()
+            # 1記事分のレコードは同じファイルに書くため、end_targetまでファイルを切り替えない
+            self.writer.write([response, request], roll=False)
+            self.__metadata.append(metadata)
+            self.stats["bytes"] += len(atcl.encoded("utf-8"))
+
+    def end_target(self, url):
+        """ add_pageで書き込んだ記事のmetadataレコードを書き込み、記事を確定する
+        """
+
+        with self.__lock:
+            self.writer.write(self.__metadata)
+            self.__indexed.append(url)
+            self.stats["urls"] += 1
+            self.stats["pages"] += len(self.__metadata)
+            self.__metadata, self.__mark = [], None
+            self.__unflushed += 1
+            full = self.__unflushed >= self.batch_size
+            expired = monotonic() - self.__last_flush >= self.flush_interval
+        if full or expired:
+            self.flush()
+
+    def discard(self, url):
+        """ add_pageで書き込んだ記事のページを取り消す
+        """
+
+        with self.__lock:
+            if self.__mark != None:
+                self.writer.truncate(self.__mark)
+            self.__metadata, self.__mark = [], None
+
+    def flush(self):
+        """ 書き込んだ記事をディスクに書き出す
+        """
+
+        with self.__lock:
+            self.writer.flush()
+            if self.__indexed and not self.__index.closed:
+                self.__index.write("".join(url + "\n" for url in self.__indexed))
+                self.__index.flush()
+                os.fsync(self.__index.fileno())
+                self.__indexed = []
+            self.__unflushed = 0
+            self.__last_flush = monotonic()
+        for callback in self.__callbacks:
+            callback()
+
+    def crawled_urls(self):
+        """ 既に書き込んだ記事のurlを返すジェネレータ
+        """
+
+        return crawled_urls(self.writer.directory)
+
+    def report(self, logger):
+        """ これまでの書き込みの統計をloggerに出力する
+        """
+
+        logger.info(
+                "warc: {} urls, {} pages, {:.1f} MB of html written to {}".format(
+                    self.stats["urls"], self.stats["pages"],
+                    self.stats["bytes"] / float(1 << 20), self.writer.directory)
+        )
+
+    def close(self):
+        """ ディスクに書き出し、書き込み中のファイルを閉じる
+        """
+
+        self.flush()
+        with self.__lock:
+            self.writer.close()
+            self.__index.close()
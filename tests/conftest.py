@@ -0,0 +1,73 @@
+# coding=utf-8
+
+"""
+リポジトリをcrawlerパッケージとして読み込めない場合(cloneしたディレクトリで実行する場合)に、crawlerとして登録する
+internet_archive_crawlerも同様に、Djangoのアプリのinternet_archivesとして登録する
+(models.pyはinternet_archives.models、その他のモジュールはinternet_archives.lib.Xとして読み込む)
+
+Djangoの設定が無い場合はメモリ上のSQLiteで設定し、テーブルを作る
+"""
+
+import importlib.util
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_DIR = os.path.join(ROOT, "internet_archive_crawler")
+
+
+def register(name, path):
+    """ pathのディレクトリをnameのパッケージとして登録する
+    """
+
+    spec = importlib.util.spec_from_file_location(
+            name, os.path.join(path, "__init__.py"), submodule_search_locations=[path])
+    module = importlib.util.module_from_spec(spec)
+    module.__path__ = [path]
+    sys.modules[name] = module
+    return module
+
+
+try:
+    import crawler.lib  # noqa: F401
+except ImportError:
+    register("crawler", ROOT)
+
+try:
+    import internet_archives.lib  # noqa: F401
+except ImportError:
+    register("internet_archives", APP_DIR).lib = register("internet_archives.lib", APP_DIR)
+
+try:
+    import django
+    from django.conf import settings
+except ImportError:
+    django = None
+
+if django != None and not settings.configured:
+    settings.configure(
+            INSTALLED_APPS=["internet_archives"],
+            DATABASES={"default": {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"}},
+            USE_TZ=False
+    )
+    django.setup()
+    from django.apps import apps
+    from django.db import connection
+    with connection.schema_editor() as editor:
+        for model in apps.get_app_config("internet_archives").get_models():
+            editor.create_model(model)
+
+
+@pytest.fixture
+def db():
+    """ テストの後にinternet_archivesのテーブルを空にする
+    """
+
+    if django == None:
+        pytest.skip("django is not installed")
+    from django.apps import apps
+    yield
+    for model in apps.get_app_config("internet_archives").get_models():
+        model.objects.all().delete()
@@ -0,0 +1,58 @@
+# coding=utf-8
+
+"""
+lib/async_fetch.pyのテスト
+
+bench/server.pyのローカルサーバに対して、全体とホストごとの同時接続数の上限を確認する
+"""
+
+import asyncio
+import logging
+
+from crawler.bench.server import LocalServer
+from crawler.lib.async_fetch import AsyncFetcher, async_get, fetch_many
+
+LOGGER = logging.getLogger(__name__)
+LATENCY = 0.05
+HOSTS = ("127.0.0.1", "localhost")  # 同じサーバを、Hostヘッダが異なる2つのホストとして扱う
+
+
+def urls(base_url, n):
+
+    port = base_url.rsplit(":", 1)[1]
+    return ["http://{}:{}/article/{}".format(host, port, i) for i in range(n) for host in HOSTS]
+
+
+def test_global_and_per_host_caps():
+
+    server = LocalServer(latency=LATENCY)
+    with server as base_url:
+        results = fetch_many(urls(base_url, 12), LOGGER, 1, max_concurrency=3, max_per_host=2)
+
+    assert all(status == 200 for _, status in results)
+    assert server.httpd.requests == 24
+    assert server.httpd.peak == 3
+    port = base_url.rsplit(":", 1)[1]
+    assert {host: server.httpd.host_peaks["{}:{}".format(host, port)] for host in HOSTS} == {h: 2 for h in HOSTS}
+
+
+def test_fetcher_can_be_reused_across_event_loops():
+
+    server = LocalServer(latency=LATENCY)
+    fetcher = AsyncFetcher(LOGGER, 1, max_concurrency=2, max_per_host=2)
+    try:
+        with server as base_url:
+            for _ in range(2):
+                results = asyncio.run(fetcher.fetch_many(urls(base_url, 2)))
+                assert all(status == 200 for _, status in results)
+    finally:
+        fetcher.close()
+    assert server.httpd.peak <= 2
+
+
+def test_async_get_shares_executor():
+
+    with LocalServer() as base_url:
+        for _ in range(2):
+            html, status = asyncio.run(async_get(base_url + "/article/1", LOGGER, 1))
+            assert status == 200 and "/article/1" in html
@@ -0,0 +1,151 @@
+# coding=utf-8
+
+"""
+internet_archive_crawler/cdx.pyのテスト
+
+bench/ia_server.pyのローカルサーバをCDX APIとして用いる
+"""
+
+import pytest
+
+import internet_archives.lib.cdx as cdx
+import internet_archives.lib.const as C
+from crawler.bench.ia_server import Faults, ReplayServer, ReplaySite
+from internet_archives.lib.cdx import CdxResolver, nearest
+
+CAPTURES = ["20190101000000", "20190601120000", "20191231000000"]
+
+
+class MultiCaptureSite(ReplaySite):
+    """ 記事ごとに複数のスナップショットを返すReplaySite
+    """
+
+    def cdx(self, url):
+
+        rows = super().cdx(url)
+        if not rows:
+            return rows
+        return rows[:1] + [[timestamp, url] for timestamp in CAPTURES]
+
+
+@pytest.fixture
+def site():
+
+    return MultiCaptureSite(n_articles=20, missing_rate=0.3)
+
+
+@pytest.fixture
+def server(site):
+
+    faults = Faults()
+    server = ReplayServer(site, faults)
+    with server:
+        yield server
+
+
+def resolver(tmp_path, server):
+
+    return CdxResolver(
+            endpoint=server.base_url + "/cdx/search/cdx",
+            snapshot_prefix=server.base_url + "/web/",
+            cache_path=str(tmp_path / "cdx.sqlite3")
+    )
+
+
+def articles(site, archived):
+
+    return [a for a in site.articles.values() if a.archived == archived]
+
+
+def cdx_requests(server):
+
+    return sum(n for (kind, _), n in server.counts.items() if kind == "cdx")
+
+
+def test_nearest():
+
+    rows = [(timestamp, "u") for timestamp in CAPTURES]
+    assert nearest([], "20190101000000") == None
+    assert nearest(rows, "20190520000000")[0] == "20190601120000"
+    assert nearest(rows, "2019030100")[0] == "20190101000000"  # 14桁に満たないものは0で埋めて比べる
+    assert nearest(rows, "")[0] == "20191231000000"  # タイムスタンプが無ければ最新のもの
+    # 同じ距離であれば古い方
+    assert nearest([("20190102", "u"), ("20190104", "u")], "20190103")[0] == "20190102"
+
+
+@pytest.mark.parametrize("published_at, timestamp", [
+        ("2019-05-20 00:00:00", "20190601120000"),
+        ("2019-01-02 00:00:00", "20190101000000"),
+        ("2020-06-01 00:00:00", "20191231000000"),
+        ("不明", "20191231000000"),
+])
+def test_resolve_selects_nearest_snapshot(tmp_path, site, server, published_at, timestamp):
+
+    article = articles(site, True)[0]
+    snapshot_url = resolver(tmp_path, server).resolve(article.url, published_at)
+    assert snapshot_url == "{}/web/{}/{}".format(server.base_url, timestamp, article.url)
+
+
+def test_results_are_cached(tmp_path, site, server):
+
+    r = resolver(tmp_path, server)
+    article = articles(site, True)[0]
+    first = r.resolve(article.url, article.published_at)
+    assert r.resolve(" {} ".format(article.url), article.published_at) == first
+    assert cdx_requests(server) == 1
+    assert r.stats == {"hits": 1, "found": 1, "not_found": 0, "errors": 0}
+
+    # 同じファイルを使えば再実行時にも問い合わせない
+    r.close()
+    assert resolver(tmp_path, server).resolve(article.url, article.published_at) == first
+    assert cdx_requests(server) == 1
+
+
+def test_negative_results_expire(tmp_path, site, server, monkeypatch):
+
+    now = [1000.0]
+    monkeypatch.setattr(cdx, "time", lambda: now[0])
+    r = resolver(tmp_path, server)
+    missing, found = articles(site, False)[0], articles(site, True)[0]
+    assert r.resolve(missing.url, missing.published_at) == None
+    assert r.resolve(found.url, found.published_at) != None
+
+    now[0] += C.CDX_NEGATIVE_TTL - 1
+    assert r.resolve(missing.url, missing.published_at) == None
+    assert cdx_requests(server) == 2 and r.stats["hits"] == 1
+
+    # 期限を過ぎたらスナップショットが無かった結果のみ問い合わせ直す
+    now[0] += 2
+    assert r.resolve(missing.url, missing.published_at) == None
+    assert r.resolve(found.url, found.published_at) != None
+    assert cdx_requests(server) == 3
+    assert r.stats == {"hits": 2, "found": 1, "not_found": 2, "errors": 0}
+
+
+def test_errors_are_counted_and_not_cached(tmp_path, site, server):
+
+    r = resolver(tmp_path, server)
+    article = articles(site, True)[0]
+    server.httpd.faults.error_rate = 1.0
+    with pytest.raises(Exception, match="status_code 503"):
+        r.resolve(article.url, article.published_at)
+    results = r.resolve_many([(a.url, a.published_at) for a in articles(site, True)[:3]])
+    assert all(isinstance(result, Exception) for result in results)
+    assert r.stats["errors"] == 4
+
+    server.httpd.faults.error_rate = 0.0
+    assert r.resolve(article.url, article.published_at) != None
+    assert r.stats["errors"] == 4 and r.stats["found"] == 1
+
+
+def test_resolve_many_queries_only_uncached_targets(tmp_path, site, server):
+
+    r = resolver(tmp_path, server)
+    targets = [(a.url, a.published_at) for a in site.articles.values()]
+    r.resolve(*targets[0])
+    results = r.resolve_many(targets + targets[:5])
+
+    assert results == [r.resolve(*target) for target in targets + targets[:5]]
+    assert sum(result != None for result in results[:len(targets)]) == len(articles(site, True))
+    # 解決済みのものと重複したものは問い合わせない
+    assert cdx_requests(server) == len(targets)
@@ -0,0 +1,24 @@
+# coding=utf-8
+
+"""
+lib/charset.pyのテスト
+"""
+
+from crawler.lib.charset import CharsetDetector
+
+SJIS_PAGE = ("<html><body>" + "日本語の記事の本文です。" * 50 + "</body></html>").encode("shift_jis")
+
+
+def test_domain_memo_uses_original_host_for_internet_archive():
+
+    detector = CharsetDetector()
+    detector.detect(SJIS_PAGE, "text/html; charset=Shift_JIS", "https://web.archive.org/web/2019/http://a.jp/1")
+    detector.detect("<html>".encode("utf-8"), "text/html; charset=utf-8", "https://web.archive.org/web/2019/http://b.jp/1")
+
+    domains = detector.domains()
+    assert "web.archive.org" not in domains
+    assert domains["a.jp"] == "cp932"
+    assert domains["b.jp"] == "utf-8"
+    # 同じドメインの別のスナップショットは、ヘッダが無くても前回の判定結果を使う
+    assert detector.detect(SJIS_PAGE, None, "https://web.archive.org/web/2020/http://a.jp/2") == "cp932"
+    assert detector.stats["domain"] == 1
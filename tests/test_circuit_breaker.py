@@ -0,0 +1,83 @@
+# coding=utf-8
+
+"""
+lib/circuit_breaker.pyのテスト
+"""
+
+from time import sleep
+
+import pytest
+
+from crawler.lib.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+from crawler.lib.metrics import METRICS
+
+
+def fail():
+
+    raise ValueError("down")
+
+
+def interrupt():
+
+    raise KeyboardInterrupt
+
+
+def open_breaker():
+
+    breaker = CircuitBreaker(name="test", failure_threshold=1, base_delay=0.05, jitter=0)
+    with pytest.raises(ValueError):
+        breaker.call(fail)
+    assert breaker.state == OPEN
+    return breaker
+
+
+def test_open_and_recover():
+
+    breaker = open_breaker()
+    with pytest.raises(CircuitOpenError):
+        breaker.call(lambda: 1)
+    sleep(0.06)
+    assert breaker.state == HALF_OPEN
+    assert breaker.call(lambda: 1) == 1
+    assert breaker.state == CLOSED
+
+
+def test_half_open_allows_only_one_probe():
+
+    breaker = open_breaker()
+    sleep(0.06)
+    assert breaker.allow()
+    assert not breaker.allow()
+
+
+def test_probe_released_after_base_exception():
+
+    breaker = open_breaker()
+    sleep(0.06)
+    with pytest.raises(KeyboardInterrupt):
+        breaker.call(interrupt)
+    # 中断された復旧確認の後も、次のアクセスで復旧を確認できる
+    assert breaker.state == HALF_OPEN
+    assert breaker.ready()
+    assert breaker.call(lambda: 1) == 1
+    assert breaker.state == CLOSED
+
+
+def test_transitions_are_counted_in_metrics():
+
+    METRICS.reset()
+    METRICS.enable()
+    try:
+        breaker = open_breaker()
+        sleep(0.06)
+        breaker.call(lambda: 1)
+        counters = METRICS.snapshot()["counters"]
+    finally:
+        METRICS.disable()
+        METRICS.reset()
+    counts = {
+            (c["labels"]["from_state"], c["labels"]["to_state"]): c["value"]
+            for c in counters
+            if c["name"] == "breaker_transitions_total" and c["labels"]["breaker"] == "test"
+    }
+    assert counts == {(CLOSED, OPEN): 1, (OPEN, HALF_OPEN): 1, (HALF_OPEN, CLOSED): 1}
@@ -0,0 +1,43 @@
+# coding=utf-8
+
+"""
+lib/compression.pyのテスト
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from crawler.lib import compression
+from crawler.lib.compression import HtmlCodec, train_dictionary
+
+HTMLS = ["<html><body><p>記事{}</p>{}</body></html>".format(i, "<div>本文</div>" * (i % 50)) for i in range(200)]
+ALGORITHMS = [compression.ZLIB] + ([compression.ZSTD] if compression.zstandard != None else [])
+
+
+@pytest.mark.parametrize("algorithm", ALGORITHMS)
+@pytest.mark.parametrize("use_dict", [False, True])
+def test_roundtrip(algorithm, use_dict):
+
+    dictionary = train_dictionary(HTMLS * 5, algorithm, size=4096) if use_dict else None
+    codec = HtmlCodec(algorithm, dictionary=dictionary, dict_name="d" if use_dict else None)
+    for html in HTMLS:
+        assert codec.decompress(codec.compress(html)) == html
+
+
+@pytest.mark.parametrize("algorithm", ALGORITHMS)
+def test_shared_codec_across_threads(algorithm):
+
+    codec = HtmlCodec(algorithm)
+    barrier = threading.Barrier(8)
+
+    def roundtrip(i):
+        barrier.wait()
+        for html in HTMLS[i::8]:
+            if codec.decompress(codec.compress(html)) != html:
+                return False
+        return True
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        assert all(executor.map(roundtrip, range(8)))
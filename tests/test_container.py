@@ -0,0 +1,55 @@
+# coding=utf-8
+
+"""
+lib/container.pyのテスト
+"""
+
+import pickle
+import sys
+
+from crawler.lib.container import ScrapedArticleData
+
+HTML = "<html><body>{}</body></html>".format("<div class='paragraph'><p>本文</p></div>" * 100)
+
+
+def article(html=HTML, **kwargs):
+
+    return ScrapedArticleData("http://a.jp/1", "http://a.jp/1?page=2", "title", html, 2,
+                              "2019-01-01 00:00:00", 200, **kwargs)
+
+
+def test_namedtuple_api():
+
+    atcl = article()
+    origin_url, page_url, title, html, page, published_at, status_code = atcl
+    assert html == atcl.html == atcl[3] == atcl[-4] == HTML
+    assert atcl[:2] == ("http://a.jp/1", "http://a.jp/1?page=2")
+    assert atcl._asdict()["html"] == HTML
+    replaced = atcl._replace(page=3)
+    assert replaced.page == 3 and replaced.html == HTML and replaced.encoding == "utf-8"
+    assert len({atcl, article(), replaced}) == 2
+    assert atcl == tuple(article())
+
+
+def test_html_is_stored_compactly():
+
+    atcl = article()
+    assert atcl.encoding == "utf-8"
+    assert atcl.encoded("utf-8") is atcl.encoded("utf-8")
+    assert sys.getsizeof(atcl.encoded("utf-8")) < sys.getsizeof(HTML)
+    assert article("<p>ascii</p>").encoding == None
+
+
+def test_bytes_and_str_compare_equal():
+
+    assert article(HTML.encode("utf-8")) == article(HTML)
+    assert article(HTML.encode("cp932"), encoding="cp932") == article(HTML)
+    assert hash(article(HTML.encode("utf-8"))) == hash(article(HTML))
+
+
+def test_pickle_keeps_compact_html():
+
+    atcl = article()
+    restored = pickle.loads(pickle.dumps(atcl))
+    assert restored == atcl
+    assert restored.encoding == "utf-8"
@@ -0,0 +1,66 @@
+# coding=utf-8
+
+"""
+internet_archive_crawler/crawled_index.pyのテスト
+"""
+
+import pytest
+
+import internet_archives.lib.crawled_index as crawled_index
+from internet_archives.lib.crawled_index import CrawledIndex
+from internet_archives.models import Url
+
+URLS = ["http://a.jp/{}".format(i) for i in range(50)]
+
+
+@pytest.fixture
+def urls(db):
+
+    Url.objects.bulk_create([Url(url_string=url) for url in URLS])
+    return URLS
+
+
+@pytest.mark.parametrize("use_bloom", [False, True])
+def test_load_from_db(urls, use_bloom):
+
+    crawled = CrawledIndex(use_bloom=use_bloom)
+    crawled.load()
+    assert len(crawled) == len(urls)
+    assert all(url in crawled for url in urls)
+    assert "http://a.jp/x" not in crawled
+
+
+def test_load_from_urls(db):
+
+    crawled = CrawledIndex()
+    crawled.load(iter(URLS))
+    assert len(crawled) == len(URLS)
+    assert all(url in crawled for url in URLS)
+    assert "http://a.jp/x" not in crawled
+
+
+def test_add(urls):
+
+    crawled = CrawledIndex()
+    crawled.load()
+    crawled.add("http://b.jp/1")
+    assert "http://b.jp/1" in crawled and "http://b.jp/2" not in crawled
+    assert len(crawled) == len(urls) + 1
+
+
+def test_empty_index(db):
+
+    crawled = CrawledIndex()
+    crawled.load()
+    assert len(crawled) == 0 and URLS[0] not in crawled
+
+
+def test_fingerprint_collision_falls_back_to_db(urls, monkeypatch):
+
+    # ハッシュ値を4通りにし、ほとんどのurlを衝突させる
+    monkeypatch.setattr(crawled_index, "fingerprint", lambda url: len(url) % 4)
+    crawled = CrawledIndex()
+    crawled.load()
+    assert all(url in crawled for url in urls)
+    assert "http://a.jp/x" not in crawled
+    assert "http://b.jp/1" not in crawled
@@ -0,0 +1,74 @@
+# coding=utf-8
+
+"""
+internet_archive_crawler/crawler.pyのテスト
+"""
+
+import logging
+
+import pytest
+
+import internet_archives.lib.const as C
+import internet_archives.lib.crawler as crawler_module
+from crawler.lib.circuit_breaker import CLOSED, OPEN, CircuitOpenError
+from internet_archives.lib.crawler import InternetArchivesCrawler
+
+LOGGER = logging.getLogger(__name__)
+SNAPSHOT = "https://web.archive.org/web/20190101000000/http://a.jp/1"
+
+
+class FakeResolver:
+
+    def __init__(self, error=None):
+
+        self.error = error
+
+    def resolve(self, url, published_at):
+
+        if self.error != None:
+            raise self.error
+        return SNAPSHOT
+
+    def resolve_many(self, targets):
+
+        pass
+
+    def report(self, logger):
+
+        pass
+
+
+def build(tmp_path, resolver):
+
+    target_file = tmp_path / "crawling_target"
+    target_file.write_text("")
+    return InternetArchivesCrawler(target_file=str(target_file), resolver=resolver)
+
+
+def test_ia_failures_open_the_breaker(db, tmp_path):
+
+    crawler = build(tmp_path, FakeResolver(ConnectionError("down")))
+    for _ in range(C.IA_BREAKER_FAILURE_THRESHOLD):
+        with pytest.raises(Exception, match="Internet Archive Server is down."):
+            crawler.scrape("http://a.jp/1", "title", "2019-01-01 00:00:00", LOGGER)
+    assert crawler.breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        crawler.scrape("http://a.jp/1", "title", "2019-01-01 00:00:00", LOGGER)
+
+
+def test_other_failures_do_not_open_the_breaker(db, tmp_path, monkeypatch):
+
+    def broken_scan(html, page_cnt):
+        raise RuntimeError("bug")
+
+    monkeypatch.setattr(crawler_module.global_utils, "get", lambda url, *args, **kwargs: ("<p>本文</p>", 200))
+    monkeypatch.setattr(crawler_module.navi, "scan_links", broken_scan)
+    crawler = build(tmp_path, FakeResolver())
+    (tmp_path / "crawling_target").write_text(
+            "".join("http://a.jp/{}|||title|||2019-01-01 00:00:00\n".format(i) for i in range(4)))
+    crawler.parse(LOGGER)
+
+    # 記事の処理の失敗はInternet Archiveの障害として数えない
+    assert crawler.breaker.state == CLOSED
+    assert sum(crawler.breaker.transitions.values()) == 0
+    assert crawler.breaker.metrics()["failures"] == 0
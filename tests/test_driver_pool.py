@@ -0,0 +1,134 @@
+# coding=utf-8
+
+"""
+lib/driver_pool.pyのテスト
+
+PhantomJSの代わりに、応答の有無と終了したか否かのみを持つWebDriverで確認する
+"""
+
+import threading
+
+import pytest
+
+import crawler.lib.driver_pool as driver_pool
+from crawler.lib.driver_pool import DriverPool
+
+
+class FakeDriver:
+
+    def __init__(self):
+
+        self.alive = True
+        self.quitted = False
+        self.rss = 100.0
+
+    @property
+    def current_url(self):
+
+        if not self.alive:
+            raise ConnectionError("browser is gone")
+        return "about:blank"
+
+    def quit(self):
+
+        self.quitted = True
+
+
+class FakeFactory:
+
+    def __init__(self):
+
+        self.drivers = []
+
+    def __call__(self):
+
+        driver = FakeDriver()
+        self.drivers.append(driver)
+        return driver
+
+
+@pytest.fixture
+def pool(monkeypatch):
+
+    monkeypatch.setattr(driver_pool, "driver_rss_mb", lambda driver: driver.rss)
+    pool = DriverPool(size=2, max_pages=3, max_rss_mb=500, factory=FakeFactory())
+    yield pool
+    pool.shutdown()
+
+
+def test_checkout_reuses_returned_driver(pool):
+
+    with pool.driver() as first:
+        pass
+    with pool.driver() as second:
+        assert second is first
+    assert pool.stats["created"] == 1
+    assert pool.stats["checkouts"] == 2
+    assert len(pool) == 1
+
+
+def test_checkout_waits_when_all_drivers_are_lent(pool):
+
+    a, b = pool.checkout(), pool.checkout()
+    assert a is not b
+    with pytest.raises(TimeoutError):
+        pool.checkout(timeout=0.05)
+
+    threading.Timer(0.05, pool.checkin, (a,)).start()
+    assert pool.checkout(timeout=1) is a
+    pool.checkin(a)
+    pool.checkin(b)
+
+
+def test_discard_quits_driver_and_frees_slot(pool):
+
+    with pytest.raises(ValueError):
+        with pool.driver() as driver:
+            raise ValueError("render failed")
+    assert driver.quitted
+    assert len(pool) == 0
+    assert pool.checkout() is not driver
+
+
+def test_recycle_by_page_count(pool):
+
+    for _ in range(3):
+        with pool.driver() as driver:
+            pass
+    assert driver.quitted
+    assert pool.stats["recycled"] == 1
+    with pool.driver() as new:
+        assert new is not driver
+
+
+def test_recycle_by_rss(pool):
+
+    with pool.driver() as driver:
+        driver.rss = 800.0
+    assert driver.quitted
+    assert pool.stats["recycled"] == 1
+    assert len(pool) == 0
+
+
+def test_unhealthy_idle_driver_is_replaced(pool):
+
+    with pool.driver() as driver:
+        pass
+    driver.alive = False
+    with pool.driver() as new:
+        assert new is not driver
+    assert driver.quitted
+    assert pool.stats["unhealthy"] == 1
+
+
+def test_shutdown_quits_idle_and_returned_drivers(pool):
+
+    idle, lent = pool.checkout(), pool.checkout()
+    pool.checkin(idle)
+    pool.shutdown()
+    assert idle.quitted and not lent.quitted
+    pool.checkin(lent)
+    assert lent.quitted
+    assert len(pool) == 0
+    with pytest.raises(RuntimeError):
+        pool.checkout()
@@ -0,0 +1,158 @@
+# coding=utf-8
+
+"""
+lib/frontier.pyのテスト
+"""
+
+import asyncio
+import threading
+from time import monotonic
+
+import crawler.lib.utils as utils
+from crawler.lib.frontier import Frontier
+
+
+def drain(frontier):
+
+    urls = []
+    entry = frontier.get(block=False)
+    while entry != None:
+        urls.append(entry.url)
+        frontier.done(entry.url)
+        entry = frontier.get(block=False)
+    return urls
+
+
+def test_does_not_add_the_same_url_twice():
+
+    frontier = Frontier(":memory:")
+    assert frontier.put("http://a.jp/1")
+    assert not frontier.put("http://a.jp/1")
+    assert frontier.put_many([("http://a.jp/1", None, None), ("http://a.jp/2", None, None)]) == 1
+    assert drain(frontier) == ["http://a.jp/1", "http://a.jp/2"]
+
+    # 取得済みのurlも追加しない
+    assert not frontier.put("http://a.jp/1")
+    assert "http://a.jp/1" in frontier and "http://a.jp/3" not in frontier
+    assert frontier.stats["added"] == 2 and frontier.stats["duplicates"] == 3
+    frontier.close()
+
+
+def test_keeps_urls_with_colliding_fingerprints(monkeypatch):
+
+    monkeypatch.setattr(utils, "fingerprint", lambda url: 0)
+    frontier = Frontier(":memory:")
+    assert frontier.put("http://a.jp/1")
+    assert frontier.put("http://a.jp/2")
+    assert drain(frontier) == ["http://a.jp/1", "http://a.jp/2"]
+    frontier.close()
+
+
+def test_alternates_hosts():
+
+    frontier = Frontier(":memory:")
+    frontier.put_many([("http://a.jp/{}".format(i), None, None, 0) for i in range(3)])
+    frontier.put_many([("http://b.jp/{}".format(i), None, None, 0) for i in range(2)])
+
+    # 同じホストが続かないよう、ホストを順番に切り替える
+    assert drain(frontier) == ["http://a.jp/0", "http://b.jp/0", "http://a.jp/1", "http://b.jp/1", "http://a.jp/2"]
+    frontier.close()
+
+
+def test_orders_by_priority():
+
+    frontier = Frontier(":memory:", memory_size=1)
+    frontier.put("http://a.jp/old", published_at="2017-01-01 00:00:00")
+    frontier.put("http://a.jp/unknown", published_at="unknown")
+    frontier.put("http://a.jp/new", published_at="2018-01-01 00:00:00")
+    frontier.put("http://a.jp/first", priority=-1e12)
+
+    # 新しい記事から取り出し、日時を解釈できないものは最後にする
+    assert drain(frontier) == ["http://a.jp/first", "http://a.jp/new", "http://a.jp/old", "http://a.jp/unknown"]
+    frontier.close()
+
+
+def test_retry_requeues_url():
+
+    frontier = Frontier(":memory:", memory_size=1)
+    frontier.put_many([("http://a.jp/1", None, None, 0), ("http://a.jp/2", None, None, 1)])
+    entry = frontier.get(block=False)
+    frontier.retry(entry.url)
+
+    assert drain(frontier) == ["http://a.jp/1", "http://a.jp/2"]
+    assert frontier.stats["retried"] == 1
+    frontier.close()
+
+
+def test_resume_requeues_leased_urls(tmp_path):
+
+    path = str(tmp_path / "frontier.sqlite3")
+    frontier = Frontier(path, memory_size=2)
+    frontier.put_many([("http://a.jp/{}".format(i), "title{}".format(i), None, i) for i in range(4)])
+    frontier.done(frontier.get(block=False).url)
+    frontier.get(block=False)  # 取得中のまま停止する
+    frontier.close()
+
+    frontier = Frontier(path, memory_size=2)
+    assert len(frontier) == 3
+    entry = frontier.get(block=False)
+    assert (entry.url, entry.title) == ("http://a.jp/1", "title1")
+    assert [entry.url] + drain(frontier) == ["http://a.jp/1", "http://a.jp/2", "http://a.jp/3"]
+    assert not frontier.put("http://a.jp/0")
+    frontier.close()
+
+    frontier = Frontier(path, resume=False)
+    assert len(frontier) == 0 and frontier.put("http://a.jp/0")
+    frontier.close()
+
+
+def test_get_waits_for_put():
+
+    frontier = Frontier(":memory:")
+    start = monotonic()
+    assert frontier.get(timeout=0.05) == None
+    assert monotonic() - start >= 0.05
+
+    timer = threading.Timer(0.05, frontier.put, ("http://a.jp/1",))
+    timer.start()
+    entry = frontier.get(timeout=5)
+    timer.join()
+    assert entry.url == "http://a.jp/1"
+    frontier.close()
+
+
+def test_close_wakes_waiting_get():
+
+    frontier = Frontier(":memory:")
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(frontier.get()))
+    waiter.start()
+    frontier.close()
+    waiter.join(5)
+
+    assert not waiter.is_alive()
+    assert results == [None]
+
+
+def test_get_async_does_not_block_the_event_loop():
+
+    frontier = Frontier(":memory:")
+
+    async def consume():
+        ticks = []
+
+        async def tick():
+            for _ in range(5):
+                ticks.append(monotonic())
+                await asyncio.sleep(0.01)
+
+        ticker = asyncio.ensure_future(tick())
+        asyncio.get_running_loop().call_later(0.05, frontier.put, "http://a.jp/1")
+        entry = await frontier.get_async(timeout=5)
+        await ticker
+        return entry, ticks
+
+    entry, ticks = asyncio.run(consume())
+    assert entry.url == "http://a.jp/1"
+    assert len(ticks) == 5
+    frontier.close()
@@ -0,0 +1,142 @@
+# coding=utf-8
+
+"""
+lib/http_cache.pyのテスト
+"""
+
+import itertools
+import logging
+
+import pytest
+import requests
+
+import crawler.lib.const as GC
+import crawler.lib.http_cache as http_cache
+import crawler.lib.utils as utils
+from crawler.bench.server import BenchHandler, LocalServer
+from crawler.lib.http_cache import ResponseCache, normalize_url
+
+LOGGER = logging.getLogger(__name__)
+ETAG = '"v1"'
+LAST_MODIFIED = "Tue, 01 Jan 2019 00:00:00 GMT"
+
+
+class ValidatingHandler(BenchHandler):
+    """ ETagとLast-Modifiedを返し、条件付きリクエストが一致すれば304を返すハンドラ
+    """
+
+    def respond(self):
+
+        self.server.conditions.append(
+                (self.headers.get("If-None-Match"), self.headers.get("If-Modified-Since")))
+        if self.headers.get("If-None-Match") == ETAG or self.headers.get("If-Modified-Since") == LAST_MODIFIED:
+            self.send_response(304)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = "<html><body>{}</body></html>".format(self.path).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        if "etag" in self.path:
+            self.send_header("ETag", ETAG)
+        else:
+            self.send_header("Last-Modified", LAST_MODIFIED)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+
+    server = LocalServer(handler=ValidatingHandler)
+    server.httpd.conditions = []
+    with server:
+        yield server
+
+
+def response(url, size):
+
+    res = requests.Response()
+    res.url = url
+    res.status_code = 200
+    res._content = b"x" * size
+    return res
+
+
+@pytest.mark.parametrize("url, normalized", [
+        ("HTTP://Example.JP/a?b=2&a=1#top", "http://example.jp/a?a=1&b=2"),
+        ("http://example.jp:80/a", "http://example.jp/a"),
+        ("https://example.jp:443", "https://example.jp/"),
+        ("http://example.jp:8080/a?x=", "http://example.jp:8080/a?x="),
+])
+def test_normalize_url(url, normalized):
+
+    assert normalize_url(url) == normalized
+
+
+def test_lookup_by_equivalent_url(tmp_path):
+
+    cache = ResponseCache(str(tmp_path / "cache.sqlite3"))
+    cache.store("http://example.jp/a?b=2&a=1", response("http://example.jp/a?b=2&a=1", 10))
+    entry = cache.lookup("HTTP://EXAMPLE.jp:80/a?a=1&b=2#top")
+    assert entry != None and entry.body == b"x" * 10
+    assert cache.lookup("http://example.jp/a?a=1") == None
+    assert cache.stats["misses"] == 1
+
+
+@pytest.mark.parametrize("path, header", [("/etag", 0), ("/last-modified", 1)])
+def test_revalidation_returns_cached_body(tmp_path, server, path, header):
+
+    cache = ResponseCache(str(tmp_path / "cache.sqlite3"), ttl=0)  # 常に再検証する
+    url = server.base_url + path
+    html, status = utils.get(url, LOGGER, 1, cache=cache)
+    assert status == 200
+
+    assert utils.get(url, LOGGER, 1, cache=cache) == (html, 200)
+    assert server.httpd.requests == 2
+    assert server.httpd.conditions[0] == (None, None)
+    assert server.httpd.conditions[1][header] == (ETAG, LAST_MODIFIED)[header]
+    assert cache.stats["revalidated"] == 1 and cache.stats["bytes_saved"] == len(html.encode("utf-8"))
+
+
+def test_fresh_entry_is_used_until_ttl_expires(tmp_path, server, monkeypatch):
+
+    now = [1000.0]
+    monkeypatch.setattr(http_cache, "time", lambda: now[0])
+    cache = ResponseCache(str(tmp_path / "cache.sqlite3"), ttl=60)
+    url = server.base_url + "/etag"
+    html, _ = utils.get(url, LOGGER, 1, cache=cache)
+
+    now[0] += 59
+    assert utils.get(url, LOGGER, 1, cache=cache)[0] == html
+    assert server.httpd.requests == 1 and cache.stats["hits"] == 1
+
+    now[0] += 2
+    assert not cache.lookup(url).fresh(cache.ttl)
+    assert utils.get(url, LOGGER, 1, cache=cache)[0] == html
+    assert server.httpd.requests == 2 and cache.stats["revalidated"] == 1
+    # 再検証した時刻から再び有効になる
+    assert cache.lookup(url).fresh(cache.ttl)
+
+
+def test_eviction_removes_least_recently_used_down_to_low_water(tmp_path, monkeypatch):
+
+    clock = itertools.count(1)
+    monkeypatch.setattr(http_cache, "time", lambda: float(next(clock)))
+    cache = ResponseCache(str(tmp_path / "cache.sqlite3"), max_bytes=1000)
+    for i in range(3):
+        cache.store("http://example.jp/{}".format(i), response("http://example.jp/{}".format(i), 300))
+    cache.hit("http://example.jp/0", cache.lookup("http://example.jp/0"))  # 0を最後に参照したものにする
+    assert len(cache) == 3
+
+    # 1200 bytesになり上限を超えるため、900 bytes(low water)以下になるまで古いものから削除する
+    cache.store("http://example.jp/3", response("http://example.jp/3", 300))
+    assert GC.HTTP_CACHE_LOW_WATER == 0.9
+    assert len(cache) == 3
+    assert cache.lookup("http://example.jp/1") == None
+    assert all(cache.lookup("http://example.jp/{}".format(i)) != None for i in (0, 2, 3))
+
+    cache.store("http://example.jp/4", response("http://example.jp/4", 600))
+    # 1500 bytes -> 参照した時刻が古い2, 0の順に削除すると900 bytesになる
+    assert [i for i in range(5) if cache.lookup("http://example.jp/{}".format(i)) != None] == [3, 4]
@@ -0,0 +1,76 @@
+# coding=utf-8
+
+"""
+lib/http_pool.pyのテスト
+"""
+
+import threading
+
+import crawler.lib.const as GC
+from crawler.bench.server import LocalServer
+from crawler.lib.http_pool import SessionPool
+
+
+def test_sequential_gets_reuse_one_connection():
+
+    pool = SessionPool()
+    server = LocalServer()
+    with server as base_url:
+        for i in range(2):
+            assert pool.get("{}/article/{}".format(base_url, i)).status_code == 200
+        # 別のスレッドのSessionでも同じ接続を使う
+        thread = threading.Thread(target=pool.get, args=(base_url + "/article/2",))
+        thread.start()
+        thread.join()
+    pool.close()
+
+    assert server.httpd.requests == 3
+    assert server.httpd.connections == 1
+
+
+def test_pool_keeps_connections_of_async_concurrency():
+
+    n = GC.ASYNC_MAX_CONCURRENCY
+    pool = SessionPool()
+    server = LocalServer(latency=0.1)
+    barrier = threading.Barrier(n, timeout=30)
+
+    def run(i):
+        for round in range(2):
+            barrier.wait()  # 全スレッドが同時にリクエストを送る
+            pool.get("{}/article/{}/{}".format(server.base_url, i, round), timeout=30)
+
+    with server:
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(n)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    pool.close()
+
+    assert server.httpd.requests == 2 * n
+    # 1回目に作った接続を全てプールに戻し、2回目はそれを再利用する(プールが小さければ接続を作り直す)
+    assert server.httpd.connections <= n
+
+
+def test_sessions_are_per_thread_and_share_connections():
+
+    pool = SessionPool()
+    sessions = []
+
+    def run():
+        sessions.append(pool.session())
+        sessions.append(pool.session())
+
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(sessions) == 8
+    assert len(set(map(id, sessions))) == 4  # スレッドの中では同じSessionを使う
+    adapters = {id(s.get_adapter("http://example.jp/")) for s in sessions}
+    assert len(adapters) == 1
+    pool.close()
+    assert pool.stats() == {}
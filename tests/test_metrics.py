@@ -0,0 +1,25 @@
+# coding=utf-8
+
+"""
+lib/metrics.pyのテスト
+"""
+
+from crawler.lib.metrics import Registry
+
+
+def test_merge_adds_snapshot_of_other_registry():
+
+    worker, parent = Registry(enabled=True), Registry(enabled=True)
+    for registry in (worker, parent):
+        registry.inc("pages_total", domain="a.jp")
+        registry.observe("render_seconds", 0.2, domain="a.jp")
+    worker.inc("pages_total", 2, domain="b.jp")
+
+    parent.merge(worker.snapshot())
+    snapshot = parent.snapshot()
+    counters = {c["labels"]["domain"]: c["value"] for c in snapshot["counters"]}
+    assert counters == {"a.jp": 2, "b.jp": 2}
+    histogram, = snapshot["histograms"]
+    assert histogram["count"] == 2
+    assert histogram["sum"] == 0.4
+    assert histogram["buckets"]["0.5"] == 2
@@ -0,0 +1,103 @@
+# coding=utf-8
+
+"""
+lib/page_navigator.pyのテスト
+"""
+
+import random
+import re
+
+import pytest
+
+import crawler.lib.const as GC
+import crawler.lib.page_navigator as navi
+from crawler.bench.bench_link_scanner import legacy, make_page
+from crawler.bench.corpus import news_page
+
+# 正規表現の境界になりやすい入力
+PATHOLOGICAL = [
+        "",
+        "<html><body>リンクなし</body></html>",
+        "<a href=\"#top\">次へ</a><a href=\"/a?page=3\">3</a>",  # アンカの次へリンクの後にページ番号のリンク
+        "<a href=\"/a?page=3\">3</a><a href=\"#top\">次へ</a>",
+        "<a href=\"#top\">次へ</a>",
+        "<a href=\"#top\">次へ</a><a href=\"/a?page=4\">次へ</a><a href=\"/a?page=3\">3</a>",
+        "<a href=\"/a/full\">続きを読む</a><a href=\"/a?page=3\">次へ</a>",
+        "<a href=\"/a?page=3\">次へ</a><a href=\"/a/full\">続きを読む</a>",
+        "<a href=\"/a?page=3\"><span class=\"x\">【次のページ】</span></a>",
+        "<a class=\"l\" href='/a?page=3' target=\"_blank\">&lt;3&gt;</a>",
+        "<a href=\"/a?page=30\">30</a><a href=\"/a?page=3\">3</a>",  # 2ページ目での"30"は次ページではない
+        "<a href=\"/a?page=3\"><a href=\"/b?page=3\">次へ</a>",  # 閉じていないaタグ
+        "<a href=\"/a?page=3\">次へ" + "<p>本文</p>" * 1000,  # 閉じタグが無い
+        "<a href=\"" + "/a" * 2000 + "\">3</a>",
+        "<a " * 500 + "href=\"/a\">次へ</a>",
+        "<a href=\"/a?page=3\">全文を表示する</a><a href=\"/b\">記事全文を表示する</a>",
+]
+
+
+def corpus(n=200, seed=0):
+
+    rnd = random.Random(seed)
+    docs = [(make_page(rnd, n_links=rnd.randint(0, 60)), rnd.randint(1, 9)) for _ in range(n)]
+    for pagination in ("next", "counter", "disp", None):
+        for page in range(1, 5):
+            docs.append((news_page(rnd, page=page, pagination=pagination), page))
+    return docs
+
+
+@pytest.mark.parametrize("html", PATHOLOGICAL)
+@pytest.mark.parametrize("page_cnt", [1, 2, 9])
+def test_scan_links_matches_legacy_on_pathological_inputs(html, page_cnt):
+
+    assert tuple(navi.scan_links(html, page_cnt)) == legacy(html, page_cnt)
+
+
+def test_scan_links_matches_legacy_on_corpus():
+
+    docs = corpus()
+    for html, page_cnt in docs:
+        assert tuple(navi.scan_links(html, page_cnt)) == legacy(html, page_cnt)
+    # 検出されるケースと検出されないケースの両方を含むこと
+    found = [navi.scan_links(html, page_cnt) for html, page_cnt in docs]
+    assert any(links.disp_url for links in found) and any(links.next_url for links in found)
+    assert any(links == (None, None) for links in found)
+
+
+def docstring_examples(func):
+    """ docstringに"next_url, item_link -> 結果"の形式で書かれた例を返す
+    """
+
+    return [(a, b, result == "True")
+            for a, b, result in re.findall(r"^\s+(\S+), (\S+) -> (True|False)$", func.__doc__, re.M)]
+
+
+IS_NEXT_URL_EXAMPLES = docstring_examples(navi.is_next_url)
+
+
+def test_is_next_url_docstring_has_examples():
+
+    assert len(IS_NEXT_URL_EXAMPLES) == 7
+
+
+@pytest.mark.parametrize("next_url, item_link, expected", IS_NEXT_URL_EXAMPLES)
+def test_is_next_url_docstring_examples(next_url, item_link, expected):
+
+    assert navi.is_next_url(next_url, item_link) == expected
+
+
+def test_is_next_url_cache_is_bounded():
+
+    navi.is_next_url.cache_clear()
+    maxsize = navi.is_next_url.cache_info().maxsize
+    assert maxsize == GC.IS_NEXT_URL_CACHE_SIZE
+    item_link = "http://hogehoge.com/article/1"
+    for i in range(maxsize + 10):
+        navi.is_next_url("/article/1?page={}".format(i), item_link)
+
+    info = navi.is_next_url.cache_info()
+    assert info.currsize == maxsize and info.misses == maxsize + 10
+    # 最も古い呼び出しは追い出され、最新の呼び出しは残っている
+    navi.is_next_url("/article/1?page={}".format(maxsize + 9), item_link)
+    assert navi.is_next_url.cache_info().hits == 1
+    navi.is_next_url("/article/1?page=0", item_link)
+    assert navi.is_next_url.cache_info().misses == maxsize + 11
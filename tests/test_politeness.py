@@ -0,0 +1,51 @@
+# coding=utf-8
+
+"""
+lib/politeness.pyのテスト
+"""
+
+import multiprocessing
+from time import monotonic
+
+from crawler.lib.politeness import HostScheduler, SharedTokenBucket
+
+RATE = 50.0
+
+
+def reserve_times(bucket, n, outbox):
+
+    scheduler = HostScheduler(shared={"web.archive.org": bucket})
+    times = []
+    for _ in range(n):
+        _, wait = scheduler.reserve("https://web.archive.org/web/*/http://a.jp/1")
+        times.append(monotonic() + wait)
+    outbox.put(times)
+
+
+def test_shared_bucket_spaces_requests_across_processes():
+
+    ctx = multiprocessing.get_context("fork")
+    bucket = SharedTokenBucket(RATE, 1, ctx=ctx)
+    outbox = ctx.Queue()
+    workers = [ctx.Process(target=reserve_times, args=(bucket, 5, outbox)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    times = sorted(t for _ in workers for t in outbox.get(timeout=10))
+    for worker in workers:
+        worker.join()
+
+    assert len(times) == 20
+    # 4プロセス合わせても、1/RATE秒に1回を超えない
+    assert times[-1] - times[0] > (len(times) - 1) / RATE * 0.95
+    assert min(b - a for a, b in zip(times, times[1:])) > 1 / RATE * 0.5
+
+
+def test_other_hosts_use_local_buckets():
+
+    ctx = multiprocessing.get_context("fork")
+    bucket = SharedTokenBucket(RATE, 1, ctx=ctx)
+    scheduler = HostScheduler(rate=RATE, min_interval=0, shared={"web.archive.org": bucket})
+    assert scheduler.reserve("http://a.jp/1")[1] < 0.001
+    assert scheduler.reserve("http://b.jp/1")[1] < 0.001
+    assert scheduler.reserve("https://web.archive.org/web/1")[1] < 0.001
+    assert scheduler.reserve("https://web.archive.org/web/2")[1] > 1 / RATE * 0.5
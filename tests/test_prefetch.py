@@ -0,0 +1,146 @@
+# coding=utf-8
+
+"""
+lib/prefetch.pyのテスト
+"""
+
+import logging
+import threading
+
+import pytest
+
+from crawler.lib.prefetch import PaginationTemplates, Prefetcher
+from crawler.lib.timeout import deadline
+
+
+def crawl(prefetcher, origin_url, n_pages):
+    """ crawler.pyの__iter_atclと同じ順にPrefetcherを呼び出す
+    """
+
+    for page in range(2, n_pages + 1):
+        url = "{}?page={}".format(origin_url, page)
+        prefetcher.advance(origin_url, url, page)
+        prefetcher.take(origin_url, url, page)
+    prefetcher.finish(origin_url)
+
+
+def test_does_not_prefetch_past_observed_page_counts():
+
+    fetched = []
+    prefetcher = Prefetcher(lambda url, page: fetched.append(url) or ("", 200), depth=3,
+                            templates=PaginationTemplates(min_support=1))
+    for i in range(10):
+        crawl(prefetcher, "http://a.jp/{}".format(i), 2)
+    prefetcher.close()
+
+    # 2ページで終わる記事ばかりのドメインでは、記録ができた後は先読みしない
+    assert prefetcher.stats["submitted"] <= 2
+    assert prefetcher.stats["unused"] == prefetcher.stats["submitted"]
+
+
+def test_prefetches_deeper_for_long_articles():
+
+    prefetcher = Prefetcher(lambda url, page: ("", 200), depth=2, templates=PaginationTemplates(min_support=1))
+    for i in range(10):
+        crawl(prefetcher, "http://a.jp/{}".format(i), 5)
+    prefetcher.close()
+
+    assert prefetcher.stats["hits"] >= 25
+    assert prefetcher.stats["unused"] <= 3
+
+
+def site(n_pages, fetched):
+    """ n_pagesページより先は404を返すfetch
+    """
+
+    def fetch(url, page):
+        fetched.append(url)
+        return ("", 200) if page <= n_pages else (None, 404)
+    return fetch
+
+
+def test_does_not_prefetch_before_pages_are_recorded():
+
+    fetched = []
+    prefetcher = Prefetcher(site(2, fetched), depth=3, templates=PaginationTemplates(min_support=3))
+    for i in range(3):
+        crawl(prefetcher, "http://a.jp/{}".format(i), 2)
+    prefetcher.close()
+
+    # パターンを学習していても、記事がそのページまで続いた記録が無い間は404になりうるリクエストを送らない
+    assert fetched == []
+    assert prefetcher.stats["submitted"] == 0
+
+
+def test_caps_speculative_prefetches_per_article():
+
+    fetched = []
+    templates = PaginationTemplates(min_support=1)
+    for i, pages in enumerate([2, 3, 3, 4, 4, 4, 4, 4]):
+        templates.learn("http://a.jp/{}".format(i), "http://a.jp/{}?page=2".format(i), 2)
+        templates.learn_length("http://a.jp/{}".format(i), pages)
+    prefetcher = Prefetcher(site(2, fetched), depth=3, templates=templates, max_speculative=1)
+    for i in range(10, 13):
+        crawl(prefetcher, "http://a.jp/{}".format(i), 2)
+    prefetcher.close()
+
+    # 3、4ページ目まで続く割合はどちらもmin_reach以上だが、必ず続くとは限らないため記事ごとに1ページのみ先読みする
+    assert prefetcher.stats["submitted"] == 3
+    assert len(fetched) <= 3
+    assert all(url.endswith("?page=3") for url in fetched)
+
+
+def test_reports_wasted_requests(caplog):
+
+    fetched = []
+    templates = PaginationTemplates(min_support=1)
+    templates.learn("http://a.jp/0", "http://a.jp/0?page=2", 2)
+    templates.learn_length("http://a.jp/0", 3)
+    prefetcher = Prefetcher(site(2, fetched), depth=1, templates=templates)
+    origin_url = "http://a.jp/1"
+    prefetcher.advance(origin_url, origin_url + "?page=2", 2)
+    prefetcher.take(origin_url, origin_url + "?page=2", 2)
+    prefetcher._Prefetcher__pending[origin_url][3][1].result()  # 404のリクエストが送られるのを待つ
+    prefetcher.finish(origin_url)
+    prefetcher.close()
+
+    assert fetched == [origin_url + "?page=3"]
+    assert prefetcher.stats["unused"] == 1
+    assert prefetcher.stats["wasted"] == 1
+    logger = logging.getLogger("test_prefetch")
+    with caplog.at_level(logging.INFO, logger="test_prefetch"):
+        prefetcher.report(logger)
+    assert "1 wasted requests" in caplog.text
+
+
+def test_discarding_queued_prefetch_is_not_wasted():
+
+    release = threading.Event()
+    templates = PaginationTemplates(min_support=1)
+    templates.learn("http://a.jp/0", "http://a.jp/0?page=2", 2)
+    templates.learn_length("http://a.jp/0", 5)
+    prefetcher = Prefetcher(lambda url, page: release.wait() and ("", 200), depth=3, max_workers=1,
+                            templates=templates)
+    prefetcher.advance("http://a.jp/1", "http://a.jp/1?page=2", 2)
+    prefetcher.finish("http://a.jp/1")
+    release.set()
+    prefetcher.close()
+
+    # 実行中だった1件のみがリクエストを送っており、待っていた2件は取り消せる
+    assert prefetcher.stats["unused"] == 3
+    assert prefetcher.stats["wasted"] == 1
+
+
+def test_take_waits_until_deadline():
+
+    release = threading.Event()
+    templates = PaginationTemplates(min_support=1)
+    templates.learn("http://a.jp/0", "http://a.jp/0?page=2", 2)
+    templates.learn_length("http://a.jp/0", 3)
+    prefetcher = Prefetcher(lambda url, page: release.wait() and ("", 200), templates=templates)
+    prefetcher.advance("http://a.jp/1", "http://a.jp/1?page=2", 2)
+    with pytest.raises(TimeoutError):
+        with deadline(0.05):
+            prefetcher.take("http://a.jp/1", "http://a.jp/1?page=3", 3)
+    release.set()
+    prefetcher.close()
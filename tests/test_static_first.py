@@ -0,0 +1,31 @@
+# coding=utf-8
+
+"""
+lib/static_first.pyのテスト
+"""
+
+import crawler.lib.page_navigator as navi
+from crawler.lib.static_first import is_sufficient
+
+# 3ページ目の記事、前のページへのリンク("2")のみがあり、本文は短い
+PAGE3 = '<html><body><p>短い本文</p><a href="http://a.jp/1?page=2">2</a></body></html>'
+
+
+def test_page_number_is_used_for_link_check():
+
+    assert is_sufficient(PAGE3, page_cnt=1)  # 1ページ目であれば"2"は次ページへのリンク
+    assert not is_sufficient(PAGE3, page_cnt=3)
+
+
+def test_scan_is_reused_for_same_html(monkeypatch):
+
+    calls = []
+    scan = navi._scanner.scan
+    monkeypatch.setattr(navi._scanner, "scan", lambda html, page_cnt: calls.append(page_cnt) or scan(html, page_cnt))
+    html = PAGE3.replace("?page=2\">2", "?page=4\">4")
+
+    assert is_sufficient(html, page_cnt=3)
+    assert navi.scan_links(html, 3).next_url == "http://a.jp/1?page=4"
+    assert calls == [3]
+    navi.scan_links(html, 1)
+    assert calls == [3, 1]
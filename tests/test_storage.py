@@ -0,0 +1,84 @@
+# coding=utf-8
+
+"""
+internet_archive_crawler/storage.pyのテスト
+"""
+
+from datetime import datetime
+
+from crawler.lib.container import ScrapedArticleData
+from internet_archives.lib.storage import dedup_existing_sources, dedup_stats
+from internet_archives.lib.writer import BufferedArticleWriter
+from internet_archives.models import HtmlBlob, PageUrl, Source, Url
+
+SHARED = "<html><body>{}</body></html>".format("<p>共通のテンプレート</p>" * 50)
+UNIQUE = "<html><body>{}</body></html>".format("<p>固有の記事</p>" * 50)
+
+
+def source(url, page, html):
+    """ HtmlBlobを使わずにSourceを保存する
+    """
+
+    url_obj, _ = Url.objects.get_or_create(url_string=url)
+    purl = PageUrl.objects.create(
+            url=url_obj, pageurl_string="https://web.archive.org/web/2019/{}?page={}".format(url, page),
+            page=page, status_code=200)
+    src = Source(purl=purl, title="title", published_at=datetime(2019, 1, 1))
+    src.set_html(html)
+    src.save()
+    return src
+
+
+def test_identical_html_is_stored_once(db):
+
+    for i in range(3):
+        source("http://a.jp/{}".format(i), 1, SHARED)
+    source("http://a.jp/9", 1, UNIQUE)
+    source("http://b.jp/1", 1, SHARED)
+
+    assert dedup_existing_sources(batch_size=2) == 5
+    assert HtmlBlob.objects.count() == 2
+    shared = HtmlBlob.objects.get(size=len(SHARED.encode("utf-8")))
+    assert Source.objects.filter(blob=shared).count() == 4
+    for src in Source.objects.all():
+        assert src.html == "" and src.get_html() in (SHARED, UNIQUE)
+    assert dedup_existing_sources() == 0  # 変換済みのものは対象にしない
+
+    stats = dedup_stats()
+    shared_size, unique_size = len(SHARED.encode("utf-8")), len(UNIQUE.encode("utf-8"))
+    # Internet Archive上のurlはキャッシュ元のドメインで集計する
+    assert stats["a.jp"] == {
+            "sources": 4,
+            "blobs": 2,
+            "logical_bytes": 3 * shared_size + unique_size,
+            "stored_bytes": shared_size + unique_size,
+            "dedup_ratio": 2.0
+    }
+    assert stats["b.jp"]["blobs"] == 1 and stats["b.jp"]["stored_bytes"] == shared_size
+
+
+def test_compressed_blobs_report_savings(db):
+
+    for i in range(4):
+        source("http://a.jp/{}".format(i), 1, SHARED)
+    dedup_existing_sources(compression="zlib")
+
+    stats = dedup_stats()["a.jp"]
+    assert stats["sources"] == 4 and stats["blobs"] == 1 and stats["dedup_ratio"] == 4.0
+    assert stats["stored_bytes"] < stats["logical_bytes"] / 4
+    assert Source.objects.first().get_html() == SHARED
+
+
+def test_writer_shares_blobs(db):
+
+    writer = BufferedArticleWriter(batch_size=100, flush_interval=1000, dedup=True)
+    for i in range(3):
+        url = "http://a.jp/{}".format(i)
+        writer.add(url, [ScrapedArticleData(url, url, "title", SHARED, 1, datetime(2019, 1, 1), 200)])
+    writer.flush()
+    url = "http://a.jp/3"
+    writer.add(url, [ScrapedArticleData(url, url, "title", SHARED, 1, datetime(2019, 1, 1), 200)])
+    writer.flush()
+
+    assert HtmlBlob.objects.count() == 1 and Source.objects.filter(blob__isnull=False).count() == 4
+    assert writer.blobs.stats == {"blobs": 1, "reused": 3}
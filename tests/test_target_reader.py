@@ -0,0 +1,65 @@
+# coding=utf-8
+
+"""
+internet_archive_crawler/target_reader.pyのテスト
+"""
+
+import pytest
+
+from internet_archives.lib.target_reader import TargetReader
+
+LINES = [
+    "http://a.jp/1|||t|||2019-01-01 00:00:00",
+    "broken line",
+    "http://a.jp/2|||t|||2019-01-02 00:00:00",
+    "http://a.jp/1|||t|||2019-01-03 00:00:00",
+    "",
+    "http://a.jp/3|||t|||2019-01-04 00:00:00",
+    "http://a.jp/2|||t|||2019-01-05 00:00:00",
+]
+
+
+def reader(tmp_path, dedup):
+
+    path = tmp_path / "crawling_target"
+    path.write_text("\n".join(LINES) + "\n", encoding="utf-8")
+    return TargetReader(str(path), dedup=dedup)
+
+
+def test_count_lines_without_dedup(tmp_path):
+
+    targets = reader(tmp_path, False)
+    # 内容は解釈せず改行の数を数える
+    assert targets.count() == (len(LINES), 0)
+    lines = list(targets)
+    targets.commit(lines[1].end)
+    assert targets.count() == (len(LINES), 3)
+
+
+def test_count_line_without_trailing_newline(tmp_path):
+
+    path = tmp_path / "crawling_target"
+    path.write_text("\n".join(LINES), encoding="utf-8")
+    targets = TargetReader(str(path))
+    assert targets.count() == (len(LINES), 0)
+    targets.commit(path.stat().st_size)
+    assert targets.count() == (len(LINES), len(LINES))
+
+
+def test_count_matches_iteration_with_dedup(tmp_path):
+
+    targets = reader(tmp_path, True)
+    total, done = targets.count()
+    assert done == 0
+    assert total == len(list(targets))
+
+
+def test_count_after_checkpoint_with_dedup(tmp_path):
+
+    targets = reader(tmp_path, True)
+    lines = list(targets)
+    targets.commit(lines[1].end)
+    total, done = targets.count()
+    # 再開後のプログレスバーは、初期値から読み込む行数だけ進んで全体の行数に一致する
+    assert total - done == len(list(targets))
+    assert done == 2
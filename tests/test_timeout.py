@@ -0,0 +1,288 @@
+# coding=utf-8
+
+"""
+lib/timeout.pyのテスト
+
+入れ子にしたタイムアウトや、スレッドごとに異なる制限時間が互いの期限を上書きしないことを確認する
+"""
+
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic, sleep
+
+import pytest
+
+import crawler.lib.page_navigator as navi
+from crawler.lib.timeout import check_deadline, deadline, on_timeout, remaining, timeout
+
+# スレッドの起動やスケジューリングによる誤差の許容範囲(秒)
+SLACK = 0.15
+# 28文字で数十秒かかるバックトラッキング
+BACKTRACKING = re.compile(r"(a+)+b")
+SUBJECT = "a" * 28
+
+
+def raise_timeout(msg):
+    raise TimeoutError(msg)
+
+
+@on_timeout(0.5, raise_timeout, hint="backtracking", isolate=True)
+def backtrack(p, s):
+    return p.search(s) != None
+
+
+@on_timeout(0.5, raise_timeout, hint="match", isolate=True)
+def match(p, s):
+    return p.search(s).group()
+
+
+def test_remaining_without_deadline():
+
+    assert remaining() == None
+    assert remaining(7) == 7
+
+
+def test_deadline_caps_remaining():
+
+    with deadline(0.5):
+        assert remaining(10) <= 0.5
+        assert remaining(0.1) == 0.1
+        assert 0.5 - SLACK < remaining() <= 0.5
+    assert remaining(10) == 10
+
+
+def test_nested_deadline_cannot_extend_outer():
+
+    with deadline(0.3) as outer:
+        with deadline(5) as inner:
+            assert inner is outer
+            assert remaining() <= 0.3
+        with deadline(0.1):
+            assert remaining() <= 0.1
+        # 内側の期限が終わった後は外側の期限に戻る
+        assert 0.1 < remaining() <= 0.3
+
+
+def test_expired_deadline():
+
+    with deadline(0.05):
+        sleep(0.1)
+        assert remaining(10) == 0.0
+        with pytest.raises(TimeoutError):
+            check_deadline()
+
+
+def test_timeout_returns_value_and_binds_deadline():
+
+    @timeout(0.5)
+    def f():
+        return remaining()
+
+    left = f()
+    assert 0.5 - SLACK < left <= 0.5
+    assert remaining() == None  # 呼び出し元には期限が設定されない
+
+
+def test_timeout_raises():
+
+    @timeout(0.1)
+    def f():
+        sleep(1)
+
+    start = monotonic()
+    with pytest.raises(TimeoutError):
+        f()
+    assert monotonic() - start < 0.1 + SLACK
+
+
+def test_nested_timeout_inner_expires_first():
+
+    @timeout(0.1)
+    def inner():
+        sleep(1)
+
+    @timeout(1.0)
+    def outer():
+        with pytest.raises(TimeoutError):
+            inner()
+        # 内側のタイムアウトで外側の期限が短くならない
+        return remaining()
+
+    left = outer()
+    assert 1.0 - 0.1 - SLACK < left < 1.0 - 0.1
+
+
+def test_nested_timeout_is_capped_by_outer():
+
+    @timeout(5)
+    def inner():
+        return remaining()
+
+    @timeout(0.3)
+    def outer():
+        return inner()
+
+    assert outer() <= 0.3
+
+
+def test_nested_timeout_outer_expires_first():
+
+    @timeout(5)
+    def inner():
+        sleep(1)
+
+    @timeout(0.2)
+    def outer():
+        inner()
+
+    start = monotonic()
+    with pytest.raises(TimeoutError):
+        outer()
+    assert monotonic() - start < 0.2 + SLACK
+
+
+def test_on_timeout_calls_handler_and_waits():
+
+    messages = []
+
+    @on_timeout(0.1, messages.append, hint="slow")
+    def f():
+        sleep(0.3)
+        return remaining()
+
+    # on_timeoutは期限を設定しないため、関数の中ではremainingがNoneのまま
+    assert f() == None
+    assert len(messages) == 1 and "slow" in messages[0]
+
+
+def test_on_timeout_inside_timeout():
+
+    messages = []
+
+    @on_timeout(0.1, messages.append, hint="inner")
+    def inner():
+        sleep(0.2)
+        return "done"
+
+    @timeout(1.0)
+    def outer():
+        return inner(), remaining()
+
+    value, left = outer()
+    assert value == "done"
+    assert len(messages) == 1
+    assert 1.0 - 0.2 - SLACK < left < 1.0 - 0.2
+
+
+def test_on_timeout_without_handler_exception():
+
+    @on_timeout(0.5, lambda msg: None, hint="fast")
+    def f():
+        return 1
+
+    assert f() == 1
+
+
+def test_parallel_threads_keep_their_own_limits():
+
+    limits = [0.1, 0.2, 0.4, 0.8, 0.1, 0.2, 0.4, 0.8]
+    work = 0.3
+    results = [None] * len(limits)
+
+    def run(i, limit):
+
+        @timeout(limit)
+        def f():
+            seen = remaining()
+            sleep(work)
+            return seen
+
+        start = monotonic()
+        try:
+            results[i] = ("ok", f(), monotonic() - start)
+        except TimeoutError:
+            results[i] = ("timeout", None, monotonic() - start)
+
+    threads = [threading.Thread(target=run, args=(i, limit)) for i, limit in enumerate(limits)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    for limit, (status, seen, elapsed) in zip(limits, results):
+        if limit < work:
+            assert status == "timeout"
+            assert elapsed < limit + SLACK
+        else:
+            assert status == "ok"
+            assert limit - SLACK < seen <= limit
+
+
+def test_parallel_deadlines_are_independent():
+
+    limits = [0.2, 1.0, 0.5, 2.0]
+    seen = [None] * len(limits)
+    barrier = threading.Barrier(len(limits))
+
+    def run(i, limit):
+        with deadline(limit):
+            barrier.wait()  # 全スレッドが期限を設定してから読む
+            seen[i] = remaining()
+
+    threads = [threading.Thread(target=run, args=(i, limit)) for i, limit in enumerate(limits)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    for limit, left in zip(limits, seen):
+        assert limit - SLACK < left <= limit
+
+
+def test_timeout_interrupts_backtracking_on_main_thread():
+
+    @timeout(0.5)
+    def f():
+        return BACKTRACKING.search(SUBJECT)
+
+    start = monotonic()
+    with pytest.raises(TimeoutError):
+        f()
+    assert monotonic() - start < 0.5 + SLACK
+    # タイマーが残っていれば、ここでSIGALRMが届く
+    sleep(0.6)
+
+
+def test_isolated_call_interrupts_backtracking_in_thread():
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        start = monotonic()
+        with pytest.raises(TimeoutError):
+            executor.submit(backtrack, BACKTRACKING, SUBJECT).result()
+        assert monotonic() - start < 0.5 + 1.0  # 子プロセスの起動を含む
+        # 終了させた子プロセスの代わりに新しい子プロセスで実行できる
+        assert executor.submit(match, re.compile("b+"), "abbc").result() == "bb"
+        assert executor.submit(backtrack, BACKTRACKING, "ab").result()
+
+
+def test_isolated_call_returns_errors_and_reuses_worker():
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        with pytest.raises(AttributeError):
+            executor.submit(match, re.compile("b"), "aaa").result()
+        assert executor.submit(match, re.compile("a+"), "aaa").result() == "aaa"
+
+
+def test_search_url_times_out_in_thread():
+
+    def search():
+        # search_urlのon_timeoutは10秒だが、呼び出し元の期限で打ち切られる
+        with deadline(0.5):
+            return navi.search_url(BACKTRACKING, SUBJECT)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        start = monotonic()
+        with pytest.raises(TimeoutError):
+            executor.submit(search).result()
+        assert monotonic() - start < 0.5 + 1.0
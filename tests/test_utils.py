@@ -0,0 +1,34 @@
+# coding=utf-8
+
+"""
+lib/utils.pyのテスト
+"""
+
+import logging
+
+import pytest
+
+import crawler.lib.utils as utils
+from crawler.lib.timeout import deadline
+
+
+class RecordingPool:
+
+    def __init__(self):
+
+        self.calls = []
+
+    def get(self, url, headers=None, timeout=None):
+
+        self.calls.append((url, timeout))
+        raise AssertionError("request should not be sent")
+
+
+def test_get_does_not_request_after_deadline(monkeypatch):
+
+    pool = RecordingPool()
+    monkeypatch.setattr(utils, "get_session_pool", lambda: pool)
+    with deadline(0):
+        with pytest.raises(TimeoutError):
+            utils.get("http://example.jp/", logging.getLogger(__name__), 1)
+    assert pool.calls == []
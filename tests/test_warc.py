@@ -0,0 +1,55 @@
+# coding=utf-8
+
+"""
+lib/warc.pyのテスト
+"""
+
+import os
+
+from crawler.lib.container import ScrapedArticleData
+from crawler.lib.warc import WarcArticleSink, crawled_urls, index_path, iter_articles, scan_crawled_urls
+
+
+def page(url, n):
+
+    return ScrapedArticleData(url, "{}?page={}".format(url, n), "title", "<p>本文{}</p>".format(n), n,
+                              "2019-01-01 00:00:00", 200)
+
+
+def test_crawled_urls_are_read_from_index(tmp_path):
+
+    directory = str(tmp_path)
+    sink = WarcArticleSink(directory, batch_size=100)
+    sink.add("http://a.jp/1", [page("http://a.jp/1", 1), page("http://a.jp/1", 2)])
+    sink.add_page("http://a.jp/2", page("http://a.jp/2", 1))
+    sink.end_target("http://a.jp/2")
+    # ディスクに書き出すまでは索引に載らない
+    assert list(crawled_urls(directory)) == []
+    sink.add_page("http://a.jp/3", page("http://a.jp/3", 1))
+    sink.discard("http://a.jp/3")
+    sink.close()
+
+    assert list(crawled_urls(directory)) == ["http://a.jp/1", "http://a.jp/2"]
+    assert set(scan_crawled_urls(directory)) == {"http://a.jp/1", "http://a.jp/2"}
+    assert [atcl.page_url for _, atcl in iter_articles(directory)] == [
+            "http://a.jp/1?page=1", "http://a.jp/1?page=2", "http://a.jp/2?page=1"]
+
+
+def test_index_is_rebuilt_when_missing(tmp_path):
+
+    directory = str(tmp_path)
+    sink = WarcArticleSink(directory)
+    sink.add("http://a.jp/1", [page("http://a.jp/1", 1), page("http://a.jp/1", 2)])
+    sink.close()
+    os.remove(index_path(directory))
+
+    sink = WarcArticleSink(directory)
+    assert list(sink.crawled_urls()) == ["http://a.jp/1"]
+    sink.add("http://a.jp/2", [page("http://a.jp/2", 1)])
+    sink.close()
+    assert list(crawled_urls(directory)) == ["http://a.jp/1", "http://a.jp/2"]
+
+
+def test_crawled_urls_of_missing_directory(tmp_path):
+
+    assert list(crawled_urls(str(tmp_path / "none"))) == []
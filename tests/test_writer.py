@@ -0,0 +1,109 @@
+# coding=utf-8
+
+"""
+internet_archive_crawler/writer.pyのテスト
+"""
+
+import gc
+import weakref
+from datetime import datetime
+from time import sleep
+
+from django.db.models.query import QuerySet
+
+import internet_archives.lib.writer as writer_module
+from crawler.lib.container import ScrapedArticleData
+from internet_archives.lib.writer import BufferedArticleWriter
+from internet_archives.models import PageUrl, Source, Url
+
+
+def pages(url, n=2):
+
+    return [
+            ScrapedArticleData(url, "{}?page={}".format(url, i), "title", "<p>{} {}</p>".format(url, i), i,
+                               datetime(2019, 1, 1), 200)
+            for i in range(1, n + 1)
+    ]
+
+
+def saved(url):
+    """ 保存されたurlの(ページ番号, ページのurl, html)のリストを返す
+    """
+
+    return sorted(
+            (source.purl.page, source.purl.pageurl_string, source.get_html())
+            for source in Source.objects.filter(purl__url__url_string=url)
+    )
+
+
+def test_flush_when_batch_is_full(db):
+
+    flushed = []
+    writer = BufferedArticleWriter(batch_size=2, flush_interval=1000)
+    writer.add_flush_callback(lambda: flushed.append(len(writer)))
+    writer.add("http://a.jp/1", pages("http://a.jp/1"))
+    writer.add("http://a.jp/1", pages("http://a.jp/1"))  # バッファにある記事は追加しない
+    assert Url.objects.count() == 0 and len(writer) == 1 and flushed == []
+
+    writer.add("http://a.jp/2", pages("http://a.jp/2"))
+    assert flushed == [0] and len(writer) == 0
+    assert Url.objects.count() == 2 and PageUrl.objects.count() == 4
+    assert saved("http://a.jp/2") == [(p.page, p.page_url, p.html) for p in pages("http://a.jp/2")]
+    assert writer.stats["flushes"] == 1 and writer.stats["urls"] == 2 and writer.stats["rows"] == 2 + 4 + 4
+
+    # 既にDBにあるurlは保存しない
+    writer.add("http://a.jp/1", pages("http://a.jp/1", 3))
+    writer.flush()
+    assert Url.objects.count() == 2 and PageUrl.objects.count() == 4
+
+
+def test_flush_after_interval(db):
+
+    writer = BufferedArticleWriter(batch_size=100, flush_interval=0.1)
+    assert not writer.flush_if_due()  # バッファが空の場合は保存しない
+    writer.add("http://a.jp/1", pages("http://a.jp/1"))
+    assert not writer.flush_if_due() and Url.objects.count() == 0
+
+    sleep(0.15)
+    assert writer.flush_if_due()
+    assert Url.objects.count() == 1 and len(writer) == 0
+
+    # 間隔を過ぎてから追加したものはaddの時点で保存する
+    sleep(0.15)
+    writer.add("http://a.jp/2", pages("http://a.jp/2"))
+    assert Url.objects.count() == 2
+
+
+def test_fallback_when_bulk_create_returns_no_pk(db, monkeypatch):
+
+    bulk_create = QuerySet.bulk_create
+
+    def without_pk(self, objs, *args, **kwargs):
+        objs = bulk_create(self, objs, *args, **kwargs)
+        if self.model in (Url, PageUrl):  # 主キーを返さないDBと同様にする
+            for obj in objs:
+                obj.pk = None
+        return objs
+
+    monkeypatch.setattr(QuerySet, "bulk_create", without_pk)
+    writer = BufferedArticleWriter(batch_size=100, flush_interval=1000)
+    for i in range(3):
+        writer.add("http://a.jp/{}".format(i), pages("http://a.jp/{}".format(i), i + 1))
+    writer.flush()
+
+    for i in range(3):
+        url = "http://a.jp/{}".format(i)
+        assert saved(url) == [(p.page, p.page_url, p.html) for p in pages(url, i + 1)]
+
+
+def test_writers_are_closed_at_exit_without_being_kept_alive(db):
+
+    writer = BufferedArticleWriter(batch_size=100, flush_interval=1000)
+    writer.add("http://a.jp/1", pages("http://a.jp/1"))
+    writer_module._close_all()
+    assert Url.objects.count() == 1
+
+    ref = weakref.ref(writer)
+    del writer
+    gc.collect()
+    assert ref() == None